@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+#
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This file is installed as $(prefix)/bin/gnutrition-batch
+
+import sys, os
+
+# The package is in $(prefix)/share/gnutrition, found from this file and
+# not the current directory, so relative file arguments keep their meaning.
+# Run from the source tree the package is next to this file.
+bindir = os.path.dirname(os.path.abspath(__file__))
+pkgdir = os.path.join(os.path.dirname(bindir), 'share', 'gnutrition')
+if not os.path.isdir(os.path.join(pkgdir, 'src')):
+    pkgdir = bindir
+sys.path.append(pkgdir)
+
+import src.batch
+sys.exit(src.batch.main())
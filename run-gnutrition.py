@@ -26,3 +26,4 @@ a=os.path.abspath('.')
 sys.path.append(os.path.abspath(a))
 
 import src.run_app
+src.run_app.run_app()
@@ -19,25 +19,38 @@ import gtk
 
 import config
 import base_win_ui
-import plan_win
-import recipe_win
-import food_win
+from util.trace import span
 
 class BaseWin:
+    # attribute -> (module, class) of each view
+    VIEWS = {'plan': ('plan_win', 'PlanWin'),
+             'recipe': ('recipe_win', 'RecipeWin'),
+             'food': ('food_win', 'FoodWin')}
+
     def __init__(self, app):
         self.app = app
         self.ui = base_win_ui.BaseWinUI()
-
-        self.plan = plan_win.PlanWin(app, self.ui.win)
-        self.recipe = recipe_win.RecipeWin(app, self.ui.win)
-        self.food = food_win.FoodWin(app, self.ui.win)
-
-        self.pack_view(self.plan.ui)
-        self.pack_view(self.recipe.ui)
-        self.pack_view(self.food.ui)
-
+        self.views = []
         self.connect_signals()
 
+    def __getattr__(self, name):
+        # A view is only built when first used, by a button or menu item
+        # or another window, so startup builds just the one shown.
+        if name in self.VIEWS:
+            return self.build_view(name)
+        raise AttributeError(name)
+
+    def build_view(self, name):
+        (module_name, class_name) = self.VIEWS[name]
+        with span('build ' + class_name):
+            module = __import__(module_name)
+            view = getattr(module, class_name)(self.app, self.ui.win)
+            self.pack_view(view.ui)
+            self.hide_view(view.ui)
+        self.__dict__[name] = view
+        self.views.append(view)
+        return view
+
     def pack_view(self, view):
         self.ui.pane_box.pack_start(view.pane, True, True, 0)
         self.ui.menubar_box.pack_start(view.menubar_box,
@@ -62,22 +75,22 @@ class BaseWin:
         else:
             self.on_recipe_button_released(None)
 
+    def switch_to(self, view):
+        for other in self.views:
+            if other is not view:
+                self.hide_view(other.ui)
+        self.show_view(view.ui)
+
     def on_plan_button_released(self, w, d=None):
-        self.hide_view(self.food.ui)
-        self.hide_view(self.recipe.ui)
-        self.show_view(self.plan.ui)
+        self.switch_to(self.plan)
         config.set_key_value('Page', 'Plan')
 
     def on_recipe_button_released(self, w, d=None):
-        self.hide_view(self.plan.ui)
-        self.hide_view(self.food.ui)
-        self.show_view(self.recipe.ui)
+        self.switch_to(self.recipe)
         config.set_key_value('Page', 'Recipe')
 
     def on_food_button_released(self, w, d=None):
-        self.hide_view(self.plan.ui)
-        self.hide_view(self.recipe.ui)
-        self.show_view(self.food.ui)
+        self.switch_to(self.food)
         config.set_key_value('Page', 'Food')
 
     def on_destroy(self, w, d=None):
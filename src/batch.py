@@ -0,0 +1,415 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""gnutrition-batch: nutrient analysis without the GUI.
+
+Results are written as JSON, one object per line. Work is spread over a
+pool of worker processes, each with its own connection to the database.
+
+  gnutrition-batch [options] recipes [RECIPE_NO ...]
+      Nutrient totals per serving for the given recipes, or all recipes.
+
+  gnutrition-batch [options] plans --start YYYY-MM-DD --end YYYY-MM-DD
+                   [--avg] [PERSON_NO ...]
+  gnutrition-batch [options] plans [--avg] --ranges FILE
+      Nutrient totals and percent of nutrient goals of the saved food plan
+      of each person (all persons if none given) between two dates
+      inclusive. With --ranges each line of the CSV file FILE gives
+        person_no, start date, end date
+
+  gnutrition-batch [options] rdi [--set SET_NO] FILE
+      Recommended daily intakes for each line of the CSV file FILE
+      (use '-' for standard input) with the columns:
+        id, age, weight (kg), female, pregnant, lactating
+      These are computed together in this process.
+
+  gnutrition-batch [options] goals [--set SET_NO]
+      Load RDI reference sets of a new release into the database, then
+      recompute the nutrient goals of every person from the active set,
+      making SET_NO the active set if given.
+
+  gnutrition-batch [options] export [--format html|csv|json]
+                   [--category CATEGORY_NO]
+      Every recipe, or the recipes of one category, with ingredients,
+      preparation and nutrients per serving, as one document.
+
+  gnutrition-batch [options] export-data [--format csv|json]
+                   [--person PERSON_NO] DIR
+      Recipes, food and recipe plans and nutrient goals, to the directory
+      DIR, one file per table: '^' separated text as the SR data (csv,
+      the default) or JSON Lines (json). With --person only the plans and
+      goals of that person.
+
+  gnutrition-batch [options] import-data [--person PERSON_NO] DIR
+      Add the data of an export-data directory to the database. With
+      --person the plans and goals, which must be of one person (see
+      export-data --person), are given to PERSON_NO. An interrupted
+      import continues where it stopped when run again.
+
+  gnutrition-batch [options] upgrade-db
+      Bring a database made by an older version up to date: duplicate
+      nutrient goals of a person are deleted, keeping the last saved, and
+      RDI reference sets of a new release are loaded. Needed once before
+      import-data.
+
+  gnutrition-batch [options] upgrade-sr ARCHIVE
+      Upgrade the USDA SR data to the release in the zip file or
+      directory ARCHIVE, writing only the rows that changed. Recipe
+      ingredients and plan entries whose food or measure was removed are
+      listed in table obsolete_ref.
+
+  gnutrition-batch [options] facets CODE [CODE ...]
+      Foods described by every one of the LanguaL factor codes given,
+      for example A0113 (spice or herb).
+"""
+import sys
+import json
+from optparse import OptionParser
+import database
+import engine
+
+# Set in each worker process by _init_worker()
+_db = None
+_nutr_nums = None
+
+# Reference data for plan_job(). Loaded once in the parent by
+# analyze_plans() and inherited by forked workers.
+_foods = None
+_goals = None
+
+def _init_worker(dbfile):
+    """Open this process' own read-only database connection.
+
+    A worker forked after the parent opened the database must not use the
+    parent's connection, so the shared state is dropped first.
+    """
+    global _db, _nutr_nums, _foods
+    database.Database._shared_state.clear()
+    _db = database.Database(dbfile, readonly=True)
+    _nutr_nums = engine.nutr_num_list(_db)
+    if _foods is None:
+        _foods = engine.FoodData(_db)
+    else:
+        _foods.db = _db     # for foods not loaded by the parent
+
+def recipe_job(recipe_no):
+    try:
+        totals = engine.stored_recipe_totals(_db, recipe_no, _nutr_nums)
+    except engine.EngineError, e:
+        return {'recipe_no': recipe_no, 'error': ' '.join(e.ebuf)}
+    return {'recipe_no': recipe_no, 'nutrients': dict(totals)}
+
+def plan_job(args):
+    (person_no, start_date, end_date, avg) = args
+    try:
+        totals = engine.plan_totals(_db, start_date, end_date, avg,
+                                    person_no=person_no, nutr_nums=_nutr_nums,
+                                    foods=_foods)
+    except engine.EngineError, e:
+        return {'person_no': person_no, 'error': ' '.join(e.ebuf)}
+    if _goals is not None and person_no in _goals:
+        goal_list = _goals[person_no]
+    else:
+        goal_list = engine.nutr_goal(_db, person_no)
+    return {'person_no': person_no, 'start': start_date, 'end': end_date,
+            'nutrients': dict(totals),
+            'pcnt_goal': dict(engine.pcnt_nutr_goal(totals, goal_list))}
+
+def analyze_plans(ranges, avg=False, dbfile=None, processes=None):
+    """Compute plan totals and percent of goals for many persons.
+
+    Parameter ranges is a list of (person_no, start_date, end_date). The
+    nutrients and weights of every food in the plans, and the goals of the
+    persons, are read once here and shared with the worker processes. The
+    ranges are split evenly over the workers, each of which uses its own
+    read-only connection.
+
+    Return a list of dictionaries in the order of ranges.
+    """
+    global _foods, _goals
+    person_nos = list(set([r[0] for r in ranges]))
+    db = database.Database(dbfile, readonly=True)
+    _foods = engine.FoodData(db)
+    _foods.load(engine.plan_foods(db, person_nos))
+    _goals = engine.nutr_goals(db, person_nos)
+    db.close()
+    database.Database._shared_state.clear()
+    jobs = [(p, start, end, avg) for p, start, end in ranges]
+    return run_jobs(plan_job, jobs, dbfile, processes)
+
+def compute_rdis(persons, dbfile=None, set_no=None):
+    """RDIs of (id, age, weight, female, pregnant, lactating) tuples."""
+    import calc_rdi
+    ref = calc_rdi.ReferenceSet(database.Database(dbfile, readonly=True),
+                                set_no)
+    columns = zip(*persons)
+    rows = calc_rdi.compute_many(*(columns[1:] + [ref]))
+    return [{'id': ident, 'nutrients': dict(zip(ref.nutr_nos, row))}
+            for ident, row in zip(columns[0], rows)]
+
+def recompute_goals(dbfile=None, set_no=None):
+    """Recompute every person's goals, after activating set_no if given.
+
+    Reference sets of the installed data files not yet in the database are
+    loaded first.
+    """
+    import calc_rdi
+    db = database.Database(dbfile)
+    db.init_rdi()
+    if set_no is None:
+        count = calc_rdi.recompute_goals(db)
+        set_no = calc_rdi.active_set(db)
+    else:
+        count = calc_rdi.activate_set(db, set_no)
+    return [{'set_no': set_no, 'persons': count}]
+
+def export(dbfile, output, fmt, category_no=None):
+    """Write recipes to output ('-' for standard output) with save_as."""
+    import save_as
+    db = database.Database(dbfile, readonly=True)
+    out = sys.stdout if output == '-' else open(output, 'w')
+    try:
+        (exported, failed) = save_as.export_recipes(db, out, fmt, category_no)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    sys.stderr.write('{0:d} recipes exported, {1:d} left out\n'.format(
+        exported, failed))
+    return 0
+
+def transfer(dbfile, command, dirname, person_no=None, fmt='csv'):
+    """Run command 'export-data' or 'import-data' with transfer.
+
+    The format fmt of an export is read from its manifest on import.
+    """
+    import transfer
+    db = database.Database(dbfile)
+    if command == 'export-data':
+        counts = transfer.export_data(db, dirname, person_no, fmt)
+        sys.stderr.write(', '.join(['{0:d} {1:s}'.format(counts[t], t)
+            for t, columns in transfer.TABLES]) + ' rows exported\n')
+    else:
+        stats = transfer.import_data(db, dirname, person_no)
+        sys.stderr.write('{imported:d} rows imported, {skipped:d} left ' \
+            'out, {obsolete:d} obsolete foods\n'.format(**stats))
+    return 0
+
+def upgrade_db(dbfile):
+    """Run the schema and data upgrades of the database, see main()."""
+    db = database.Database(dbfile)
+    removed = db.index_nutr_goal()
+    db.init_rdi()
+    return [{'duplicate_goals_deleted': removed}]
+
+def upgrade_sr(dbfile, source):
+    """Upgrade the SR data with sr_upgrade, one JSON line per table."""
+    import sr_upgrade
+    db = database.Database(dbfile)
+    stats = sr_upgrade.upgrade(db, source)
+    results = [{'table': table, 'added': stats[table][0],
+                'changed': stats[table][1], 'removed': stats[table][2]}
+               for table, key in sr_upgrade.SR_TABLES]
+    obsolete = stats['obsolete']
+    sys.stderr.write('{0:d} ingredients and {1:d} food plan entries refer ' \
+        'to removed foods or measures, see table obsolete_ref\n'.format(
+        obsolete['ingredient'], obsolete['food_plan']))
+    return results
+
+def facet_foods(dbfile, codes):
+    """Return NDB_No and Long_Desc of the foods having every facet code."""
+    import sr_extra
+    db = database.Database(dbfile)
+    found = sorted(sr_extra.facet_index(db).search(codes))
+    results = []
+    for i in range(0, len(found), 500):
+        chunk = found[i:i+500]
+        db.query("SELECT NDB_No, Long_Desc FROM food_des " +
+            "WHERE NDB_No IN ({0:s}) ORDER BY NDB_No".format(
+            ', '.join(['?'] * len(chunk))), sql_params=chunk)
+        results.extend([{'NDB_No': num, 'Long_Desc': desc}
+                        for num, desc in db.get_result() or ()])
+    return results
+
+def run_jobs(func, jobs, dbfile, processes=None):
+    """Run func over each item of jobs in a process pool.
+
+    Results are returned in the order of jobs. With processes 1 everything
+    runs in this process.
+    """
+    if processes == 1:
+        _init_worker(dbfile)
+        return map(func, jobs)
+    from multiprocessing import Pool, cpu_count
+    if not processes:
+        processes = cpu_count()
+    # One shard of about equal size per worker
+    chunksize = max(1, (len(jobs) + processes - 1) / processes)
+    pool = Pool(processes, _init_worker, (dbfile,))
+    try:
+        return pool.map(func, jobs, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+def _all_numbers(dbfile, sql):
+    db = database.Database(dbfile)
+    db.query(sql)
+    numbers = [row[0] for row in db.get_result() or ()]
+    db.close()
+    database.Database._shared_state.clear()
+    return numbers
+
+def _read_csv(fn):
+    """Return rows of CSV file fn ('-' for stdin), skipping # comments."""
+    import csv
+    f = sys.stdin if fn == '-' else open(fn, 'r')
+    rows = [row for row in csv.reader(f)
+            if row and not row[0].startswith('#')]
+    if f is not sys.stdin:
+        f.close()
+    return rows
+
+def _read_rdi_file(fn):
+    jobs = []
+    for row in _read_csv(fn):
+        ident, age, weight = row[0], float(row[1]), float(row[2])
+        female, preg, lac = [int(v) for v in row[3:6]]
+        jobs.append((ident, age, weight, female, preg, lac))
+    return jobs
+
+def _date(text):
+    """Return date text as YYYY-MM-DD, as dates are stored in the plans.
+
+    Raise ValueError if it is not a date.
+    """
+    import datetime
+    try:
+        return datetime.datetime.strptime(text.strip(),
+                                          '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise ValueError("'{0:s}' is not a date (YYYY-MM-DD)".format(text))
+
+def _plan_range(person_no, start, end):
+    """Return a checked (person_no, start_date, end_date) for plan_job().
+
+    Raise ValueError if a date is wrong or end is before start.
+    """
+    start, end = _date(start), _date(end)
+    if end < start:
+        raise ValueError('end date {0:s} is before start date {1:s}'.format(
+            end, start))
+    return (int(person_no), start, end)
+
+def main(argv=None):
+    parser = OptionParser(usage=__doc__.split('\n\n', 1)[1].rstrip())
+    parser.add_option('--db', dest='dbfile', default=None,
+        help='SQLite database file (default ~/.gnutrition/gnutr_db.lt3)')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=None,
+        help='number of worker processes (default: number of CPUs)')
+    parser.add_option('-o', '--output', dest='output', default='-',
+        help='write results to this file instead of standard output')
+    parser.add_option('--start', dest='start', help='plan start date')
+    parser.add_option('--end', dest='end', help='plan end date')
+    parser.add_option('--avg', dest='avg', action='store_true', default=False,
+        help='divide plan totals by the number of days')
+    parser.add_option('--ranges', dest='ranges',
+        help='CSV file of person_no, start date, end date')
+    parser.add_option('--set', dest='set_no', type='int', default=None,
+        help='RDI reference set (default: the active set)')
+    parser.add_option('--format', dest='format', default=None,
+        choices=['html', 'csv', 'json'],
+        help='export format: html, csv or json (default html, csv for ' \
+             'export-data)')
+    parser.add_option('--category', dest='category', type='int',
+        default=None, help='export only recipes of this category number')
+    parser.add_option('--person', dest='person', type='int', default=None,
+        help='person_no of the plans and goals to export or import')
+    (opts, args) = parser.parse_args(argv)
+    if not args:
+        parser.error('a command is required')
+
+    from util.log import initLogger
+    initLogger(logLevel='warn', logDisk=False, logConsole=True)
+
+    command, args = args[0], args[1:]
+    if command == 'recipes':
+        func = recipe_job
+        jobs = [int(a) for a in args] or _all_numbers(opts.dbfile,
+            "SELECT recipe_no FROM recipe ORDER BY recipe_no")
+    elif command == 'plans':
+        if opts.ranges:
+            ranges = []
+            for i, row in enumerate(_read_csv(opts.ranges)):
+                try:
+                    if len(row) < 3:
+                        raise ValueError('person_no, start date and end ' \
+                                         'date are required')
+                    ranges.append(_plan_range(*row[:3]))
+                except ValueError, e:
+                    parser.error('{0:s} row {1:d}: {2!s}'.format(
+                        opts.ranges, i + 1, e))
+        elif opts.start and opts.end:
+            try:
+                (p, start, end) = _plan_range(0, opts.start, opts.end)
+            except ValueError, e:
+                parser.error(str(e))
+            persons = [int(a) for a in args] or _all_numbers(opts.dbfile,
+                "SELECT person_no FROM person ORDER BY person_no")
+            ranges = [(p, start, end) for p in persons]
+        else:
+            parser.error('plans needs --start and --end, or --ranges')
+        results = analyze_plans(ranges, opts.avg, opts.dbfile, opts.jobs)
+    elif command == 'rdi':
+        if len(args) != 1:
+            parser.error('rdi needs one CSV file')
+        persons = _read_rdi_file(args[0])
+        results = persons and compute_rdis(persons, opts.dbfile, opts.set_no)
+    elif command == 'goals':
+        results = recompute_goals(opts.dbfile, opts.set_no)
+    elif command == 'export':
+        return export(opts.dbfile, opts.output, opts.format or 'html',
+                      opts.category)
+    elif command in ('export-data', 'import-data'):
+        if len(args) != 1:
+            parser.error('{0:s} needs one directory'.format(command))
+        if opts.format == 'html':
+            parser.error('--format of {0:s} is csv or json'.format(command))
+        return transfer(opts.dbfile, command, args[0], opts.person,
+                        opts.format or 'csv')
+    elif command == 'upgrade-db':
+        results = upgrade_db(opts.dbfile)
+    elif command == 'upgrade-sr':
+        if len(args) != 1:
+            parser.error('upgrade-sr needs one archive or directory')
+        results = upgrade_sr(opts.dbfile, args[0])
+    elif command == 'facets':
+        if not args:
+            parser.error('facets needs at least one factor code')
+        results = facet_foods(opts.dbfile, args)
+    else:
+        parser.error('unknown command {0:s}'.format(command))
+
+    if command == 'recipes':
+        results = run_jobs(func, jobs, opts.dbfile, opts.jobs)
+    out = sys.stdout if opts.output == '-' else open(opts.output, 'w')
+    for result in results:
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+    if out is not sys.stdout:
+        out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
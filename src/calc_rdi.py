@@ -18,7 +18,20 @@
 
 # Ian's code to compute the RDIs
 
-# General RDI tables 
+# The RDI tables are in the database, see Database.init_rdi(). Several
+# reference sets can be loaded side by side; the one marked active in table
+# rdi_set is used unless another is asked for. The sets are loaded by the
+# setup druid and by 'gnutrition-batch goals'; nothing here writes them.
+#
+# rdi_set: (set_no, set_desc, version, active)
+# rdi_nutr: (set_no, Nutr_No, by_weight, pregnancy, lactation)
+#   If by_weight is 1 the values are per kg of body weight. The pregnancy
+#   and lactation values are added for pregnant and lactating women.
+# rdi: (set_no, Nutr_No, sex, age_lower, value)
+#   sex is 0 for men, 1 for women. A value applies from age_lower up to the
+#   next age_lower of the same Nutr_No and sex.
+#
+# Set 1 is from data/RDI*.txt:
 # Reference: Bender, D.A. and Bender, A.E., `Nutrition: a reference handbook'
 # 1st ed., Oxford University Press, 1997, ISBN 0-19-262368-0. All page numbers
 # are for this book 
@@ -26,7 +39,11 @@
 # a choice, and the lower value is generally chosen where a range is
 # given.
 # FIXME: more data on cholesterol, fatty acids and fibre
-# FIXME: wouldn't it be better to put all this into a database table?
+
+from bisect import bisect_right
+from util.exception import AppException
+
+class RDIError(AppException): pass
 
 factor = {
     'CHO': 2, 'FAT': 1, 'ENERGY': 9, 'SUGAR': 10, 'M_UNSAT_FAT': 76,
@@ -44,178 +61,200 @@ factor = {
 # dependent upon the age and sex. (pg 82) The BMR is converted into energy
 # requirements by a fourth variable C, also age- and sex-dependent (pg 89)*/
 #
-# energy_dict = {key: value}
-# value = [(age, male, female)]
-energy_dict = { 
-    'child': [ (0, 410, 410), (1, 414, 431), (2, 414, 406), 
-        (3, 393, 377), (4, 377, 364), (5, 364, 352), (6, 352, 331),
-        (7, 331, 301), (8, 306, 276), (9, 285, 247)],
-    'A': [(10, 0.0732, 0.0510), (18, 0.0640, 0.0615), (30, 0.0485, 0.0364),
-        (60, 0.0565, 0.0439)],
-    'B': [(10, 2.72, 3.12), (18, 2.84, 2.08), (30, 3.67, 3.47),
-        (60, 2.04, 2.49)],
-    'C': [(10, 1.74, 1.59), (11, 1.67, 1.55), (12, 1.61, 1.51), 
-        (13, 1.56, 1.47), (14, 1.49, 1.46), (15, 1.44, 1.47), 
-        (16, 1.40, 1.48), (17, 1.40, 1.50), (18, 1.41, 1.42), 
-        (60, 1.40, 1.40)] 
-}
+# These are the rdi rows with Nutr_No energy_child, energy_A, energy_B and
+# energy_C.
+energy_keys = ('energy_child', 'energy_A', 'energy_B', 'energy_C')
 
+# Nutrients computed from energy intake: (Nutr_No, fraction, factor key)
+energy_fractions = [
+    ('269', 0.1, 'EN_CHO'),     # sugar
+    ('204', 0.3, 'EN_FAT'),     # total fat
+    ('606', 0.1, 'EN_FAT'),     # saturated
+    ('645', 0.1, 'EN_FAT'),     # mono-unsaturated
+    ('646', 0.1, 'EN_FAT'),     # poly-unsaturated
+    ('618', 0.01, 'EN_FAT'),    # 18:2
+    ('619', 0.002, 'EN_FAT'),   # 18:3
+    ('205', 0.53, 'EN_CHO')]    # carbohydrate
 
-# rdi_dict = {key: value}
-# key = Nutr_No
-# value =  (by_weight, pregnancy, lactation, [(age, male, female)])
-rdi_dict = {
-    203: (1, 6, 17.5,
-        [ (0.3, 1.85, 1.85), (0.58, 1.65, 1.65), (0.83, 1.48, 1.48),
-            (1.0, 1.26, 1.26), (1.5, 1.17, 1.17), (2, 1.13, 1.13),
-            (3, 1.09, 1.09), (4, 1.06, 1.06), (5, 1.02, 1.02),
-            (6, 1.01, 1.01), (9, 0.99, 0.99), (10, 0.99, 1),
-            (11, 0.98, 0.98), (12, 1, 0.96), (13, 0.97, 0.94),
-            (14, 0.96, 0.90), (15, 0.92, 0.87), (16, 0.90, 0.83),
-            (17, 0.86, 0.80), (18, 0.75, 0.75)] ),
-    291: (0, 0, 0,
-        [ (18, 30, 30)] ),
-    301: (0, 400, 400,
-        [ (0, 400, 400), (0.5, 600, 600), (1, 800, 800), 
-            (11, 1200, 1200), (25, 800, 800) ]),
-    303: (0, 15, 0,
-        [ (0, 6, 6), (0.5, 10, 10), (11, 12, 15), 
-            (19, 10, 15), (51, 10, 10) ]),
-    304: (0, 40, 75,
-        [ (0, 40, 40), (0.5, 60, 60), (1, 80, 80), (4, 120, 120),
-            (7, 170, 170), (11, 270, 280), (15, 400, 300), (19, 350, 280) ]),
-    305: (0, 400, 400,
-        [ (0, 300, 300), (0.5, 500, 500), (1, 800, 800), (11, 1200, 1200),
-            (25, 800, 800)]),
-    306: (0, 0, 0,
-        [ (0, 500, 500), (0.5, 700, 700), (1, 1000, 1000), (2, 1400, 1400),
-            (6, 1600, 1600), (10, 2000, 2000)]),
-    307: (0, 0, 0, 
-        [ (0, 120, 120), (0.5, 200, 200), (1, 225, 225), (2, 300, 300),
-            (6, 400, 400), (10, 500, 500)]),
-    309: (0, 3, 7,
-        [ (0, 5, 5), (1, 10, 10), (11, 15, 12)]),
-    312: (0, 0, 0.3,
-        [ (0, 0.4, 0.4), (0.5, 0.6, 0.6), (1, 0.7, 0.7), (4, 1.0, 1.0),
-                         (11, 1.5, 1.5)]),
-    315: (0, 0, 0, 
-        [(0, 0.3, 0.3), (0.5, 0.6, 0.6), (1, 0.7, 0.7), (4, 1.0, 1.0),
-                         (11, 1.5, 1.5)]),
-    317: (0, 10, 20, 
-        [(0, 10, 10), (0.5, 15, 15), (1, 20, 20), (7, 30, 30),
-                         (11, 40, 45), (15, 50, 50), (19, 70, 55)]),
-    392: (0, 0, 500,
-        [(0, 375, 365), (1, 400, 400), (4, 500, 500), (7, 700, 700),
-                         (11, 1000, 800)]),
-    394: (0, 2, 2,
-        [(0, 3, 3), (0.5, 4, 4), (1, 6, 6), (4, 7, 7), (11, 10, 8)]),
-    401: (0, 10, 35,
-        [(0, 30, 30), (0.5, 35, 35), (1, 40, 40), (4, 45, 45),
-                         (11, 50, 50), (15, 60, 60)]),
-    404: (0, 0.4, 0.5,
-        [(0, 0.3, 0.3), (0.5, 0.4, 0.4), (1, 0.7, 0.7), (4, 0.9, 0.9),
-            (7, 1.0, 1.0), (11, 1.3, 1.1), (15, 1.5, 1.1), (51, 1.2, 1.1),
-            (-1, 0, 0)]),
-    405: (0, 0.3, 0.5,
-        [(0, 0.4, 0.4), (0.5, 0.5, 0.5), (1, 0.8, 0.8), (4, 1.1, 1.1),
-            (7, 1.2, 1.2), (11, 1.5, 1.3), (15, 1.8, 1.3), (19, 1.7, 1.3),
-            (51, 1.4, 1.3)]),
-    406: (0, 2, 5,
-        [(0, 5, 5), (0.5, 6, 6), (1, 9, 9), (4, 12, 12), (7, 13, 13),
-            (11, 17, 15), (15, 20, 15), (19, 19, 15), (51, 15, 13)]),
-    410: (0, 0, 0,
-        [(0, 2, 2), (0.5, 3, 3), (7, 4, 4)]),
-    415: (0, 0.6, 0.5,
-        [(0, 0.3, 0.3), (0.5, 0.5, 0.5), (1, 0.7, 0.7), (4, 1.1, 1.1),
-            (7, 1.4, 1.4), (11, 1.7, 1.4), (15, 2.0, 1.5), (19, 2.0, 1.6)]),
-    417: (0, 220, 100,
-        [(0, 25, 25), (0.5, 35, 35), (1, 50, 50), (4, 75, 75),
-            (7, 100, 100), (11, 150, 150), (15, 200, 180)]),
-    418: (0, 0.2, 0.6,
-        [(0, 0.3, 0.3), (0.5, 0.5, 0.5), (1, 0.7, 0.7), (4, 1, 1),
-            (7, 1.4, 1.4), (11, 2.0, 2.0)]),
-    501: (1, 0, 0,
-        [(0.25, 17, 17), (2, 12.5, 12.5), (10, 3.5, 3.5)]),
-    502: (1, 0, 0,
-        [(0.25, 87, 87), (2, 37, 37), (10, 28, 28), (18, 7, 7)]),
-    503: (1, 0, 0,
-        [(0.25, 70, 70), (2, 31, 31), (10, 28, 28), (18, 10, 10)]),
-    504: (1, 0, 0,
-        [(0.25, 161, 161), (2, 73, 73), (10, 44, 44), (18, 14, 14)]),
-    505: (1, 0, 0,
-        [(0.25, 103, 103), (2, 64, 64), (10, 44, 44), (18, 12, 12)]),
-    506: (1, 0, 0,
-        [(0.25, 58, 58), (2, 27, 27), (10, 22, 22), (18, 13, 13)]),
-    508: (1, 0, 0,
-        [(0.25, 125, 125), (2, 69, 69), (10, 22, 22), (18, 14, 14)]),
-    510: (1, 0, 0,
-        [(0.25, 93, 93), (2, 38, 38), (10, 25, 25), (18, 10, 10)]),
-    512: (1, 0, 0,
-        [(0, 8, 8)]),
-    601: (0, 0, 0,
-        [(18, 300, 300)]) 
-}
+def check_sets(db):
+    """Raise RDIError unless the RDI tables have been created in db."""
+    db.query("SELECT count(*) FROM sqlite_master " +
+             "WHERE type = 'table' AND name = 'rdi_set'")
+    if not db.get_single_result():
+        raise RDIError("No RDI reference sets in the database. Run " +
+                       "'gnutrition-batch goals' to load them.")
+
+def active_set(db):
+    """Return the set_no of the active reference set."""
+    check_sets(db)
+    db.query("SELECT set_no FROM rdi_set WHERE active = 1")
+    set_no = db.get_single_result()
+    if set_no is None:
+        raise RDIError('No active RDI reference set.')
+    return set_no
+
+def reference_sets(db):
+    """Return a list of (set_no, set_desc, version, active)."""
+    check_sets(db)
+    db.query("SELECT set_no, set_desc, version, active FROM rdi_set " +
+             "ORDER BY set_no")
+    return db.get_result() or []
+
+class ReferenceSet:
+    """The RDI tables of one reference set, ready for computation.
+
+    Each table is a pair of lists (ages, values), ages ascending, so the
+    value for an age is found with a binary search.
+    """
+    def __init__(self, db, set_no=None):
+        check_sets(db)
+        if set_no is None:
+            set_no = active_set(db)
+        self.set_no = set_no
+        self.tables = {}        # (Nutr_No, sex) -> (ages, values)
+        db.query("SELECT Nutr_No, sex, age_lower, value FROM rdi " +
+                 "WHERE set_no = ? ORDER BY Nutr_No, sex, age_lower",
+                 sql_params=(set_no,))
+        for num, sex, age, value in db.get_result() or ():
+            ages, values = self.tables.setdefault((num, sex), ([], []))
+            ages.append(age)
+            values.append(value)
+        if not self.tables:
+            raise RDIError('No RDI reference set {0!r}'.format(set_no))
+        db.query("SELECT Nutr_No, by_weight, pregnancy, lactation " +
+                 "FROM rdi_nutr WHERE set_no = ?", sql_params=(set_no,))
+        nutr = sorted(db.get_result() or (), key=lambda row: int(row[0]))
+        self.rdi_nums = [row[0] for row in nutr]
+        self.by_weight = [row[1] == 1 for row in nutr]
+        self.by_mg = [int(row[0]) >= 501 and int(row[0]) <= 512
+                      for row in nutr]
+        self.pregnancy = [row[2] for row in nutr]
+        self.lactation = [row[3] for row in nutr]
+        # Cys and Met, can be interconverted by hepatic enzymes, so RDIs
+        # are issued for the total; likewise Phe and Tyr. The total is
+        # split evenly: (index of total, Nutr_No of the second)
+        self.halves = [(self.rdi_nums.index(num), other)
+                       for num, other in (('506', '507'), ('508', '509'))
+                       if num in self.rdi_nums]
+        # Column order of compute_many() rows
+        self.nutr_nos = (['268', '208'] + [f[0] for f in energy_fractions] +
+                         self.rdi_nums + [h[1] for h in self.halves])
+        self.en_fractions = [fraction / factor[key]
+                             for num, fraction, key in energy_fractions]
+        self.age_cache = {}
+
+    def value(self, num, age, female):
+        """Return the table value of Nutr_No num for age and sex.
+
+        For an age below the first age of the table the first value is used.
+        """
+        try:
+            (ages, values) = self.tables[(num, female)]
+        except KeyError:
+            raise RDIError('No RDI data for {0:s} in set {1!r}'.format(
+                num, self.set_no))
+        return values[max(bisect_right(ages, age) - 1, 0)]
+
+    def age_values(self, age, female):
+        """Values of every table for one age and sex."""
+        try:
+            return self.age_cache[(age, female)]
+        except KeyError:
+            pass
+        if age < 10:
+            energy = (self.value('energy_child', age, female),)
+        else:
+            energy = tuple([self.value(key, age, female)
+                            for key in energy_keys[1:]])
+        values = (energy,
+                  [self.value(num, age, female) for num in self.rdi_nums])
+        self.age_cache[(age, female)] = values
+        return values
+
+def reference_set(ref=None):
+    """Return ref or else the active ReferenceSet."""
+    if ref is not None:
+        return ref
+    import database
+    return ReferenceSet(database.Database())
+
+def compute_many(ages, weights, females, pregs, lacs, ref=None):
+    """Compute the RDIs of many persons.
+
+    The parameters are sequences of equal length, one item per person, with
+    the meaning of the parameters of compute(). Return a list with a row of
+    float values per person, in the order of the Nutr_No strings of
+    ref.nutr_nos. ref is a ReferenceSet, by default the active one.
+    """
+    ref = reference_set(ref)
+    offset = 2 + len(energy_fractions)
+    rows = []
+    for age, weight, female, preg, lac in zip(ages, weights, females,
+                                              pregs, lacs):
+        age = float(age)
+        weight = float(weight)
+        female = int(female == 1)
+        energy, values = ref.age_values(age, female)
+        if len(energy) == 1:
+            kj = energy[0] * 1000.0     # values in MJ, want kJ
+        else:
+            kj = (weight * energy[0] + energy[1]) * energy[2] * 1000.0
+        kcal = kj * factor['KJ2KCAL']
+        row = [kj, kcal] + [kcal * f for f in ref.en_fractions]
+        for i, value in enumerate(values):
+            if ref.by_weight[i]:
+                value = value * weight
+            if ref.by_mg[i]:
+                value = value / 1000.0
+            if preg == 1:
+                value = value + ref.pregnancy[i]
+            if lac == 1:
+                value = value + ref.lactation[i]
+            row.append(value)
+        for i, other in ref.halves:
+            row[offset + i] = row[offset + i] * 0.5
+        for i, other in ref.halves:
+            row.append(row[offset + i])
+        rows.append(row)
+    return rows
+
+def compute(age, weight, female, preg, lac, ref=None):
+    """Return a list of (Nutr_No, value) strings for one person."""
+    ref = reference_set(ref)
+    row = compute_many([age], [weight], [female], [preg], [lac], ref)[0]
+    return [(num, str(value)) for num, value in zip(ref.nutr_nos, row)]
+
+def save_person(db, person_no, age, weight, female, preg, lac):
+    """Keep the values the RDIs of person_no are computed from."""
+    db.query("INSERT OR REPLACE INTO person_rdi VALUES (?, ?, ?, ?, ?, ?)",
+             sql_params=(person_no, float(age), float(weight), int(female),
+                         int(preg), int(lac)))
+
+def recompute_goals(db, ref=None):
+    """Replace the nutrient goals of every person in table person_rdi.
+
+    Goals are computed from ref, by default the active reference set, and
+    written in one transaction, together with any statements already run
+    with commit=False. Return the number of persons updated.
+    """
+    if ref is None:
+        ref = ReferenceSet(db)
+    db.query("SELECT person_no, age, weight, female, pregnant, lactating " +
+             "FROM person_rdi ORDER BY person_no")
+    persons = db.get_result() or []
+    if not persons:
+        db.commit()
+        return 0
+    import engine
+    columns = zip(*persons)
+    rows = compute_many(*(columns[1:] + [ref]))
+    engine.save_goals(db, dict([(person_no, zip(ref.nutr_nos, row))
+                                for person_no, row in zip(columns[0], rows)]))
+    return len(persons)
 
-def lookup(age_data_list, age, gender):
-    for age_data, man_data, woman_data in age_data_list:
-        if age >= age_data:
-            if gender == 1:
-                value = woman_data
-            else:
-                value = man_data
-    return value
-    
-def normal_rdi(num, age, weight, female, preg, lac):
-    by_weight, pregnancy, lactation, age_data_list = rdi_dict[num]
-    value = lookup(age_data_list, age, female)
-    if by_weight == 1:
-        value = value * weight
-    if num >= 501 and num <= 512:
-        value = value/1000.0
-    if preg == 1:
-        value = value + pregnancy
-    if lac == 1:
-        value = value + lactation
-    return value
-
-def energy_intake(age, weight, female):
-    if age < 10:
-        value = lookup(energy_dict['child'], age, female)
-    else:
-        bmr = ((weight * lookup(energy_dict['A'], age, female)) +
-            lookup(energy_dict['B'], age, female))
-        value = bmr * lookup(energy_dict['C'], age, female)
-    value = value * 1000.0    # values in MJ, want kJ
-    return value
-
-def compute(age, weight, female, preg, lac):
-    rdi_list = []
-    energy = energy_intake(age, weight, female)
-    rdi_list.append(('268', str(energy)))                           # kj
-    energy = energy * factor['KJ2KCAL']
-    rdi_list.append(('208', str(energy)))                           # kcal
-    rdi_list.append(('269', str(0.1 * energy/ factor['EN_CHO'])))   # sugar
-    rdi_list.append(('204', str(0.3 * energy/ factor['EN_FAT'])))   # total
-    rdi_list.append(('606', str(0.1 * energy/ factor['EN_FAT'])))   # sat
-    rdi_list.append(('645', str(0.1 * energy/ factor['EN_FAT'])))   # non
-    rdi_list.append(('646', str(0.1 * energy/ factor['EN_FAT'])))   # poly
-    rdi_list.append(('618', str(0.01 * energy/ factor['EN_FAT'])))  # 18:2
-    rdi_list.append(('619', str(0.002 * energy/ factor['EN_FAT']))) # 18.3
-    rdi_list.append(('205', str(0.53 * energy/ factor['EN_CHO'])))  # carbs
-
-    # nutrients that are age, weight, or sex dependent
-    for key in rdi_dict.keys():
-        value = normal_rdi(key, age, weight, female, preg, lac)
-        rdi_list.append((str(key), str(value)))
-
-    # Cys and Met, can be interconverted by hepatic
-    # enzymes, so RDIs are issued for the total.
-    # meth and cyst
-    value = normal_rdi(506, age, weight, female, preg, lac)
-    rdi_list.append(('506', str(0.5 * value)))
-    rdi_list.append(('507', str(0.5 * value)))
-    # phen and tyro
-    value = normal_rdi(508, age, weight, female, preg, lac)
-    rdi_list.append(('508', str(0.5 * value)))
-    rdi_list.append(('509', str(0.5 * value)))
-    return rdi_list
+def activate_set(db, set_no):
+    """Make set_no the active reference set and recompute every goal."""
+    ref = ReferenceSet(db, set_no)
+    db.query("UPDATE rdi_set SET active = (set_no = ?)",
+             sql_params=(set_no,), commit=False)
+    return recompute_goals(db, ref)
@@ -16,8 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import shelve, install
-from os import environ, path, access, F_OK, mkdir, name
+import atexit, shelve, install
+from os import environ, path, access, F_OK, mkdir, name, remove, rename
 
 if name == 'nt':
 	home = environ['USERPROFILE']
@@ -33,32 +33,88 @@ if not access(udir, F_OK):
     mkdir(udir)
     mkdir(versiondir)
 
-def get_value(key):
-    db = shelve.open(fn, 'c')
-    try:
-        value = db[key]
-    except KeyError:
-        value = None
+# The config shelve is read once into _cache. Changes are written back
+# (write-behind) from an idle callback when a GLib main loop is running, and
+# always at exit. A flush writes a complete new shelve beside the old one and
+# renames it into place, so the config file is never left half written.
+_cache = None
+_dirty = False
+_flush_pending = False
+
+def _load():
+    global _cache
+    if _cache is None:
+        db = shelve.open(fn, 'c')
+        _cache = dict(db)
+        db.close()
+    return _cache
+
+def _shelve_files(base):
+    """Return files a shelve named 'base' may use, depending on dbm module."""
+    return [base + sfx for sfx in ('', '.db', '.dir', '.dat', '.bak')
+            if path.exists(base + sfx)]
+
+def flush():
+    """Write any changed values to the config file."""
+    global _dirty, _flush_pending
+    _flush_pending = False
+    if not _dirty:
+        return False
+    tmp = fn + '.new'
+    for f in _shelve_files(tmp):
+        remove(f)
+    db = shelve.open(tmp, 'n')
+    db.update(_cache)
     db.close()
-    return value
+    for f in _shelve_files(tmp):
+        target = fn + f[len(tmp):]
+        if name == 'nt' and path.exists(target):
+            remove(target)  # rename() will not replace a file on Windows
+        rename(f, target)
+    _dirty = False
+    return False    # Also removes the idle callback
+
+def _schedule_flush():
+    global _dirty, _flush_pending
+    _dirty = True
+    if _flush_pending:
+        return
+    try:
+        from gobject import idle_add
+    except ImportError:
+        return      # Written at exit
+    _flush_pending = True
+    idle_add(flush)
+
+atexit.register(flush)
+
+def discard():
+    """Forget cached values and any changes not yet written."""
+    global _cache, _dirty
+    _cache = None
+    _dirty = False
+
+def get_value(key):
+    return _load().get(key)
 
 def set_key_value(key, value):
-    db = shelve.open(fn)
-    db[key] = value
-    db.close()
+    cache = _load()
+    if key in cache and cache[key] == value:
+        return
+    cache[key] = value
+    _schedule_flush()
 
 def delete_entry(key):
-    db = shelve.open(fn)
-    if db.has_key[key]:
-        del db[key]
-    db.close()
+    cache = _load()
+    if key in cache:
+        del cache[key]
+        _schedule_flush()
 
 def keys():
     from util.utility import stdout
-    db = shelve.open(fn)
-    for key in db.keys():
-        stdout("{0:s}: {1!r}\n".format(key, db[key]))
-    db.close()
+    cache = _load()
+    for key in sorted(cache.keys()):
+        stdout("{0:s}: {1!r}\n".format(key, cache[key]))
 
 if __name__ == '__main__':
     print 'Current keys in', fn
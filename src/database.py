@@ -16,9 +16,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sqlite3 as dbms
 import datetime, time
-import re
+import logging
+import re, sys
+from bisect import bisect_right
+from os.path import basename
 import config
-from util.utility import stdout, stderr, func
+from util.utility import stdout, stderr
 from util.exception import AppException, AppFileReadError
 from util.log import LOG as log
 debug = log.debug
@@ -51,34 +54,42 @@ def leap_year(year):
         return True
     return False
 
-def days_since(start_year, datestr):
+# Ordinal day numbers are memoized by date string. A plan rarely spans more
+# than a few hundred distinct dates so the cache stays small.
+_ordinal_cache = {}
+
+def date_ordinal(datestr):
+    """Return the proleptic Gregorian ordinal of a YYYY-MM-DD date string.
+
+    January 1 of year 1 is day 1, as with datetime.date.toordinal().
     """
+    try:
+        return _ordinal_cache[datestr]
+    except KeyError:
+        pass
+    if not datestr:
+        raise Exception("Date string required.")
+    ymd = datestr.split('-')
+    if len(ymd) != 3:
+        raise Exception("Date string must be in YYYY-MM-DD format.")
+    try:
+        n = datetime.date(int(ymd[0]), int(ymd[1]), int(ymd[2])).toordinal()
+    except ValueError, e:
+        raise Exception("Invalid date '{0:s}': {1!s}".format(datestr, e))
+    _ordinal_cache[datestr] = n
+    return n
+
+def days_since(start_year, datestr):
+    """Return the number of days from January 1 of start_year to datestr.
+
+    Not inclusive- days_since(2012, '2012-01-01') is zero.
     """
     Y = int(start_year)
     # check for >= 1900 && < 2100
     c = Y/100
     if not c in [19,20]:
         raise Exception("Start year must be 1900 <= y < 2100")
-    if not datestr:
-        raise Exception("Date string required.")
-    #          J  F  M  A  M  J  J  A  S  O  N  D
-    days_in_month =  [31,28,31,20,31,30,31,31,30,31,30,31]
-    ymd = datestr.split('-')
-    if len(ymd) != 3:
-        raise Exception("Date string must be in YYYY-MM-DD format.")
-    Y,M,D = int(ymd[0]), int(ymd[1]), int(ymd[2])
-    days = 0
-    # Accumulate days since start_year, four years at a time, and adjust for leap year
-    for y in range(start_year, Y):
-        days = days + 365
-        if leap_year(y):
-            days = days + 1
-    if leap_year(Y):
-        days_in_month[1] = 29
-    for m in range(0, M-1):
-        days = days + days_in_month[m]
-    days = days + D
-    return days - 1  # Not inclusive- days_since(2012, 2012-01-01) is zero
+    return date_ordinal(datestr) - datetime.date(Y, 1, 1).toordinal()
 
 def to_days(datestr=None):
     # Replacement for MySQLs TO_DAYS() function:
@@ -86,6 +97,20 @@ def to_days(datestr=None):
     # days. The arbitrary starting point is January 1, 1900.
     return days_since(1900, datestr)
 
+def days_between(ranges):
+    """Return a list of inclusive day counts for (start, end) date pairs.
+
+    For example, per-week averages over a year can be computed from a single
+    call with 52 ranges. Both dates are YYYY-MM-DD strings; a range whose end
+    is the same as its start counts as one day.
+    """
+    return [date_ordinal(end) - date_ordinal(start) + 1
+            for start, end in ranges]
+
+def num_days(start_date, end_date):
+    """Return the inclusive number of days from start_date to end_date."""
+    return date_ordinal(end_date) - date_ordinal(start_date) + 1
+
 dbms.register_adapter(datetime.datetime, curtime)
 dbms.register_adapter(datetime.datetime, curdate)
 
@@ -93,29 +118,169 @@ def regexp(exp, text):
     """Define a function to be called when sqlite3 module sees 'REGEXP'"""
     return text is not None and re.search(exp, text) is not None
 
-class Database:
-    _shared_state = {}
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_fingerprints = {}
+
+def fingerprint(sql):
+    """Return sql with literals replaced by '?' and white space collapsed.
+
+    Statements built with format() differ only in their literal values;
+    they share a fingerprint so their timings are counted together. A
+    list of values such as IN (1, 2, 3) becomes (?+).
+    """
+    try:
+        return _fingerprints[sql]
+    except KeyError:
+        pass
+    fp = _literal_re.sub('?', ' '.join(sql.split()))
+    fp = _in_list_re.sub('(?+)', fp)
+    if len(_fingerprints) > 4096:
+        _fingerprints.clear()
+    _fingerprints[sql] = fp
+    return fp
+
+class QueryStats:
+    """Wall time and rows returned of SQL statements.
+
+    Timings are kept per statement fingerprint and per caller (module and
+    function calling Connection.query()), each with a histogram over the
+    millisecond limits in BUCKETS. Shared by all connections of a process.
+    """
+    BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+
     def __init__(self):
-        self.__dict__ = self._shared_state
-        if self._shared_state:
+        import threading
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.slow_ms = None
+        self.reset()
+
+    def configure(self):
+        """Read the settings from config, once per process."""
+        if self.slow_ms is not None:
             return
+        import gnutr_consts
+        enabled = config.get_value('query_stats')
+        if enabled is None:
+            enabled = gnutr_consts.QUERY_STATS
+        slow_ms = config.get_value('slow_query_ms')
+        if slow_ms is None:
+            slow_ms = gnutr_consts.SLOW_QUERY_MS
+        self.slow_ms = slow_ms
+        if enabled and not self.enabled:
+            import atexit
+            atexit.register(self.dump)
+        self.enabled = bool(enabled)
+
+    def reset(self):
+        self.by_sql = {}
+        self.by_caller = {}
+
+    def _add(self, table, key, ms, rows):
+        entry = table.get(key)
+        if entry is None:
+            # count, total ms, max ms, rows, histogram
+            entry = table[key] = [0, 0.0, 0.0, 0, [0] * (len(self.BUCKETS) + 1)]
+        entry[0] += 1
+        entry[1] += ms
+        if ms > entry[2]:
+            entry[2] = ms
+        entry[3] += rows
+        entry[4][bisect_right(self.BUCKETS, ms)] += 1
+
+    def add(self, sql, caller, ms, rows):
+        fp = fingerprint(sql)
+        self.lock.acquire()
+        try:
+            self._add(self.by_sql, fp, ms, rows)
+            self._add(self.by_caller, caller, ms, rows)
+        finally:
+            self.lock.release()
+
+    def report(self, limit=30):
+        """Return the statistics as text, most total time first."""
+        heads = ['<{0:d}'.format(b) for b in self.BUCKETS]
+        heads.append('>={0:d}'.format(self.BUCKETS[-1]))
+        lines = []
+        self.lock.acquire()
+        try:
+            for title, table in (('statement', self.by_sql),
+                                 ('caller', self.by_caller)):
+                lines.append('{0:>8s} {1:>10s} {2:>8s} {3:>8s} {4:>8s}  {5:s}'
+                    .format('count', 'total ms', 'mean ms', 'max ms', 'rows',
+                            ' '.join(['{0:>5s}'.format(h) for h in heads])))
+                entries = sorted(table.items(), key=lambda i: -i[1][1])
+                for key, (count, total, high, rows, hist) in entries[:limit]:
+                    lines.append(
+                        '{0:8d} {1:10.1f} {2:8.2f} {3:8.1f} {4:8d}  {5:s}'.format(
+                            count, total, total / count, high, rows,
+                            ' '.join(['{0:5d}'.format(n) for n in hist])))
+                    lines.append('    {0:s}: {1:s}'.format(title, key))
+                lines.append('')
+        finally:
+            self.lock.release()
+        return '\n'.join(lines)
+
+    def dump(self, fn=None):
+        """Write report() to fn, by default query_stats in the user's
+        directory."""
+        if not (self.by_sql or self.by_caller):
+            return
+        from os import path
+        if not fn:
+            fn = path.join(config.udir, 'query_stats')
+        try:
+            f = open(fn, 'w')
+            f.write(self.report())
+            f.close()
+        except IOError, e:
+            error('Could not write query statistics: {0!s}'.format(e))
+
+query_stats = QueryStats()
+
+class Connection:
+    """A connection to the SQLite database.
+
+    Most of the application uses Database, which shares one connection per
+    process. Separate Connection instances are for code that needs more
+    than one, such as ConnectionPool.
+    """
+    def __init__(self, dbfile=None, readonly=False, check_same_thread=True):
+        self._connect(dbfile, readonly, check_same_thread)
+
+    def _connect(self, dbfile, readonly, check_same_thread=True):
+        """Open dbfile, by default gnutr_db.lt3 in the user's directory.
+
+        A readonly connection refuses to modify the database (SQLite 3.8.0
+        and later).
+        """
         self.Error = dbms.Error
         from os import path
         self.user = config.user
-        dbfile =  path.join(config.udir, 'gnutr_db.lt3')
+        if not dbfile:
+            dbfile = path.join(config.udir, 'gnutr_db.lt3')
+        self.dbfile = dbfile
         try:
-            con = dbms.connect(dbfile)
+            con = dbms.connect(dbfile, check_same_thread=check_same_thread)
             # text_factory must be set to 'str' due to current limitations
             # in csv.reader()
             con.text_factory = str
             con.create_function('REGEXP', 2, regexp)
             con.create_function('TO_DAYS', 1, to_days)
+            con.create_function('DAYS_BETWEEN', 2, num_days)
             cur = con.cursor()
+            if readonly:
+                cur.execute("PRAGMA query_only = ON")
         except self.Error, e:
             "Error {0:s}:".format(e.args[0])
             raise self.Error
         self.con = con
         self.cur = cur
+        # True while statements run with commit=False are not committed
+        self.in_transaction = False
+        # Slow statements of the open transaction, explained after it ends
+        self.pending_explain = []
 
     def close(self): 
         if self.con:
@@ -302,6 +467,103 @@ class Database:
             "(person_no INTEGER NOT NULL, " +
             "Nutr_No TEXT NOT NULL, " +
             "goal_val REAL NOT NULL)", 'nutr_goal')
+        self.index_nutr_goal()
+
+    def index_nutr_goal(self):
+        """Keep one nutrient goal per (person_no, Nutr_No).
+
+        Databases made before the index was added may hold several goals
+        of a person for one nutrient; all but the last saved are deleted
+        and logged. Run by init_user() and by 'gnutrition-batch
+        upgrade-db'. Return the number of goals deleted.
+        """
+        self.query("SELECT COUNT(*) FROM sqlite_master " +
+            "WHERE type = 'index' AND name = 'nutr_goal_person_nutr'")
+        if self.get_single_result():
+            return 0
+        self.query("SELECT person_no, Nutr_No, goal_val FROM nutr_goal " +
+            "WHERE rowid NOT IN (SELECT MAX(rowid) FROM nutr_goal " +
+            "GROUP BY person_no, Nutr_No) ORDER BY person_no, Nutr_No")
+        removed = self.get_result() or ()
+        for person_no, num, val in removed:
+            warn("deleting duplicate goal of person {0!r} for nutrient " \
+                 "{1:s}: {2!r}".format(person_no, num, val))
+        self.query("DELETE FROM nutr_goal WHERE rowid NOT IN " +
+            "(SELECT MAX(rowid) FROM nutr_goal GROUP BY person_no, Nutr_No)",
+            commit=False)
+        self.query("CREATE UNIQUE INDEX nutr_goal_person_nutr " +
+            "ON nutr_goal (person_no, Nutr_No)")
+        info("created index 'nutr_goal_person_nutr', {0:d} duplicate goals " \
+             "deleted".format(len(removed)))
+        return len(removed)
+
+    def init_rdi(self):
+        """Create the RDI tables and load any reference set not yet loaded.
+
+        A reference set is kept in rdi_set, rdi_nutr and rdi, loaded from
+        the data files of the same names. Sets already in the database are
+        left alone so new sets can be added by later releases. The first
+        set loaded is made active. See calc_rdi.py.
+
+        Run by the setup druid and by 'gnutrition-batch goals', the places
+        the database is set up or upgraded; reading the RDI tables needs
+        neither write access nor the data files.
+        """
+        self.create_table("CREATE TABLE IF NOT EXISTS rdi_set" +
+            "(set_no INTEGER PRIMARY KEY NOT NULL, " +
+            "set_desc TEXT NOT NULL, " +
+            "version TEXT NOT NULL, " +
+            "active INTEGER NOT NULL DEFAULT 0)", 'rdi_set')
+        self.create_table("CREATE TABLE IF NOT EXISTS rdi_nutr" +
+            "(set_no INTEGER NOT NULL, " +
+            "Nutr_No TEXT NOT NULL, " +
+            "by_weight INTEGER NOT NULL, " +
+            "pregnancy REAL NOT NULL, " +
+            "lactation REAL NOT NULL, " +
+            "PRIMARY KEY (set_no, Nutr_No))", 'rdi_nutr')
+        self.create_table("CREATE TABLE IF NOT EXISTS rdi" +
+            "(set_no INTEGER NOT NULL, " +
+            "Nutr_No TEXT NOT NULL, " +
+            "sex INTEGER NOT NULL, " +
+            "age_lower REAL NOT NULL, " +
+            "value REAL NOT NULL)", 'rdi')
+        self.query("CREATE UNIQUE INDEX IF NOT EXISTS rdi_lookup " +
+            "ON rdi (set_no, Nutr_No, sex, age_lower)")
+        # The values nutrient goals of each person are computed from
+        self.create_table("CREATE TABLE IF NOT EXISTS person_rdi" +
+            "(person_no INTEGER PRIMARY KEY NOT NULL, " +
+            "age REAL NOT NULL, " +
+            "weight REAL NOT NULL, " +
+            "female INTEGER NOT NULL, " +
+            "pregnant INTEGER NOT NULL, " +
+            "lactating INTEGER NOT NULL)", 'person_rdi')
+
+        import csv
+        import install
+        from os import path
+        self.query("SELECT set_no FROM rdi_set")
+        loaded = set([row[0] for row in self.get_result() or ()])
+        for table_name, marks in (('rdi_set', '?, ?, ?, 0'),
+                                  ('rdi_nutr', '?, ?, ?, ?, ?'),
+                                  ('rdi', '?, ?, ?, ?, ?')):
+            data_fn = path.join(install.idir, 'data', table_name.upper() + '.txt')
+            try:
+                data = [row for row in csv.reader(open(data_fn, 'r'),
+                            delimiter='^', quotechar="'")
+                        if row and int(row[0]) not in loaded]
+            except Exception, e:
+                e = AppFileReadError(e)
+                e = e + "Failed to read data file '{0:s}'".format(data_fn)
+                raise e
+            if data:
+                self.query("INSERT INTO {0:s} VALUES ({1:s})".format(
+                        table_name, marks), many=True, sql_params=data,
+                        commit=False)
+                info("loaded {0:d} rows into '{1:s}'".format(len(data),
+                                                             table_name))
+        self.query("UPDATE rdi_set SET active = 1 WHERE set_no = " +
+            "(SELECT MIN(set_no) FROM rdi_set) AND NOT EXISTS " +
+            "(SELECT * FROM rdi_set WHERE active = 1)")
 
     def curtime(self):
         return curtime()
@@ -326,8 +588,15 @@ class Database:
             if not log_only:
                 stdout(s)
 
-    def query(self, sql, many=False, sql_params=None, caller=None):
-        """Execute the SQL statement with given SQL parameters."""
+    def query(self, sql, many=False, sql_params=None, caller=None, commit=True):
+        """Execute the SQL statement with given SQL parameters.
+
+        If commit is False the statement is left in the open transaction so
+        several statements can be committed together with commit().
+
+        The wall time of each statement is measured; see QueryStats.
+        """
+        start = time.time()
         try:
             if sql_params:
                 if many:
@@ -338,15 +607,22 @@ class Database:
                 self.cur.executemany(sql)
             else:
                 self.cur.execute(sql)
-            self.con.commit()
+            if commit:
+                self.con.commit()
+            self.in_transaction = not commit
             result = self.cur.fetchall()
         except self.Error, sqlerr:
-            self.con.rollback()
+            self.rollback()
             excp = SQLiteQueryError("{0:s}\n\tquery: {1:s}".format(sqlerr, sql))
             if caller:
                 excp += '  Caller: {0:s}'.format(caller)
             error(excp)
             raise excp
+        ms = (time.time() - start) * 1000.0
+        if query_stats.slow_ms is None:
+            query_stats.configure()
+        if query_stats.enabled or ms >= query_stats.slow_ms:
+            self.record_query(sql, many, sql_params, caller, ms, len(result))
         # Convert to tuple as GNUtrition code expects MySQLdb tuple return
         self.result = tuple(result)
         self.last_query = sql
@@ -354,15 +630,82 @@ class Database:
         # Added for debugging
         self.show_query(sql, sql_params, caller)
 
+    def record_query(self, sql, many, sql_params, caller, ms, rows):
+        """Add a statement's timing to query_stats and log it if slow."""
+        if not caller:
+            # The function that called query()
+            code = sys._getframe(2).f_code
+            caller = '{0:s}:{1:s}'.format(basename(code.co_filename),
+                                          code.co_name)
+        if query_stats.enabled:
+            query_stats.add(sql, caller, ms, rows)
+        if ms >= query_stats.slow_ms:
+            warn('Slow query ({0:.0f} ms, {1:d} rows) from {2:s}:\n  {3:s}'
+                 .format(ms, rows, caller, ' '.join(sql.split())))
+            if many:
+                pass
+            elif self.in_transaction:
+                # EXPLAIN is not DML: the sqlite3 module would commit the
+                # open transaction before running it
+                self.pending_explain.append((sql, sql_params, caller))
+            else:
+                self.log_plan(sql, sql_params)
+
+    def log_plan(self, sql, sql_params=None):
+        for line in self.explain(sql, sql_params):
+            warn('  plan: {0:s}'.format(line))
+
+    def explain_pending(self):
+        """Log the plans of slow statements of the transaction just ended."""
+        pending = self.pending_explain
+        self.pending_explain = []
+        for sql, sql_params, caller in pending:
+            warn('Plan of slow query from {0:s}:\n  {1:s}'.format(caller,
+                 ' '.join(sql.split())))
+            self.log_plan(sql, sql_params)
+
+    def explain(self, sql, sql_params=None):
+        """Return the lines of EXPLAIN QUERY PLAN for sql.
+
+        A separate cursor is used so the result of the last query is kept.
+        Must not be called inside a transaction, see record_query().
+        """
+        try:
+            cur = self.con.cursor()
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, sql_params or ())
+            return [str(row[-1]) for row in cur.fetchall()]
+        except self.Error, e:
+            # For example a CREATE TABLE statement
+            return ['not available: {0!s}'.format(e)]
+
+    def commit(self):
+        """Commit statements run with query(..., commit=False)."""
+        self.con.commit()
+        self.in_transaction = False
+        if self.pending_explain:
+            self.explain_pending()
+
+    def rollback(self):
+        self.con.rollback()
+        self.in_transaction = False
+        if self.pending_explain:
+            self.explain_pending()
+
+    def log_no_result(self):
+        # Empty results are common; build the message only when it is logged
+        if not log.isEnabledFor(logging.DEBUG):
+            return
+        s = 'No result from:\n  {0:s}'.format(self.last_query)
+        if self.last_query_params:
+            s = s + '\n  sql params: {0!r}'.format(self.last_query_params)
+        debug(s)
+
     def get_result(self):
         """Return full result, fetchall() from cursor.execute()"""
         result = self.result
         self.result = None
         if not result:
-            s = 'No result from:\n  {0:s}'.format(self.last_query)
-            if self.last_query_params:
-                s = s + '\n  sql params: {0!r}'.format(self.last_query_params)
-            info(s)
+            self.log_no_result()
         return result
 
     def get_row_result(self):
@@ -370,10 +713,7 @@ class Database:
         result = self.result
         self.result = None
         if not result:
-            s = 'No result from:\n  {0:s}'.format(self.last_query)
-            if self.last_query_params:
-                s = s + '\n  sql params: {0!r}'.format(self.last_query_params)
-            info(s)
+            self.log_no_result()
             return result
         if len(result) == 1:
             return result[0]
@@ -385,10 +725,7 @@ class Database:
         result = self.result
         self.result = None
         if not result:
-            s = 'No result from:\n  {0:s}'.format(self.last_query)
-            if self.last_query_params:
-                s = s + '\n  sql params: {0!r}'.format(self.last_query_params)
-            info(s)
+            self.log_no_result()
             return None
         if len(result) == 1:
             if len(result[0] ) == 1:
@@ -438,6 +775,38 @@ class Database:
             m += 1
         return m
 
+class Database(Connection):
+    _shared_state = {}
+    def __init__(self, dbfile=None, readonly=False):
+        """Open the SQLite database, shared by every instance.
+
+        Parameters dbfile and readonly are only used by the first instance
+        created in a process.
+        """
+        self.__dict__ = self._shared_state
+        if self._shared_state:
+            return
+        self._connect(dbfile, readonly)
+
+class ConnectionPool:
+    """A fixed number of Connections shared by threads.
+
+    A thread takes a connection with get() and must give it back with put().
+    get() waits when every connection is in use.
+    """
+    def __init__(self, size, dbfile=None, readonly=True):
+        import Queue
+        self.connections = Queue.Queue()
+        for i in range(size):
+            self.connections.put(Connection(dbfile, readonly,
+                                            check_same_thread=False))
+
+    def get(self):
+        return self.connections.get()
+
+    def put(self, con):
+        self.connections.put(con)
+
 def table_exists(table):
     """Return True or False for existence of table.
 
@@ -463,13 +832,6 @@ def num2str(number, n):
         s = '0' + s
     return s
  
-def good_NDB_No(NDB_No):
-    """Verify NDB_No is valid for current data set."""
-    db = Database()
-    sql = "SELECT NDB_No FROM food_des WHERE NDB_No = '{0:s}'".format(NDB_No)
-    db.query(sql)
-    return db.get_single_result()
-
 # These next two are only valid for MySQL database 
 def msre_desc_from_msre_no(mysql=None, msre_no=None):
     """Use msre_no (measure number) to retrieve corresponding measure description."""
@@ -488,43 +850,76 @@ def gm_wgt_from_fd_and_msre(mysql, NDB_No, Msre_No):
     mysql.query(sql.format(int(NDB_No), int(Msre_No)))
     return mysql.get_single_result()
 
-# This is only valid for initialized database.Database() class
-def latest_Msre_Desc_for_NDB_No(sqlite, NDB_No):
-    """Retrieve current measure descriptions for given NDB_No (food number)"""
-    sql = "SELECT Msre_Desc, Gm_wgt FROM weight WHERE NDB_No = '{0:s}'"
-    sqlite.query(sql.format(NDB_No))
-    desc_list = sqlite.get_result()
-    if not desc_list:
-        return ([],[]) # Nothing we can do about this...
-    all_desc = []
-    all_weights = []
-    for choice in desc_list: 
-        all_desc.append(choice[0])
-        all_weights.append(choice[1])
-    iam = func()
-    debug('{0:s}({1:s}): {2!r}'.format(iam, NDB_No, all_desc))
-    debug('{0:s}({1:s}): {2!r}'.format(iam, NDB_No, all_weights))
-    return (all_desc, all_weights)
-    
-    def find_closest(desc_list, desc): """Attempt to find a close match for Msre_Desc.
-    Parameter desc_list is a current list of all Msre_Desc for a particular NDB_No.
-    Parameter desc is a specific Msre_Desc from old data.
+def normalize_Msre_Desc(desc):
+    """Return measure description text in the form used for matching.
+
+    Some differences in measure descriptions between SR releases are just
+    white space or letter case.
     """
-    import re
-    # Some differences in measure descriptions are just white space. 
-    found = None
-    s2 = desc.replace(' ','')
-    for item in desc_list:
-        s1 = item.replace(' ', '')
-        if s1 == s2:
-            found = item
-            break
-    info('find_closest: {0!r} {1!r}'.format( desc_list, desc))
-    info('  result: {0!r}'.format(found))
-    return found
-    
+    return ''.join(desc.split()).lower()
+
+class MeasureIndex:
+    """Index of current measure descriptions (Msre_Desc) by food number.
+
+    Each measure is keyed three ways: by exact text, by normalized text
+    (see normalize_Msre_Desc()) and by gram weight rounded to GM_DIGITS
+    places, so a measure from old data or an imported file is matched with
+    dictionary lookups only. Where two measures share a key the one with
+    the lower sequence number wins.
+    """
+    GM_DIGITS = 1
+
+    def __init__(self, sqlite=None, NDB_No=None):
+        self.exact = {}
+        self.text = {}
+        self.gm_wgt = {}
+        if sqlite:
+            self.load(sqlite, NDB_No)
+
+    def load(self, sqlite, NDB_No=None):
+        """Add measures for one food, or for all foods if NDB_No is None."""
+        sql = "SELECT NDB_No, Msre_Desc, Gm_wgt FROM weight"
+        if NDB_No:
+            sqlite.query(sql + " WHERE NDB_No = ? ORDER BY Seq",
+                         sql_params=(NDB_No,))
+        else:
+            sqlite.query(sql + " ORDER BY NDB_No, Seq")
+        for num, desc, gm_wgt in sqlite.get_result() or ():
+            self.add(num, desc, gm_wgt)
+
+    def add(self, NDB_No, desc, gm_wgt):
+        self.exact.setdefault((NDB_No, desc), desc)
+        self.text.setdefault((NDB_No, normalize_Msre_Desc(desc)), desc)
+        if gm_wgt is not None:
+            key = (NDB_No, round(float(gm_wgt), self.GM_DIGITS))
+            self.gm_wgt.setdefault(key, desc)
+
+    def is_valid(self, NDB_No, desc):
+        """Return True if desc is a current Msre_Desc for NDB_No."""
+        return (NDB_No, desc) in self.exact
+
+    def match(self, NDB_No, desc, gm_wgt=None):
+        """Return the current Msre_Desc best matching desc, or None.
+
+        An exact match is tried first, then a match on gram weight (if
+        gm_wgt is given) and finally a match on normalized text. If gram
+        weights match chances are excellent the measure is the same one.
+        """
+        found = self.exact.get((NDB_No, desc))
+        if found:
+            return found
+        if gm_wgt is not None:
+            key = (NDB_No, round(float(gm_wgt), self.GM_DIGITS))
+            found = self.gm_wgt.get(key)
+            if found:
+                return found
+        if desc:
+            return self.text.get((NDB_No, normalize_Msre_Desc(desc)))
+        return None
+
 def to_Msre_Desc(sqlite=None, mysql=None,
-                            NDB_No=None, Msre_Desc=None, Msre_No=None):
+                            NDB_No=None, Msre_Desc=None, Msre_No=None,
+                            index=None):
     """Return a measurement deescription from current database.
 
     Given Nutrient Database Number NDB_No and one of measure description
@@ -535,6 +930,8 @@ def to_Msre_Desc(sqlite=None, mysql=None,
     class.
     Parameter mysql is needed if parameter Msre_No is given, and must
     be an instance of mysql.Database() class.
+    Parameter index is an optional MeasureIndex already loaded with the
+    measures for NDB_No; without one the measures are read from sqlite.
     """
     if not sqlite:
         raise Exception("sqlite parameter for SQLite3 instance missing.")
@@ -549,32 +946,52 @@ def to_Msre_Desc(sqlite=None, mysql=None,
     else:
         desc = Msre_Desc
 
-    # First see if we have exact match
-    (desc_list, new_gwt_list) = latest_Msre_Desc_for_NDB_No(sqlite, NDB_No)
-    for d in desc_list:
-        if d == desc:
-            return d  # Great
-
-    # Next see if we can match gram weights. If we can chances are excellent
-    # we then derive the correct Msre_Desc.
+    old_gwt = None
     if Msre_No:
         old_gwt = gm_wgt_from_fd_and_msre(mysql, NDB_No, Msre_No)
-        for wt in range(len(new_gwt_list)):
-            if new_gwt_list[wt] == old_gwt:
-                return desc_list[wt]
-    description = find_closest(desc_list, desc)
+    if index is None:
+        index = MeasureIndex(sqlite, NDB_No)
+    description = index.match(NDB_No, desc, old_gwt)
     if not description:
         debug('No Msre_Desc found for desc {0:s} and NDB_No {1:s}'.format(
                 desc, NDB_No))
-        debug('All Msre_Desc for NDB_No: {0!r}'.format(desc_list))
     return description
 
+def valid_NDB_No_set(sqlite):
+    """Return the set of all NDB_No (food numbers) in the current SR data."""
+    sqlite.query("SELECT NDB_No FROM food_des")
+    return set([row[0] for row in sqlite.get_result()])
+
+def mysql_measure_tables(mysql):
+    """Return MySQL (measure, weight) tables as dictionaries.
+
+    Only valid for the older MySQL databases that used a 'measure' table.
+    The first maps msre_no to msre_desc, the second maps (NDB_No, msre_no)
+    to gram weight.
+    """
+    measures, weights = {}, {}
+    mysql.query("SELECT msre_no, msre_desc FROM measure")
+    for msre_no, msre_desc in mysql.get_result() or ():
+        measures[msre_no] = msre_desc
+    mysql.query("SELECT fd_no, msre_no, wgt_val FROM weight")
+    for fd_no, msre_no, wgt_val in mysql.get_result() or ():
+        weights[(num2str(fd_no, 5), msre_no)] = wgt_val
+    return (measures, weights)
+
 def migrate(mysql):
     """Retrieve gnutrition table data from MySQL database.
-    Parameters uname and pword are the MySQL username and password used with
-    the older version of GNUtritin."""
-    from gnutr import Dialog
+
+    Parameter mysql is an initialized instance of mysql.Database() class.
+
+    All SR data needed to validate the old rows (food numbers and a
+    MeasureIndex of measure descriptions) is read into memory first, and the rows are then written
+    with one executemany per table in a single transaction.
+
+    Return a dictionary with counts of 'migrated' and 'skipped' rows and
+    the number of 'obsolete' food numbers found.
+    """
     lite = Database()
+    stats = {'migrated': 0, 'skipped': 0, 'obsolete': 0}
 
     # Need to check for tables: recipe, ingredient, preparation
     # person, food_plan, recipe_plan, nutr_goal 
@@ -600,13 +1017,26 @@ def migrate(mysql):
     # Any version - food numbers may have disappeared from earlier SR data
     #               to later SR data. NDB_No inserted in SQLite tables must
     #               exist in current SR data.
-    #               
 
-    # Create a list of for obsolete NDB_No (food number) and recipe_no 
-    # (recipe number) for recipes which will fail to import properly due to
-    # the obsolete NDB_No.
-    recipe_failures = []
-    obsolete_NDB_No = []
+    good_NDB_Nos = valid_NDB_No_set(lite)
+    measures = MeasureIndex(lite)
+    if use_msre_no:
+        (old_measures, old_weights) = mysql_measure_tables(mysql)
+
+    def measure(NDB_No, msre):
+        """Return current Msre_Desc for old msre_no or Msre_Desc."""
+        if use_msre_no:
+            desc = old_measures.get(msre)
+            old_gwt = old_weights.get((NDB_No, msre))
+        else:
+            desc, old_gwt = msre, None
+        return measures.match(NDB_No, desc, old_gwt)
+
+    # Recipes which will fail to import properly due to an obsolete NDB_No
+    # (food number) or a measure that no longer exists.
+    recipe_failures = set()
+    obsolete_NDB_No = set()
+    inserts = []
 
     # ingredient table
     if 'ingredient' in found:
@@ -616,73 +1046,61 @@ def migrate(mysql):
             mysql.query(sql1)
         else:
             mysql.query(sql2)
-        result = mysql.get_result()
-        if result:
-            debug('found {0:d} ingredients'.format(len(result)))
-            debug("{0!r}".format(result))
-            for i in range(len(result)):
-                NDB_No = num2str(result[i][3],5)
-                if not good_NDB_No(NDB_No):
-                    recipe_failures.append(recipe_no)
-                    obsolete_NDB_No.append(NDB_No)
-                    debug('NDB_No {0:d} is obsolete.'.format(NDB_No))
-                    continue   
-                Msre_No, Msre_Desc = None, None
-                recipe_no = result[i][0]
-                amount = result[i][1]
-                if use_msre_no:
-                    Msre_No = result[i][2]
-                else:
-                    Msre_Desc = result[i][2]
-                Msre_Desc = to_Msre_Desc(sqlite=lite, mysql=mysql, NDB_No=NDB_No,
-                                            Msre_Desc=Msre_Desc, Msre_No=Msre_No)
-                assert Msre_Desc
-                debug('Found Msre_Desc {0:s}'.format(Msre_Desc))
-                params = (recipe_no, amount, Msre_Desc, NDB_No)
-                lite.query("INSERT INTO 'ingredient' VALUES (?,?,?,?)",
-                           many=False, sql_params=params, caller='migrate')
+        result = mysql.get_result() or ()
+        debug('found {0:d} ingredients'.format(len(result)))
+        rows = []
+        for recipe_no, amount, msre, fd_no in result:
+            NDB_No = num2str(fd_no, 5)
+            if NDB_No not in good_NDB_Nos:
+                recipe_failures.add(recipe_no)
+                obsolete_NDB_No.add(NDB_No)
+                debug('NDB_No {0:s} is obsolete.'.format(NDB_No))
+                continue
+            Msre_Desc = measure(NDB_No, msre)
+            if not Msre_Desc:
+                recipe_failures.add(recipe_no)
+                debug('No Msre_Desc found for {0!r} and NDB_No {1:s}'.format(
+                        msre, NDB_No))
+                continue
+            rows.append((recipe_no, amount, Msre_Desc, NDB_No))
+        good = [r for r in rows if r[0] not in recipe_failures]
+        stats['skipped'] += len(result) - len(good)
+        inserts.append(("INSERT INTO 'ingredient' VALUES (?,?,?,?)", good))
 
     # recipie table
     if 'recipe' in found:
         mysql.query("SELECT recipe_no, recipe_name, no_serv, no_ingr, " +
                     "category_no FROM recipe")
-        result = mysql.get_result()
-        if result:
-            debug('found {0:d} recipies'.format(len(result)))
-            debug('{0!r}'.format(result))
-            for i in range(len(result)):
-                if result[i][0] in recipe_failures:
-                    debug('Recipe {0:s} will not import'.format(result[i][1]))
-                    continue
-                lite.query("INSERT INTO 'recipe' VALUES (?,?,?,?,?)",
-                           many=False, sql_params=result[i], caller='migrate')
+        result = mysql.get_result() or ()
+        debug('found {0:d} recipies'.format(len(result)))
+        rows = []
+        for row in result:
+            if row[0] in recipe_failures:
+                debug('Recipe {0:s} will not import'.format(row[1]))
+                continue
+            rows.append(row)
+        stats['skipped'] += len(result) - len(rows)
+        inserts.append(("INSERT INTO 'recipe' VALUES (?,?,?,?,?)", rows))
+
     # preparation table
     if 'preparation' in found:
         mysql.query("SELECT recipe_no, prep_time, prep_desc FROM preparation")
-        result = mysql.get_result()
-        if result:
-            debug('found {0:d} entries in preparation table'.format(len(result)))
-            debug('{0!r}'.format(result))
-            for i in range(len(result)):
-                if result[i][0] in recipe_failures:
-                    continue
-                lite.query("INSERT INTO 'preparation' VALUES (?,?,?)",
-                           many=False, sql_params=result[i], caller='migrate')
+        result = mysql.get_result() or ()
+        debug('found {0:d} entries in preparation table'.format(len(result)))
+        rows = [r for r in result if r[0] not in recipe_failures]
+        stats['skipped'] += len(result) - len(rows)
+        inserts.append(("INSERT INTO 'preparation' VALUES (?,?,?)", rows))
 
     # person table
     if 'person' in found:
         mysql.query("SELECT person_no, person_name, user_name FROM person")
-        result = mysql.get_result()
-        if result and len(result) > 0:
-            persons = len(result)
-            debug('found {0:d} entries in person table'.format(persons))
-            debug('{0!r}'.format(result))
-            lite.query("INSERT INTO 'person' VALUES (?,?,?)",
-                           many=True, sql_params=result, caller='migrate')
-            # This for filling in 'Name' in User Setup Personal Details
-            # User can change but show them what they used before.
-            if persons == 1 and not config.get_value('Name'):
-                config.set_key_value('Name', person_name)
+        result = mysql.get_result() or ()
+        debug('found {0:d} entries in person table'.format(len(result)))
+        inserts.append(("INSERT INTO 'person' VALUES (?,?,?)", list(result)))
+        # This for filling in 'Name' in User Setup Personal Details
+        # User can change but show them what they used before.
+        if len(result) == 1 and not config.get_value('Name'):
+            config.set_key_value('Name', result[0][1])
 
     # food_plan table
     if 'food_plan' in found:
@@ -692,52 +1110,58 @@ def migrate(mysql):
             mysql.query(sql1)
         else:
             mysql.query(sql2)
-        result = mysql.get_result()
-        if result:
-            debug('found {0:d} entries in food_plan table'.format(len(result)))
-            for i in range(len(result)):
-                NDB_No = num2str(result[i][5],5)
-                date = str(result[i][1])
-                time = str(result[i][2])
-                if not good_NDB_No(result[i][5]):
-                    s = 'Food plan for {0:s} {1:s} contains obsolete NDB_No.'
-                    debug(s.format(date, time))
-                    continue
-                person_no = result[i][0]
-                amount = result[i][3]
-                if use_msre_no:
-                    Msre_Desc = msre_desc_from_msre_no(result[i][4])
-                else:
-                    Msre_Desc = result[i][4]
-                Msre_Desc = to_Msre_Desc(sqlite=lite, mysql=mysql, NDB_No=NDB_No,
-                                            Msre_Desc=Msre_Desc, Msre_No=Msre_No)
-                params = (person_no, date, time[:-3], amount, Msre_Desc, NDB_No)
-                lite.query("INSERT INTO 'food_plan' VALUES (?,?,?,?,?,?)",
-                           many=False, sql_params=params, caller='migrate')
+        result = mysql.get_result() or ()
+        debug('found {0:d} entries in food_plan table'.format(len(result)))
+        rows = []
+        for person_no, date, time, amount, msre, fd_no in result:
+            NDB_No = num2str(fd_no, 5)
+            date, time = str(date), str(time)
+            if NDB_No not in good_NDB_Nos:
+                obsolete_NDB_No.add(NDB_No)
+                s = 'Food plan for {0:s} {1:s} contains obsolete NDB_No.'
+                debug(s.format(date, time))
+                continue
+            Msre_Desc = measure(NDB_No, msre)
+            if not Msre_Desc:
+                continue
+            rows.append((person_no, date, time[:-3], amount, Msre_Desc, NDB_No))
+        stats['skipped'] += len(result) - len(rows)
+        inserts.append(("INSERT INTO 'food_plan' VALUES (?,?,?,?,?,?)", rows))
+
     # recipe_plan table
     if 'recipe_plan' in found:
         # Need to convert datetime.date and datetime.timedelta MySQL types to
         # strings before inserting into SQLite table.
         mysql.query("SELECT person_no, date, time, no_portions, " +
                     "recipe_no FROM recipe_plan")
-        result = mysql.get_result()
+        result = mysql.get_result() or ()
         debug('found {0:d} entries in recipe_plan table'.format(len(result)))
-        if result:
-            for r in range(len(result)):
-                recipe_no = result[r][4]
-                date = str(result[r][1])
-                time = str(result[r][2])
-                if recipe_no in recipe_failures:
-                    debug('recipe plan for {0:s} {1:s} will not import'.format(date, time))
-                    continue
-                person_no = result[r][0]
-                no_portions = result[r][3]
-                params = (person_no, date, time[:-3], no_portions, recipe_no)
-                debug("{0!r}".format(params))
-                lite.query("INSERT INTO 'recipe_plan' VALUES (?,?,?,?,?)",
-                           many=False, sql_params=params, caller='migrate')
+        rows = []
+        for person_no, date, time, no_portions, recipe_no in result:
+            date, time = str(date), str(time)
+            if recipe_no in recipe_failures:
+                debug('recipe plan for {0:s} {1:s} will not import'.format(date, time))
+                continue
+            rows.append((person_no, date, time[:-3], no_portions, recipe_no))
+        stats['skipped'] += len(result) - len(rows)
+        inserts.append(("INSERT INTO 'recipe_plan' VALUES (?,?,?,?,?)", rows))
+
+    # Write everything in one transaction
+    try:
+        for sql, rows in inserts:
+            if rows:
+                lite.query(sql, many=True, sql_params=rows, caller='migrate',
+                           commit=False)
+                stats['migrated'] += len(rows)
+        lite.commit()
+    except SQLiteQueryError:
+        lite.rollback()
+        raise
+    stats['obsolete'] = len(obsolete_NDB_No)
+    info('migrate: {0:d} rows migrated, {1:d} skipped, {2:d} obsolete NDB_No'.format(
+            stats['migrated'], stats['skipped'], stats['obsolete']))
     # nutr_goal table needs to be recalculated
-    return True
+    return stats
 #---------------------------------------------------------------------------
 if __name__ == '__main__':
     from util.log import init_logging
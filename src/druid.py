@@ -46,6 +46,7 @@ class Druid:
     def on_cancel(self, w, d=None):
         self.ui.dialog.hide()
         gtk.main_quit()
+        config.discard()
         for user_file in os.listdir(self.app.user_dir):
             os.unlink(os.path.join(self.app.user_dir, user_file))
         return 0
@@ -64,6 +65,7 @@ class Druid:
 
             self.sqlite.init_USDA_data()
             self.sqlite.init_user()
+            self.sqlite.init_rdi()
 
             # See if this user has GNUtrition data from older version
             # which used MySQL. That data should be migrated to newer SQLite
@@ -82,7 +84,13 @@ class Druid:
                     import mysql
                     self.mysql = mysql.open_mysqldb(db_uname, db_pword)
                     if self.mysql:
-                        database.migrate(self.mysql)
+                        stats = database.migrate(self.mysql)
+                        Dialog('notify',
+                            'Imported {0:d} rows, skipped {1:d}.\n'.format(
+                                stats['migrated'], stats['skipped']) +
+                            '{0:d} foods no longer exist in the current\n'.format(
+                                stats['obsolete']) +
+                            'USDA data.')
             # no error, so skip over page_db_error
             self.ui.set_page(3)
             return
@@ -142,6 +150,8 @@ class Druid:
                 lactating = 0
 
             data = calc_rdi.compute(age, weight, female, pregnant, lactating)
+            calc_rdi.save_person(self.sqlite, self.person.get_person_num(),
+                                 age, weight, female, pregnant, lactating)
             self.nutr_goal_dlg = nutr_goal_dlg.NutrGoalDlg()
             self.nutr_goal_dlg.save_goal(data)
 
@@ -0,0 +1,465 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2000-2002 Edgar Denny (edenny@skyweb.net)
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Nutrient computations without the GUI.
+
+Nothing here imports gtk. Every function takes 'db', an instance of
+database.Database() (or anything with the same query() and get_*result()
+methods), so the same code serves the dialogs, gnutrition-batch and any
+other program working on the SQLite data.
+
+Nutrient totals are lists of (Nutr_No, value) tuples in nutr_def order,
+the form the dialogs have always used.
+"""
+from array import array
+from util.exception import AppException
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+class EngineError(AppException): pass
+
+def nutr_num_list(db):
+    """Return a list of every Nutr_No in nutr_def order."""
+    db.query("SELECT Nutr_No FROM nutr_def")
+    return [row[0] for row in db.get_result()]
+
+def zero_totals(nutr_nums):
+    return [(num, 0.000) for num in nutr_nums]
+
+def _to_dict(tot_list):
+    d = {}
+    for num, val in tot_list:
+        d[num] = val
+    return d
+
+def _to_list(nutr_nums, totals):
+    return [(num, totals.get(num, 0.000)) for num in nutr_nums]
+
+def food_nutrients(db, NDB_No):
+    """Return list of (Nutr_No, Nutr_Val) per 100 gm of food NDB_No."""
+    db.query("SELECT Nutr_No, Nutr_Val FROM nut_data WHERE NDB_No = ?",
+             sql_params=(NDB_No,))
+    return db.get_result() or ()
+
+def gm_per_measure(db, NDB_No, Msre_Desc):
+    """Return the gram weight of one Msre_Desc of food NDB_No.
+
+    A few foods list the same Msre_Desc twice; as with Store the one with
+    the lower sequence number is used.
+    """
+    db.query("SELECT Gm_wgt FROM weight WHERE NDB_No = ? AND Msre_Desc = ? " +
+             "ORDER BY Seq LIMIT 1", sql_params=(NDB_No, Msre_Desc))
+    gm = db.get_single_result()
+    if gm is None:
+        raise EngineError("No measure '{0:s}' for NDB_No {1:s}".format(
+                Msre_Desc, NDB_No))
+    return float(gm)
+
+class FoodData:
+    """In-memory nutrient values and gram weights of foods.
+
+    Used in place of a query per food when the same foods are added up
+    many times, as when analyzing the plans of many persons. Foods can be
+    loaded in bulk with load(); any other food is read from db on first use
+    and kept.
+
+    Gram weights not loaded are taken from measures, if given, an object
+    with a gm_per_measure(NDB_No, Msre_Desc) method such as store.Store.
+    """
+    def __init__(self, db, measures=None):
+        self.db = db
+        self.measures = measures
+        self.nutrients = {}     # NDB_No -> ((Nutr_No, Nutr_Val), ...)
+        self.gm_wgt = {}        # (NDB_No, Msre_Desc) -> Gm_wgt
+        self.vectors = {}       # NDB_No -> array of value per gram
+
+    def load(self, NDB_Nos):
+        """Read nutrients and weights of all foods in NDB_Nos."""
+        NDB_Nos = [n for n in set(NDB_Nos) if n not in self.nutrients]
+        # Keep well below SQLite's limit on the number of host parameters
+        for i in range(0, len(NDB_Nos), 500):
+            chunk = NDB_Nos[i:i+500]
+            marks = ', '.join(['?'] * len(chunk))
+            nutrients = dict([(n, []) for n in chunk])
+            self.db.query("SELECT NDB_No, Nutr_No, Nutr_Val FROM nut_data " +
+                "WHERE NDB_No IN ({0:s})".format(marks), sql_params=chunk)
+            for NDB_No, nutr_num, nutr_val in self.db.get_result() or ():
+                nutrients[NDB_No].append((nutr_num, nutr_val))
+            for NDB_No, nutr_list in nutrients.iteritems():
+                self.nutrients[NDB_No] = tuple(nutr_list)
+            self.db.query("SELECT NDB_No, Msre_Desc, Gm_wgt FROM weight " +
+                "WHERE NDB_No IN ({0:s}) ORDER BY Seq DESC".format(marks),
+                sql_params=chunk)
+            # Lowest Seq last, so it wins
+            for NDB_No, msre_desc, gm_wgt in self.db.get_result() or ():
+                self.gm_wgt[(NDB_No, msre_desc)] = float(gm_wgt)
+
+    def food_nutrients(self, NDB_No):
+        try:
+            return self.nutrients[NDB_No]
+        except KeyError:
+            nutr_list = tuple(food_nutrients(self.db, NDB_No))
+            self.nutrients[NDB_No] = nutr_list
+            return nutr_list
+
+    def gm_per_measure(self, NDB_No, Msre_Desc):
+        try:
+            return self.gm_wgt[(NDB_No, Msre_Desc)]
+        except KeyError:
+            if self.measures:
+                return self.measures.gm_per_measure(NDB_No, Msre_Desc)
+            gm = gm_per_measure(self.db, NDB_No, Msre_Desc)
+            self.gm_wgt[(NDB_No, Msre_Desc)] = gm
+            return gm
+
+    def per_gram(self, NDB_No, nutr_nums):
+        """Return an array of each nutrient of nutr_nums in one gram of food.
+
+        The array is kept, so nutr_nums must be the same on every call.
+        """
+        try:
+            return self.vectors[NDB_No]
+        except KeyError:
+            index = dict([(num, i) for i, num in enumerate(nutr_nums)])
+            vector = array('d', [0.0]) * len(nutr_nums)
+            for nutr_num, nutr_val in self.food_nutrients(NDB_No):
+                i = index.get(nutr_num)
+                if i is not None:
+                    vector[i] = nutr_val / 100.0
+            self.vectors[NDB_No] = vector
+            return vector
+
+def add_food(db, totals, amount, Msre_Desc, NDB_No, foods=None):
+    """Add nutrients of amount * Msre_Desc of NDB_No to dictionary totals.
+
+    If foods, a FoodData instance, is given it is used instead of db.
+    """
+    if foods:
+        grams = float(amount) * foods.gm_per_measure(NDB_No, Msre_Desc)
+        nutr_list = foods.food_nutrients(NDB_No)
+    else:
+        grams = float(amount) * gm_per_measure(db, NDB_No, Msre_Desc)
+        nutr_list = food_nutrients(db, NDB_No)
+    for nutr_num, nutr_val in nutr_list:
+        if nutr_num in totals:
+            totals[nutr_num] += grams * nutr_val / 100.0
+
+def food_totals(db, amount, Msre_Desc, NDB_No, nutr_nums=None, foods=None):
+    """Return nutrient totals for a single food.
+
+    With foods, a FoodData instance, the totals are the food's per gram
+    array times the grams, read from the database only the first time.
+    """
+    if nutr_nums is None:
+        nutr_nums = nutr_num_list(db)
+    if foods:
+        grams = float(amount) * foods.gm_per_measure(NDB_No, Msre_Desc)
+        vector = foods.per_gram(NDB_No, nutr_nums)
+        return [(num, grams * val) for num, val in zip(nutr_nums, vector)]
+    totals = _to_dict(zero_totals(nutr_nums))
+    add_food(db, totals, amount, Msre_Desc, NDB_No)
+    return _to_list(nutr_nums, totals)
+
+def recipe_ingredients(db, recipe_no):
+    """Return list of (amount, Msre_Desc, NDB_No) for recipe_no."""
+    db.query("SELECT amount, Msre_Desc, NDB_No FROM ingredient " +
+             "WHERE recipe_no = ?", sql_params=(recipe_no,))
+    return db.get_result() or ()
+
+def recipe_totals(db, ingr_list, num_serv, nutr_nums=None, foods=None):
+    """Return nutrient totals per serving for a list of ingredients.
+
+    Parameter ingr_list is a sequence of (amount, Msre_Desc, NDB_No).
+    Parameter foods is an optional FoodData instance.
+    """
+    if nutr_nums is None:
+        nutr_nums = nutr_num_list(db)
+    totals = _to_dict(zero_totals(nutr_nums))
+    for amount, msre_desc, fd_num in ingr_list:
+        add_food(db, totals, amount, msre_desc, fd_num, foods)
+    num_serv = float(num_serv)
+    for num in totals:
+        totals[num] = totals[num] / num_serv
+    return _to_list(nutr_nums, totals)
+
+def stored_recipe_totals(db, recipe_no, nutr_nums=None):
+    """Return nutrient totals per serving for a recipe in the recipe table."""
+    db.query("SELECT no_serv FROM recipe WHERE recipe_no = ?",
+             sql_params=(recipe_no,))
+    num_serv = db.get_single_result()
+    if not num_serv:
+        raise EngineError("No recipe number {0!r}".format(recipe_no))
+    return recipe_totals(db, recipe_ingredients(db, recipe_no), num_serv,
+                         nutr_nums)
+
+def plan_totals(db, start_date, end_date, avg=False, person_no=None,
+                temp=False, nutr_nums=None, foods=None):
+    """Return nutrient totals for a food plan between two dates inclusive.
+
+    If temp is True the session tables food_plan_temp and recipe_plan_temp
+    are used (as PlanComputeDlg does), otherwise the saved plan of
+    person_no. If avg is True the totals are divided by the number of days.
+    Parameter foods is an optional FoodData instance.
+    """
+    if nutr_nums is None:
+        nutr_nums = nutr_num_list(db)
+    totals = _to_dict(zero_totals(nutr_nums))
+    if temp:
+        tables = ('recipe_plan_temp', 'food_plan_temp')
+        where, params = '', (start_date, end_date)
+    else:
+        if person_no is None:
+            raise EngineError("person_no is required for a saved plan.")
+        tables = ('recipe_plan', 'food_plan')
+        where, params = 'person_no = ? AND ', (person_no, start_date, end_date)
+
+    db.query("SELECT recipe_no, no_portions FROM {0:s} ".format(tables[0]) +
+             "WHERE " + where + "date >= ? AND date <= ?", sql_params=params)
+    for recipe_no, num_portions in db.get_result() or ():
+        db.query("SELECT no_serv FROM recipe WHERE recipe_no = ?",
+                 sql_params=(recipe_no,))
+        num_serv = db.get_single_result()
+        if not num_serv:
+            raise EngineError("No recipe number {0!r} in the plan".format(
+                recipe_no))
+        num_serv = float(num_serv)
+        for amount, msre_desc, fd_num in recipe_ingredients(db, recipe_no):
+            add_food(db, totals, amount * num_portions / num_serv,
+                     msre_desc, fd_num, foods)
+
+    db.query("SELECT amount, Msre_Desc, NDB_No FROM {0:s} ".format(tables[1]) +
+             "WHERE " + where + "date >= ? AND date <= ?", sql_params=params)
+    for amount, msre_desc, fd_num in db.get_result() or ():
+        add_food(db, totals, amount, msre_desc, fd_num, foods)
+
+    tot_list = _to_list(nutr_nums, totals)
+    if avg:
+        tot_list = divide_by_days(tot_list, start_date, end_date)
+    return tot_list
+
+def divide_by_days(tot_list, start_date, end_date):
+    import database
+    days = float(database.num_days(start_date, end_date))
+    return [(num, val / days) for num, val in tot_list]
+
+def pcnt_calories(tot_list):
+    """Return percent of calories from (protein, fat, carbohydrate)."""
+    totals = _to_dict(tot_list)
+    cals_protein = totals.get('203', 0.0) * 4.0
+    cals_fat = totals.get('204', 0.0) * 9.0
+    cals_carb = totals.get('205', 0.0) * 4.0
+    tot = cals_protein + cals_fat + cals_carb
+    if tot == 0.0:
+        return (0.0, 0.0, 0.0)
+    return (cals_protein * 100.0/tot, cals_fat * 100.0/tot,
+            cals_carb * 100.0/tot)
+
+def plan_foods(db, person_nos):
+    """Return the set of NDB_No used in the saved plans of person_nos.
+
+    Foods in recipes of the plans are included.
+    """
+    marks = ', '.join(['?'] * len(person_nos))
+    db.query("SELECT NDB_No FROM food_plan " +
+             "WHERE person_no IN ({0:s}) ".format(marks) +
+             "UNION SELECT NDB_No FROM ingredient WHERE recipe_no IN " +
+             "(SELECT recipe_no FROM recipe_plan " +
+             "WHERE person_no IN ({0:s}))".format(marks),
+             sql_params=list(person_nos) * 2)
+    return set([row[0] for row in db.get_result() or ()])
+
+def nutr_goals(db, person_nos):
+    """Return dictionary person_no -> list of (Nutr_No, goal_val)."""
+    goals = dict([(p, []) for p in person_nos])
+    marks = ', '.join(['?'] * len(person_nos))
+    db.query("SELECT person_no, Nutr_No, goal_val FROM nutr_goal " +
+             "WHERE person_no IN ({0:s})".format(marks),
+             sql_params=list(person_nos))
+    for person_no, num, val in db.get_result() or ():
+        goals[person_no].append((num, val))
+    return goals
+
+def nutr_goal(db, person_no):
+    """Return list of (Nutr_No, goal_val) for person_no."""
+    db.query("SELECT Nutr_No, goal_val FROM nutr_goal WHERE person_no = ?",
+             sql_params=(person_no,))
+    return db.get_result() or ()
+
+# Goals read by cached_nutr_goal(), kept until save_goals() changes them
+_goal_cache = {}
+
+def cached_nutr_goal(db, person_no):
+    """Like nutr_goal(), but the table is only read once per person."""
+    try:
+        return _goal_cache[person_no]
+    except KeyError:
+        goal_list = tuple(nutr_goal(db, person_no))
+        _goal_cache[person_no] = goal_list
+        return goal_list
+
+def save_goals(db, goals):
+    """Replace the nutrient goals of many persons in one transaction.
+
+    Parameter goals is a dictionary person_no -> sequence of
+    (Nutr_No, goal_val), the whole goal vector of the person. Statements
+    already run with commit=False are committed along with it.
+    """
+    person_nos = list(goals)
+    rows = [(p, str(int(num)), float(val))
+            for p in person_nos for num, val in goals[p]]
+    # A failed query rolls back the whole transaction
+    for i in range(0, len(person_nos), 500):
+        chunk = person_nos[i:i+500]
+        db.query("DELETE FROM nutr_goal WHERE person_no IN ({0:s})".format(
+                ', '.join(['?'] * len(chunk))), sql_params=chunk,
+                commit=False)
+    if rows:
+        db.query("INSERT INTO nutr_goal VALUES (?, ?, ?)", many=True,
+                 sql_params=rows, commit=False)
+    db.commit()
+    forget_goals(person_nos)
+
+def forget_goals(person_nos):
+    """Drop cached goals of persons whose nutr_goal rows were changed."""
+    for person_no in person_nos:
+        _goal_cache.pop(person_no, None)
+        _goal_vectors.pop(person_no, None)
+
+def save_goal(db, person_no, goal_list):
+    """Replace the nutrient goals of one person."""
+    save_goals(db, {person_no: goal_list})
+
+class GoalVector:
+    """Nutrient goals of a person aligned to a list of Nutr_No.
+
+    scale[i] is 100 / goal of nutr_nums[i], so the percent of goal of
+    nutrient totals in nutr_nums order is one multiplication per nutrient.
+    """
+    def __init__(self, nutr_nums, goal_list):
+        self.nutr_nums = nutr_nums
+        index = dict([(num, i) for i, num in enumerate(nutr_nums)])
+        self.scale = array('d', [0.0]) * len(nutr_nums)
+        positions = set()
+        for num, val in goal_list:
+            i = index.get(str(num))
+            if i is None:
+                continue
+            positions.add(i)
+            if val != 0.0:
+                self.scale[i] = 100.0 / val
+        # Nutrients with a goal, in nutr_nums order
+        self.positions = sorted(positions)
+
+    def pcnt(self, tot_list):
+        """Return list of (Nutr_No, percent of goal) for each goal.
+
+        tot_list must be nutrient totals in the order of nutr_nums, as
+        returned by the functions here given the same nutr_nums.
+        """
+        scale = self.scale
+        nutr_nums = self.nutr_nums
+        return [(nutr_nums[i], tot_list[i][1] * scale[i])
+                for i in self.positions]
+
+# GoalVectors made by goal_vector(), dropped by save_goals()
+_goal_vectors = {}
+
+def goal_vector(db, person_no, nutr_nums):
+    """Return the GoalVector of person_no, kept until goals are saved."""
+    vector = _goal_vectors.get(person_no)
+    if vector is None or (vector.nutr_nums is not nutr_nums and
+                          vector.nutr_nums != nutr_nums):
+        vector = GoalVector(nutr_nums, cached_nutr_goal(db, person_no))
+        _goal_vectors[person_no] = vector
+    return vector
+
+def pcnt_nutr_goal(tot_list, goal_list):
+    """Return list of (Nutr_No, percent of goal) for each goal."""
+    totals = _to_dict(tot_list)
+    pcnt_list = []
+    for num, val in goal_list:
+        num = str(num)
+        if num not in totals:
+            continue
+        if val == 0.0:
+            pcnt = 0.0
+        else:
+            pcnt = totals[num] * 100.0 / val
+        pcnt_list.append((num, pcnt))
+    return pcnt_list
+
+def search_by_nutr_constr(db, constr_list, fg_num=None, norm_by=0,
+                          num_foods=40):
+    """Return list of NDB_No best satisfying the nutrient constraints.
+
+    Parameter constr_list is a list of (Nutr_No, constraint) where the
+    constraint weights the nutrient in the food score. With norm_by 0 the
+    nutrient values are taken per kcal, otherwise per 100 gm. Each value is
+    normalized by the average over all foods searched. Foods whose energy
+    in kcals is undefined are ignored. Parameter fg_num limits the search
+    to one food group.
+    """
+    nutr_nums = [num for num, constr in constr_list]
+    marks = ', '.join(['?'] * (len(nutr_nums) + 1))
+    sql = ("SELECT nut_data.NDB_No, Nutr_No, Nutr_Val FROM nut_data " +
+           "{0:s}WHERE Nutr_No IN ({1:s})")
+    params = ['208'] + nutr_nums
+    if fg_num:
+        sql = sql.format("JOIN food_des ON nut_data.NDB_No = food_des.NDB_No ",
+                         marks) + " AND food_des.FdGrp_Cd = ?"
+        params.append(fg_num)
+    else:
+        sql = sql.format('', marks)
+    db.query(sql, sql_params=params)
+
+    foods = {}
+    for fd_num, nutr_num, nutr_val in db.get_result() or ():
+        foods.setdefault(fd_num, {})[nutr_num] = nutr_val
+
+    # value of each constraint nutrient, per kcal or per weight
+    values = {}
+    sums = dict([(num, 0.0) for num in nutr_nums])
+    for fd_num, nutrs in foods.iteritems():
+        energy = nutrs.get('208', 0.0)
+        if not energy:
+            continue
+        v = {}
+        for num in nutr_nums:
+            val = float(nutrs.get(num, 0.0))
+            if norm_by == 0:
+                val = val / float(energy)
+            v[num] = val
+            sums[num] += val
+        values[fd_num] = v
+    if not values:
+        return []
+    n = float(len(values))
+    avgs = dict([(num, sums[num] / n) for num in nutr_nums])
+
+    scores = []
+    for fd_num, v in values.iteritems():
+        score = 0.0
+        for num, constr in constr_list:
+            if avgs[num]:
+                score += float(constr) * v[num] / avgs[num]
+        scores.append((score, fd_num))
+    scores.sort(reverse=True)
+    return [fd_num for score, fd_num in scores[:num_foods]]
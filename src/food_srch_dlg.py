@@ -20,7 +20,9 @@ import food_srch_dlg_ui
 import gnutr
 import store
 import database
+import engine
 import help
+from util.trace import span, traced
 
 # I can pass a class here nad check if it is plan, food, or recipe
 class FoodSrchDlg:
@@ -54,6 +56,7 @@ class FoodSrchDlg:
     def on_hide(self, w, d=None):
         self.ui.dialog.hide()
 
+    @traced('FoodSrchDlg.on_response')
     def on_response(self, w, resp, d=None):
         if not hasattr(self, 'food_srch_res_dlg'):
             import food_srch_res_dlg
@@ -67,16 +70,19 @@ class FoodSrchDlg:
         elif resp == gtk.RESPONSE_OK:
             page = self.ui.notebook.get_current_page()
             if page == 0:
-                match_list = self.search_by_text()
+                with span('search by text'):
+                    match_list = self.search_by_text()
                 if not match_list:
                     gnutr.Dialog('warn', 'No matching foods.')
                     return
             else:
-                match_list = self.search_by_nutrient()
+                with span('search by nutrient'):
+                    match_list = self.search_by_nutrient()
                 if not match_list:
                     gnutr.Dialog('warn', 'No matching foods.')
                     return
-            self.food_srch_res_dlg.show(match_list, self.view)
+            with span('show results'):
+                self.food_srch_res_dlg.show(match_list, self.view)
 
         elif resp == gtk.RESPONSE_CANCEL or resp == gtk.RESPONSE_DELETE_EVENT:
             if hasattr(self, 'food_srch_res_dlg'):
@@ -166,127 +172,15 @@ class FoodSrchDlg:
         return 0
             
     def search_by_nutr_constr(self, fg_desc, norm_by, num_foods, constr_list):
-        nutr_tot_list = []
-        dict = self.store.nutr_desc2num
-        query =  "("
+        num_constr_list = []
         for nutr_desc, constraint in constr_list:
-            nutr_num = dict[nutr_desc]
-            nutr_tot_list.append((nutr_num, '0.0', constraint))
-            query = query + " Nutr_No = '%s' OR" % (nutr_num)
-        query = query + " Nutr_No = '208' )"
-
-        dict = self.store.fg_desc2num
-        if fg_desc == 'All Foods':
-            query = ("SELECT NDB_No, Nutr_No, Nutr_Val FROM nut_data " +
-                "WHERE " + query)
-        else: 
+            num_constr_list.append((self.store.nutr_desc2num[nutr_desc],
+                                    constraint))
+        fg_num = None
+        if fg_desc != 'All Foods':
             fg_num = self.store.fg_desc2num[fg_desc]
-            query = ("SELECT nut_data.NDB_No, Nutr_No, Nutr_Val FROM " +
-                "nut_data, food_des WHERE " +
-                "food_des.FdGrp_Cd = '{0:s}' AND ".format(fg_num) +
-                "nut_data.NDB_No = food_des.NDB_No AND " + query)
-        self.db.query(query)
-        result = self.db.get_result()
-
-        # compute the average nutrient value for each of the nutrients that
-        # are a constraints. Will be used to normalize values.
-        num_tot_foods = 0
-        fd_num_prev = 0
-        temp_list = []
-        for fd_num, nutr_num, nutr_val in result:
-            if len(temp_list) != 0 and fd_num != fd_num_prev:
-                self.incr_nutr_values(temp_list, nutr_tot_list, norm_by)
-                temp_list[:] = []
-                num_tot_foods = num_tot_foods + 1
-            temp_list.append((fd_num, nutr_num, nutr_val))
-            fd_num_prev = fd_num
-        for i in range(len(nutr_tot_list)):
-            nutr_num, nutr_val_tot, constraint = nutr_tot_list[i]
-            total = float(nutr_num)/float(num_tot_foods)
-            nutr_tot_list[i] = (nutr_num, str(total), constraint)
-
-        # compute the food score on the basis of the nutrient constraints
-        score_list = []
-        fd_num_prev = ''
-        temp_list = []
-        for fd_num, nutr_num, nutr_val in result:
-            if len(temp_list) != 0 and fd_num != fd_num_prev:
-                fd_score = self.calc_score(temp_list, nutr_tot_list, norm_by)
-                temp_list[:] = []
-                self.add_to_score_list(score_list, fd_num, fd_score, num_foods)
-            temp_list.append((fd_num, nutr_num, nutr_val))
-            fd_num_prev = fd_num
-
-        # return a list just of fd_num
-        ret_list = []
-        for fd_num, fd_score in score_list:
-            ret_list.append(fd_num)
-        return ret_list
-
-    def calc_score(self, fd_list, avg_nutr_list, norm_by):
-        energy_val = 0.0
-        for fd_num, nutr_num, nutr_val in fd_list:
-            if nutr_num == 208:
-                energy_val = nutr_val
-
-        # ignore those foods whose energy in kcals is undefined
-        if energy_val == 0.0:
-            return 0.0
-
-        food_score = 0.0
-        for fd_num, nutr_num, nutr_val in fd_list:
-            for avg_nutr_num, avg_nutr_val, constraint in avg_nutr_list:
-                if nutr_num == avg_nutr_num:
-                    if norm_by == 0:    # score per calories
-                        value = float(nutr_val)/ float(energy_val)
-                    else:               # score per weight
-                        value = float(nutr_val)
-
-                    # normalize w.r.t the average nutrient value
-                    food_score = food_score + (float(constraint) *
-                        value / float(avg_nutr_val))
-                    break
-        return food_score
-
-    def add_to_score_list(self, score_list, fd_num, fd_score, num_foods):
-        length = len(score_list)
-        if length < num_foods:
-            score_list.append((fd_num, fd_score))
-        else:
-            score_lowest = score_list[0]
-            j = 0
-            for i in range(length):
-                num, score = score_list[i]
-                if float(score) < score_lowest:
-                    score_lowest = float(score)
-                    j = i
-            if float(fd_score) > score_lowest:
-                score_list[j] = (fd_num, fd_score)
-        return score_list
-
-    def incr_nutr_values(self, list_tmp, nutr_tot_list, norm_by):
-        energy_val = 0.0
-        for fd_num, nutr_num, nutr_val in list_tmp:
-            if nutr_num == 208:
-                energy_val = nutr_val
-
-        # ignore those foods whose energy in kcals is undefined
-        if energy_val == 0.0:
-            return
-
-        # sum the nutrient values for the food to the nutrient
-        # values. Divide if necessary by the energy in kcals. If
-        # not, the values are per 100gm, rather than per kcal.
-        for i in range(len(nutr_tot_list)):
-            nutr_num_tot, nutr_val_tot, constr = nutr_tot_list[i]
-            for fd_num, nutr_num, nutr_val in list_tmp:
-                if nutr_num_tot == nutr_num:
-                    total = float(nutr_val_tot)
-                    if norm_by == 0:    # per calorie
-                        total = total + float(nutr_val) / float(energy_val)
-                    else:                # per weight
-                        total = total + float(nutr_val)
-                    nutr_tot_list[i] = (nutr_num_tot, str(total), constr)
+        return engine.search_by_nutr_constr(self.db, num_constr_list, fg_num,
+            norm_by, num_foods)
 
     def on_treeview_key_press_event(self, widget, event):
         if event.keyval == gtk.keysyms.Return:
@@ -17,6 +17,7 @@
 #
 
 import gtk
+import gobject
 
 import food_win_ui
 import gnutr
@@ -36,6 +37,7 @@ class FoodWin:
         self.ui.hbox.reparent(self.ui.notebook_container)
         self.ui.notebook_container.show_all()
         self.store = store.Store()
+        self.compute_pending = False
 
         self.connect_signals()
 
@@ -53,12 +55,31 @@ class FoodWin:
         self.ui.compute_button.connect('clicked', self.on_compute_released)
         self.ui.pref_button.connect('clicked', self.on_goals_released)
         
-        self.ui.amount_entry.connect('focus-out-event', self.on_compute_released)
-        self.ui.msre_combo.connect('changed', self.on_compute_released)
+        self.ui.amount_entry.connect('focus-out-event', self.on_amount_focus_out)
+        self.ui.msre_combo.connect('changed', self.on_msre_changed)
         self.ui.food_entry.connect('changed', self.on_food_entry_changed)
 
-    def on_food_entry_changed(self, w, d=None):
+    # A food selection changes the measure, amount and food entries in turn;
+    # the composition is computed once, when GTK is next idle.
+    def schedule_compute(self):
+        if not self.compute_pending:
+            self.compute_pending = True
+            gobject.idle_add(self.on_compute_idle)
+
+    def on_compute_idle(self):
+        self.compute_pending = False
         self.on_compute_released(None, None)
+        return False
+
+    def on_amount_focus_out(self, w, e, d=None):
+        self.schedule_compute()
+        return False
+
+    def on_msre_changed(self, w, d=None):
+        self.schedule_compute()
+
+    def on_food_entry_changed(self, w, d=None):
+        self.schedule_compute()
 
     def on_plan_activate(self, w, d=None):
         self.app.base_win.on_plan_button_released(None)
@@ -96,6 +117,7 @@ class FoodWin:
             amount = float(self.ui.amount_entry.get_text())
         except ValueError:
             gnutr.Dialog('error', 'The amount must be a number.', self.parent)
+            return
         self.nutr_comp_dlg.compute_food(amount, msre_desc, fd_num)
 
     def on_goals_released(self, w, d=None):
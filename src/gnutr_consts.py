@@ -23,12 +23,26 @@ LOG_LEVEL = 'warn'  # off, debug, info, warn, error, critical
 LOG_ROTATE = 3      # New one started when LOG_MAX_SZ is reached.
 LOG_MAX_SZ = 50000
 
+# Database query statistics. Set config key 'query_stats' to collect timings
+# per statement and per caller, written to ~/.gnutrition/query_stats at exit.
+# Statements slower than 'slow_query_ms' milliseconds have their query plan
+# logged whether or not statistics are collected.
+QUERY_STATS = False
+SLOW_QUERY_MS = 250
+
+# User actions (see util/trace.py) taking 'slow_action_ms' milliseconds or
+# more are logged with their timings. With config key 'profile' set each
+# action is profiled to ~/.gnutrition/profile.
+PROFILE = False
+SLOW_ACTION_MS = 200
+
 # This needs to be added to install process, somthing like:
 # configure --disable-version-check
 CHECK_DISABLED = False
 # Next two can be changed by user
 CHECK_VERSION = True
 CHECK_INTERVAL = 604800   # 60*60*24*7 (one week)
+CHECK_TIMEOUT = 5         # seconds to wait for the version file
 
 # This file has version information for both the latest application version
 # and the current USDA Standard Reference Database version.
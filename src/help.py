@@ -47,11 +47,24 @@ def get_browser():
     debug('No Web browser found.')
     return ''
 
+# Set by find_browser()
+selected_browser = None
+
+def find_browser():
+    """Return the browser to use, searching PATH the first time only.
+
+    The search stats every PATH directory for each browser, so it is done
+    when help is first needed or from an idle callback after startup.
+    """
+    global selected_browser
+    if selected_browser is None:
+        selected_browser = get_browser()
+    return selected_browser
+
 def open(html_page):
     url = 'file://' + install.idir + '/doc/' + html_page
 
-    if selected_browser:
-        controller = webbrowser.get(selected_browser)
+    browser = find_browser()
+    if browser:
+        controller = webbrowser.get(browser)
         controller.open(url)
-
-selected_browser = get_browser()
@@ -15,10 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import gtk
 import nutr_composition_dlg_ui
 import store
 import database
+import engine
 import help
 from util.log import LOG as log
 debug = log.debug
@@ -27,12 +29,54 @@ warn = log.warn
 error = log.error
 critical = log.critical
 
+class CompositionView:
+    """The text shown in the composition entries.
+
+    The text last set in each entry is kept, and only entries whose text
+    changes are given to GTK.
+    """
+    def __init__(self, ui):
+        # (Nutr_No as in the nutrient totals, Nutrient of the ui)
+        self.cells = [(str(n.num), n) for n in ui.nutr_list]
+        self.calorie_entries = (ui.protein_entry, ui.fat_entry, ui.carb_entry)
+        self.shown = {}         # entry -> text
+        self.formatted = {}     # value -> text
+
+    def format(self, value):
+        try:
+            return self.formatted[value]
+        except KeyError:
+            if len(self.formatted) > 4096:
+                self.formatted.clear()
+            text = self.formatted[value] = '%.3f' % (value)
+            return text
+
+    def set_text(self, entry, text):
+        if self.shown.get(entry) != text:
+            entry.set_text(text)
+            self.shown[entry] = text
+
+    def render(self, tot_list, pcnt_list, pcnt_calories):
+        """Show nutrient totals, percents of goal and percents of calories.
+
+        Nutrients missing from tot_list or pcnt_list show zero.
+        """
+        amounts = dict(tot_list)
+        pcnts = dict(pcnt_list)
+        for num, nutr in self.cells:
+            self.set_text(nutr.entry_amount, self.format(amounts.get(num, 0.0)))
+            self.set_text(nutr.entry_pcnt, self.format(pcnts.get(num, 0.0)))
+        for entry, value in zip(self.calorie_entries, pcnt_calories):
+            self.set_text(entry, self.format(value))
+
 class NutrCompositionDlg:
     def __init__(self):
         self.ui = nutr_composition_dlg_ui.NutrCompositionDlgUI()
         self.db = database.Database()
         self.store = store.Store()
+        self.foods = engine.FoodData(self.db, self.store)
         self.list_nutr_tot = []
+        self.view = CompositionView(self.ui)
 
         self.ui.dialog.connect('response', self.on_response)
         
@@ -61,142 +105,37 @@ class NutrCompositionDlg:
         self.list_pcnt_goal = self.compute_pcnt_nutr_goal()
 
     def compute_food(self, amount, msre_desc, food_num):
-        nutr_num_list = self.store.nutr_num_list
-        self.list_nutr_tot[:] = []
-
-        for nutr_num in nutr_num_list:
-            self.list_nutr_tot.append((nutr_num, 0.000))
-
-        self.add_food_to_nutr_total(amount, msre_desc, food_num)
+        self.list_nutr_tot = engine.food_totals(self.db, amount, msre_desc,
+            food_num, self.store.nutr_num_list, self.foods)
         self.list_pcnt_goal = self.compute_pcnt_nutr_goal()
         self.update()
 
     def update(self):
-        self.reset()
-        nutr_num2val_dict = {}
-        for num, val in self.list_nutr_tot:
-            nutr_num2val_dict[num] = val
-        
-        for n in self.ui.nutr_list:
-            if str(n.num) in nutr_num2val_dict.keys():
-                n.entry_amount.set_text('%.3f' %(nutr_num2val_dict[str(n.num)]))
-                
-        pcnt_num2val_dict = {}
-        for num, val in self.list_pcnt_goal:
-            pcnt_num2val_dict[num] = val
-        
-        for n in self.ui.nutr_list:
-            if str(n.num) in pcnt_num2val_dict.keys():
-                n.entry_pcnt.set_text('%.3f' %(pcnt_num2val_dict[str(n.num)]))
-        
-        protein, fat, carbs = self.compute_pcnt_calories()
-        self.ui.protein_entry.set_text('%.3f' %(protein))
-        self.ui.fat_entry.set_text('%.3f' %(fat))
-        self.ui.carb_entry.set_text('%.3f' %(carbs))
-
-    def add_food_to_nutr_total(self, amount, msre_desc, food_num):
-
-        self.db.query("SELECT Nutr_No, Nutr_Val FROM nut_data " +
-            "WHERE NDB_No = '%s'" % (food_num))
-        list_food_nutr = self.db.get_result()
-
-        self.db.query("SELECT Gm_wgt FROM weight " +
-            "WHERE NDB_No = '{0:s}'  AND Msre_Desc ='{1:s}'".format(
-                    food_num, msre_desc))
-        gm_per_msre = self.db.get_single_result()
-
-        for i in range(len(self.list_nutr_tot)):
-            tot_nutr_num, tot_nutr_val = self.list_nutr_tot[i]
-            for j in range(len(list_food_nutr)):
-                fd_nutr_num, fd_nutr_val = list_food_nutr[j]
-                if tot_nutr_num == fd_nutr_num:
-                    total = tot_nutr_val
-                    total = total + (float(amount) * gm_per_msre
-                        * fd_nutr_val / 100.0)
-                    self.list_nutr_tot[i] = (tot_nutr_num, total)
+        self.view.render(self.list_nutr_tot, self.list_pcnt_goal,
+                         self.compute_pcnt_calories())
 
     def compute_pcnt_calories(self):
-        #dict = self.store.nutr_desc2num #wtf?
-        c,cals_protein,cals_fat,cals_carb = 0,0,0,0
-        for nutr_num, nutr_val in self.list_nutr_tot:
-            if nutr_num == '203':
-                cals_protein = nutr_val * 4.0
-                c = c + 1
-            elif nutr_num == '204':
-                cals_fat = nutr_val * 9.0
-                c = c + 1
-            elif nutr_num == '205':
-                cals_carb = nutr_val * 4.0
-                c = c + 1
-            if c == 3:
-                break
-        tot = cals_protein + cals_fat + cals_carb
-        if tot == 0.0:
-            return (0.0, 0.0, 0.0)
-        else:
-            return (cals_protein * 100.0/tot, cals_fat * 100.0/tot,
-                cals_carb * 100.0/tot)
+        return engine.pcnt_calories(self.list_nutr_tot)
 
     def compute_nutr_total(self, recipe):
-        list_nutr_num = self.store.nutr_num_list
-
-        # initialize to zero
-        self.list_nutr_tot[:] = []
-        for nutr_num in list_nutr_num:
-            self.list_nutr_tot.append((nutr_num, 0.000))
-
-        info('compute_nutr_total(recipe):')
-        # iterate over ingredients
-        for ingr in recipe.ingr_list:
-            info('  amount: {0:d} msre_desc: {1:s} food_num: {2:s}'.format(
-                                ingr.amount, ingr.msre_desc, ingr.food_num))
-            self.add_food_to_nutr_total(ingr.amount, ingr.msre_desc, ingr.food_num)
-
-        # divide by the number of servings
-        for i in range(len(self.list_nutr_tot)):
-            nutr_num, nutr_val = self.list_nutr_tot[i]
-            total = nutr_val/float(recipe.num_serv)
-            self.list_nutr_tot[i] = (nutr_num, total)
+        ingr_list = [(ingr.amount, ingr.msre_desc, ingr.food_num)
+                     for ingr in recipe.ingr_list]
+        if log.isEnabledFor(logging.DEBUG):
+            debug('compute_nutr_total(recipe):\n' + '\n'.join([
+                '  amount: {0!r} msre_desc: {1:s} food_num: {2:s}'.format(*i)
+                for i in ingr_list]))
+        self.list_nutr_tot = engine.recipe_totals(self.db, ingr_list,
+            recipe.num_serv, self.store.nutr_num_list, self.foods)
         return self.list_nutr_tot
 
     def compute_pcnt_nutr_goal(self):
         if not hasattr(self, 'person'):
             import person
             self.person = person.Person()
-
         person_num = self.person.get_person_num()
-
-        self.db.query("SELECT Nutr_No, goal_val FROM nutr_goal " +
-            "WHERE person_no = %d " % (person_num))
-        list_nutr_goal = self.db.get_result()
-
-        dict = {}
-        #print 'list_nutr_tot (nutr_composition_dlg.py):'
-        for num, val in self.list_nutr_tot:
-            #print 'num:', num, 'val:', val
-            dict[num] = val
-
-        list_pcnt_goal = []
-        print 'list_nutr_goal (nutr_composition_dlg.py):'
-        for num, val in list_nutr_goal:
-            #print 'num:', num, 'val:', val
-            if val == 0.0:
-                pcnt = 0.0
-            else:
-                try:
-                    pcnt = dict[num] * 100.0 / val
-                except KeyError:
-                    #DEBUG FIXME: why this error?
-                    print 'nutr_composition_dlg: line 186, key error', num  
-                    continue
-            list_pcnt_goal.append((num, pcnt))
-        return list_pcnt_goal
+        goals = engine.goal_vector(self.db, person_num,
+                                   self.store.nutr_num_list)
+        return goals.pcnt(self.list_nutr_tot)
 
     def reset(self):
-        for n in self.ui.nutr_list:
-            n.entry_amount.set_text('0.000')
-            n.entry_pcnt.set_text('0.000')
-
-        self.ui.protein_entry.set_text('0.000')
-        self.ui.fat_entry.set_text('0.000')
-        self.ui.carb_entry.set_text('0.000')
+        self.view.render((), (), (0.0, 0.0, 0.0))
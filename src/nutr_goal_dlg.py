@@ -19,6 +19,7 @@ import gtk
 import nutr_goal_dlg_ui
 import gnutr
 import person
+import engine
 import help
 
 class NutrGoalDlg:
@@ -64,22 +65,8 @@ class NutrGoalDlg:
 
     def get_goal(self):
         person_no = self.person.get_person_num()
-
-        self.person.db.query("SELECT Nutr_No, goal_val FROM nutr_goal " + 
-            "WHERE person_no = %d" % (person_no))
-        goal_list = self.person.db.get_result()
-
-        return goal_list
+        return engine.cached_nutr_goal(self.person.db, person_no)
 
     def save_goal(self, goal_list):
         person_num = self.person.get_person_num()
-
-        # delete the old goals if necessary
-        self.person.db.query("DELETE FROM nutr_goal " +
-            "WHERE person_no = %d" % (person_num))
-
-        for nutr_num, nutr_val in goal_list:
-            self.person.db.query("INSERT INTO nutr_goal VALUES " +
-                "('%d', '%d', '%f')" % (person_num, int(nutr_num),
-                                        float(nutr_val)),
-                                        caller='save_goal')
+        engine.save_goal(self.person.db, person_num, goal_list)
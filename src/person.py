@@ -25,6 +25,8 @@ class Person:
         if self._shared_state:
             return
         self.db = database.Database()
+        self.person_num = None
+        self.plan_copied = False
 
     def get_name(self, user):
         self.db.query("SELECT person_name FROM person WHERE user_name = '%s'" 
@@ -50,13 +52,26 @@ class Person:
             if match == 0:
                 self.db.query("INSERT INTO person VALUES (NULL, '%s', '%s')" 
                     % (person_name, user))
+        self.invalidate()
 
     def update_name(self, old_name, new_name):
         user = self.get_user()
         sql = "UPDATE  person SET person_name = '{0:s}' WHERE user_name = '{1:s}'"
         self.db.query(sql.format(new_name, user))
+        self.invalidate()
+
+    def ensure_setup(self):
+        """Run setup() unless it has been run already.
+
+        At startup setup() runs from an idle callback, unless the plan view
+        needs the working copy of the plan first.
+        """
+        if not self.plan_copied:
+            self.setup()
+        return False    # Also removes an idle callback
 
     def setup(self):
+        """Copy the person's saved plan to the working plan tables."""
         person_num = self.get_person_num()
 
         # drop any existing temporary tables
@@ -83,26 +98,11 @@ class Person:
             "PRIMARY KEY (date, recipe_no, time) )")
 
         # copy any data from stored tables to temporary ones
-        self.db.query("SELECT * FROM food_plan WHERE person_no = %d" 
-            % (person_num))
-        result = self.db.get_result()
-
-        if result and len(result) != 0:
-            for person_no, date, time, amount, msre_desc, ndb_no in result:
-                self.db.query("INSERT INTO food_plan_temp VALUES" +
-                    "(%d, '%s', '%s', %f, '%s', '%s' )"
-                    %(person_no, str(date), str(time), amount, msre_desc, ndb_no),
-                        caller='Person.setup')
-
-        self.db.query("SELECT * FROM recipe_plan WHERE person_no = %d" 
-            % (person_num))
-        result = self.db.get_result()
-        if result and len(result) != 0:
-            for person_num, date, time, num_portions, recipe_num in result:
-                self.db.query("INSERT INTO recipe_plan_temp VALUES" +
-                    " (%d, '%s', '%s', %f, %d )" 
-                    % (person_num, date, time, num_portions, 
-                        recipe_num), caller='Person.setup')
+        self.db.query("INSERT INTO food_plan_temp SELECT * FROM food_plan " +
+            "WHERE person_no = ?", sql_params=(person_num,))
+        self.db.query("INSERT INTO recipe_plan_temp SELECT * FROM recipe_plan " +
+            "WHERE person_no = ?", sql_params=(person_num,))
+        self.plan_copied = True
 
     # self.db.user is basename($HOME)
     # 'Username' will be:
@@ -118,7 +118,17 @@ class Person:
         return config.get_value('Username')
 
     def get_person_num(self):
-        user_name = self.get_user()
-        self.db.query("SELECT person_no FROM person WHERE user_name = '%s'" 
-            % (user_name))
-        return self.db.get_single_result()
+        """Return person_no for the current user.
+
+        The value is looked up once and kept until invalidate() is called.
+        """
+        if self.person_num is None:
+            user_name = self.get_user()
+            self.db.query("SELECT person_no FROM person WHERE user_name = '%s'" 
+                % (user_name))
+            self.person_num = self.db.get_single_result()
+        return self.person_num
+
+    def invalidate(self):
+        """Forget the cached person_no after the person table changes."""
+        self.person_num = None
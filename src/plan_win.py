@@ -38,6 +38,7 @@ class PlanWin:
         self.parent = parent
 
         self.connect_signals()
+        self.person.ensure_setup()
         self.update()
 
     def get_current_date(self):
@@ -312,9 +313,11 @@ class PlanWin:
         return self.db.get_result()
 
     def food_quantity_info(self, food_no, msre_desc):
-        self.db.query("SELECT Amount, Gm_wgt FROM weight WHERE NDB_No = '{0:s}'" +
-            "AND Msre_Desc = '{1:s}'".format(food_no, msre_desc))
-        return self.db.get_result()
+        if not hasattr(self, 'store'):
+            import store
+            self.store = store.Store()
+        return tuple([(amount, gm_wgt) for desc, amount, gm_wgt
+                      in self.store.get_measures(food_no) if desc == msre_desc])
 
 
     def get_recipes_for_date(self, date):
@@ -406,31 +409,14 @@ class PlanWin:
     def save_plan(self):
         person_num = self.person.get_person_num()
 
-        # delete old plan
-        self.db.query("DELETE FROM food_plan WHERE person_no = %d" 
-            %(person_num))
-        self.db.query("DELETE FROM recipe_plan WHERE person_no = %d" 
-            %(person_num))
-
-        # transfer from tempory to stored table
-        # FIXME: for plans that span a large time, this is inefficient
-        self.db.query("SELECT * FROM food_plan_temp")
-        plan_list = self.db.get_result()
-
-        for person, date, time, amount, msre_desc, ndb_no in plan_list:
-            self.db.query("INSERT INTO food_plan VALUES (" + 
-                "{0:d}, '{1:s}', '{2:s}', {3:f}, '{4:s}', {5:d})".format(
-                person, date, time, amount, msre_desc, ndb_no),
-                caller='PlanWin.save_plan')
-
-        self.db.query("SELECT * FROM recipe_plan_temp")
-        recipe_list = self.db.get_result()
-
-        for person_num, date, time, num_portions, recipe_num in recipe_list:
-            self.db.query("INSERT INTO recipe_plan VALUES (" +
-                "%d, '%s', '%s', %f, %d)"
-                %(person_num, date, time, num_portions, recipe_num),
-                caller='PlanWin.save_plan')
+        # replace the stored plan with the temporary one in one transaction
+        self.db.query("DELETE FROM food_plan WHERE person_no = ?",
+            sql_params=(person_num,), commit=False)
+        self.db.query("DELETE FROM recipe_plan WHERE person_no = ?",
+            sql_params=(person_num,), commit=False)
+        self.db.query("INSERT INTO food_plan SELECT * FROM food_plan_temp",
+            commit=False)
+        self.db.query("INSERT INTO recipe_plan SELECT * FROM recipe_plan_temp")
 
     def add_recipe(self, recipe):
         date = self.ui.date.entry.get_text()
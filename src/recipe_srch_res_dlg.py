@@ -24,6 +24,7 @@ import gnutr_consts
 import database
 import store
 import help
+from util.trace import span, traced
 
 class RecipeSrchResDlg:
     def __init__(self, app):
@@ -69,6 +70,7 @@ class RecipeSrchResDlg:
             desc = model.get_value(iter, 0)
             self.ui.recipe_entry.set_text(desc)
 
+    @traced('RecipeSrchResDlg.on_response')
     def on_response(self, w, r, d=None):
         if r == gtk.RESPONSE_HELP:
             help.open('')
@@ -111,7 +113,8 @@ class RecipeSrchResDlg:
                     ingr.msre_desc = msre_desc
                     recipe.ingr_list.append(ingr)
 
-                self.app.base_win.recipe.update(recipe)
+                with span('show recipe'):
+                    self.app.base_win.recipe.update(recipe)
                 self.ui.dialog.hide()
 
             elif self.view == gnutr_consts.PLAN:
@@ -124,7 +127,8 @@ class RecipeSrchResDlg:
                     return
 
                 self.ui.dialog.hide()
-                self.app.base_win.plan.add_recipe(recipe)
+                with span('add to plan'):
+                    self.app.base_win.plan.add_recipe(recipe)
 
         elif r == 1:
             desc = self.ui.recipe_entry.get_text()
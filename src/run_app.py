@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import config
+import gobject
 import gtk
 from util.log import init_logging
 
@@ -23,7 +24,7 @@ class RunApp:
     def __init__(self):
         from os import path
         logfile = path.join(config.udir, 'log')
-        init_logging(logfile, logto='both', level='info')
+        init_logging(logfile, logto='both', level='info', queue=True)
         self.first_run = not config.get_value('sqlite3')
         if self.first_run:
             # First run, program default values can be added here
@@ -41,33 +42,87 @@ class RunApp:
         else:
             self.startup()
 
+    def configure_trace(self):
+        """Set up timing and optional profiling of user actions."""
+        import gnutr_consts
+        from os import path
+        from util import trace
+        slow = config.get_value('slow_action_ms')
+        if slow is None:
+            slow = gnutr_consts.SLOW_ACTION_MS
+        profile = config.get_value('profile')
+        if profile is None:
+            profile = gnutr_consts.PROFILE
+        profile_dir = None
+        if profile:
+            profile_dir = path.join(config.udir, 'profile')
+        trace.configure(slow, profile_dir,
+                        path.join(config.udir, 'span_totals'))
+
     def startup(self):
-        import version
-        version.check_version()
+        """Show the main window, then finish starting up when idle.
+
+        Only the view last used (config 'Page') is built before the window
+        is shown; see BaseWin. The working copy of the plan, the search for
+        a help browser, the version check and the loading of the SR tables
+        not needed to start (see sr_extra) are done by run_deferred().
+        """
+        self.configure_trace()
+        from util.trace import span
+        with span('RunApp.startup'):
+            with span('open database'):
+                import database
+                self.db = database.Database()
 
-        import database 
-        self.db = database.Database()
+            with span('store'):
+                import store
+                self.store = store.Store()
 
-        import store
-        self.store = store.Store()
+            import person
+            self.person = person.Person()
 
-        import person
-        self.person = person.Person()
-        self.person.setup()
+            with span('main window'):
+                import base_win
+                self.base_win = base_win.BaseWin(self)
+                self.base_win.show()
+
+        import help
+        self.deferred = [('person setup', self.person.ensure_setup),
+                         ('find browser', help.find_browser),
+                         ('check version', self.check_version),
+                         ('SR tables', self.load_sr_extra)]
+        gobject.idle_add(self.run_deferred)
+
+    def run_deferred(self):
+        """Run one deferred startup task per idle callback."""
+        from util.trace import span
+        if self.deferred:
+            (name, task) = self.deferred.pop(0)
+            with span(name):
+                task()
+        return bool(self.deferred)
+
+    def check_version(self):
+        import version
+        version.check_version()
 
-        import base_win
-        self.base_win = base_win.BaseWin(self)
-        self.base_win.show()
+    def load_sr_extra(self):
+        import sr_extra
+        sr_extra.load_in_background()
 
     def shutdown(self):
+        config.flush()
         if not self.first_run:          #otherwise, after first run empty db would be created. Smells like program crash in future
             import database 
             db = database.Database()    #foo-script: Do we really need it at all?
             db.close()
         
 def run_app():
+    # Let the log listener and version check threads run during gtk.main()
+    gobject.threads_init()
     app = RunApp()
     gtk.main()
     app.shutdown()
 
-run_app()
+if __name__ == '__main__':
+    run_app()
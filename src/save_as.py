@@ -16,31 +16,118 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-template1 = """<html>
+"""Export of recipes as HTML, CSV or JSON.
+
+A writer streams recipes to any object with a write() method:
+
+    writer = WRITERS['html'](f)
+    writer.begin('My Recipes')
+    writer.recipe(recipe, nutr_list, pcnt_cal)
+    writer.end()
+
+Parameter recipe has the attributes of gnutr.Recipe used by RecipeWin
+(desc, num_serv, prep_desc and ingr_list, each ingredient with amount,
+msre_desc and food_desc). export_recipes() writes every recipe, or the
+recipes of one category, reading the database once.
+"""
+from cgi import escape
+import engine
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+# Nutrient table sections of an exported recipe: (title, ((label, Nutr_No),
+# ...)). HTML shows two nutrients per row.
+SECTIONS = (
+    ('Macro-Nutrients', (
+        ('Protein (g)', '203'), ('Saturated Fat (g)', '606'),
+        ('Total Fat (g)', '204'), ('Mono-Unsaturated Fat (g)', '645'),
+        ('Carbohydrates (g)', '205'), ('Poly-Unsaturated Fat (g)', '646'),
+        ('Cholesterol (mg)', '601'), ('Fiber (g)', '291'),
+        ('Calories (kcal)', '208'), ('Energy (kJ)', '268'))),
+    ('Micro-Nutrients', (
+        ('A (mg RE)', '318'), ('Calcium (mg)', '301'),
+        ('E (mg ATE)', '394'), ('Iron (mg)', '303'),
+        ('C (mg)', '401'), ('Magnesium (mg)', '304'),
+        ('Thiamin (mg)', '404'), ('Phosphorus (mg)', '305'),
+        ('Riboflavin (mg)', '405'), ('Potassium (mg)', '306'),
+        ('Niacin (mg)', '406'), ('Sodium (mg)', '307'),
+        ('Panto. Acid (mg)', '410'), ('Zinc (mg)', '309'),
+        ('B6 (mg)', '415'), ('Copper (mg)', '312'),
+        ('Folate (cmg)', '417'), ('Manganese (mg)', '315'),
+        ('B12 (cmg)', '418'), ('Selenium (mcg)', '317'))))
+
+# Every exported nutrient, in table order
+NUTRIENTS = tuple([item for title, items in SECTIONS for item in items])
+NUTR_NUMS = [num for label, num in NUTRIENTS]
+
+class Record:
+    """Attributes given as keyword arguments, standing in for gnutr.Recipe
+    and gnutr.Ingredient where gtk is not wanted."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class NutrientIndex:
+    """Nutrient values of a list of (Nutr_No, value) by Nutr_No."""
+    def __init__(self, nutr_list):
+        self.values = dict([(str(num), val) for num, val in nutr_list])
+
+    def value(self, num):
+        return self.values.get(str(num), 0.0)
+
+    def values_of(self, nutr_nums):
+        return [self.values.get(num, 0.0) for num in nutr_nums]
+
+def to_unicode(text):
+    """Decode database text for JSON.
+
+    Text typed in GNUtrition is UTF-8, while some SR descriptions have
+    Windows-1252 punctuation.
+    """
+    if not isinstance(text, str):
+        return text
+    try:
+        return text.decode('utf-8')
+    except UnicodeDecodeError:
+        return text.decode('cp1252', 'replace')
+
+def amount_text(amount):
+    """Return an ingredient amount without needless decimals."""
+    return '{0:g}'.format(float(amount))
+
+#---------------------------------------------------------------------------
+# HTML
+
+html_head = """<html>
   <head>
     <title>%s</title>
     <meta name="Author" content="Edgar Denny">
     <meta http-equiv="Content-Type" content="text/html">
   </head>
   <body bgcolor="#ffffff" text="#000000" link="#00008b" vlink="#8b0000" alink="#ff0000">
-  <p><center><h1>%s</h1></center></p>
+"""
+
+html_recipe_head = """  <p><center><h1>%s</h1></center></p>
     <p><h2>Ingredients</h2>Number of Servings : %s</p>
     <table width="90%%" cellpadding="5" border=1 frame="void">
       <tr>
         <td>Amount</td><td>Measure</td><td>Ingredient</td>
-      </tr> 
+      </tr>
 """
 
-template2 = """      <tr>
-        <td>%d</td><td>%s</td><td>%s</td>
-      </tr> 
+html_ingredient = """      <tr>
+        <td>%s</td><td>%s</td><td>%s</td>
+      </tr>
 """
 
-template3 = """    </table>
+html_table_end = """    </table>
   </p>
 """
 
-template4 = """  <p><h2>Preparation</h2></p>
+html_preparation = """  <p><h2>Preparation</h2></p>
   <table width="90%%" cellpadding="5" border=1 frame="void">
     <tr><td>
       <pre style="font-family: serif">%s</pre>
@@ -48,7 +135,7 @@ template4 = """  <p><h2>Preparation</h2></p>
   </table>
 """
 
-template5 = """  <p>
+html_section = """  <p>
     <table border="1" width="90%%" cellpadding="5" frame="void">
       <colgroup span="4">
         <col width="25%%">
@@ -60,79 +147,216 @@ template5 = """  <p>
         <td colspan=4>%s</td>
       </tr>
 """
-template6 = """    <tr>
-      <td>%s</td><td>%.3f</td><td>%s</td><td>%.3f</td>
+
+html_pair = """    <tr>
+      <td>%s</td><td>%%.3f</td><td>%s</td><td>%%.3f</td>
     </tr>
 """
 
-template7 = """    <tr>
-      <td>%s</td><td>%.3f</td>
+html_single = """    <tr>
+      <td>%s</td><td>%%.3f</td>
     </tr>
 """
 
+html_end = """  </body>
+</html>
+"""
+
+def compile_html_nutrients():
+    """Return the format string of the nutrient tables of a recipe.
+
+    Labels and markup are filled in once here, leaving one %.3f for each
+    value of NUTR_NUMS followed by the three percentages of calories.
+    """
+    def section(title):
+        return (html_section % title).replace('%', '%%')
+    parts = ['<p><h2>Nutrient Composition (Per Serving)</h2></p>\n']
+    for title, items in SECTIONS:
+        parts.append(section(title))
+        for i in range(0, len(items), 2):
+            parts.append(html_pair % (items[i][0], items[i + 1][0]))
+        parts.append(html_table_end)
+    parts.append(section('Percentage of Calories'))
+    parts.append(html_pair % ('Protein', 'Fat'))
+    parts.append(html_single % 'Carbohydrates')
+    parts.append(html_table_end)
+    return ''.join(parts)
+
+html_nutrients = compile_html_nutrients()
+
+class HtmlWriter:
+    """Recipes as one HTML document."""
+    def __init__(self, f):
+        self.f = f
+
+    def begin(self, title):
+        self.f.write(html_head % escape(title))
+
+    def recipe(self, recipe, nutr_list, pcnt_cal):
+        write = self.f.write
+        write(html_recipe_head % (escape(recipe.desc), recipe.num_serv))
+        write(''.join([html_ingredient % (amount_text(ingr.amount),
+                                          escape(ingr.msre_desc),
+                                          escape(ingr.food_desc))
+                       for ingr in recipe.ingr_list]))
+        write(html_table_end)
+        if recipe.prep_desc:
+            write(html_preparation % escape(recipe.prep_desc))
+        values = NutrientIndex(nutr_list).values_of(NUTR_NUMS)
+        write(html_nutrients % tuple(values + list(pcnt_cal)))
+
+    def end(self):
+        self.f.write(html_end)
+
+#---------------------------------------------------------------------------
+# CSV and JSON
+
+class CsvWriter:
+    """One row per recipe: name, servings, category, ingredients as
+    'amount measure food' joined by '; ', preparation, the nutrients of
+    NUTRIENTS and the percentages of calories."""
+    def __init__(self, f):
+        import csv
+        self.writer = csv.writer(f)
+
+    def begin(self, title):
+        self.writer.writerow(['Recipe', 'Servings', 'Category',
+            'Ingredients', 'Preparation'] +
+            [label for label, num in NUTRIENTS] +
+            ['% Calories Protein', '% Calories Fat', '% Calories Carbohydrates'])
+
+    def recipe(self, recipe, nutr_list, pcnt_cal):
+        ingredients = '; '.join(['{0:s} {1:s} {2:s}'.format(
+                amount_text(ingr.amount), ingr.msre_desc, ingr.food_desc)
+            for ingr in recipe.ingr_list])
+        values = NutrientIndex(nutr_list).values_of(NUTR_NUMS)
+        self.writer.writerow([recipe.desc, recipe.num_serv,
+            getattr(recipe, 'cat_desc', ''), ingredients,
+            recipe.prep_desc or ''] +
+            ['{0:.3f}'.format(v) for v in values + list(pcnt_cal)])
+
+    def end(self):
+        pass
+
+class JsonWriter:
+    """A JSON list of recipe objects, written one recipe at a time."""
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def begin(self, title):
+        self.f.write('[\n')
+
+    def recipe(self, recipe, nutr_list, pcnt_cal):
+        import json
+        index = NutrientIndex(nutr_list)
+        obj = {'name': to_unicode(recipe.desc),
+               'servings': recipe.num_serv,
+               'category': to_unicode(getattr(recipe, 'cat_desc', None)),
+               'ingredients': [{'amount': ingr.amount,
+                                'measure': to_unicode(ingr.msre_desc),
+                                'NDB_No': ingr.food_num,
+                                'food': to_unicode(ingr.food_desc)}
+                               for ingr in recipe.ingr_list],
+               'preparation': to_unicode(recipe.prep_desc),
+               'nutrients': dict(zip(NUTR_NUMS, index.values_of(NUTR_NUMS))),
+               'pcnt_calories': list(pcnt_cal)}
+        if self.count:
+            self.f.write(',\n')
+        self.f.write(json.dumps(obj, sort_keys=True))
+        self.count += 1
+
+    def end(self):
+        self.f.write('\n]\n')
+
+WRITERS = {'html': HtmlWriter, 'csv': CsvWriter, 'json': JsonWriter}
+
+#---------------------------------------------------------------------------
+
+def recipe_records(db, category_no=None):
+    """Yield a Record for each recipe, or each recipe in category_no.
+
+    Recipes and their ingredients are read with one query each, ordered by
+    recipe_no, and merged, so memory use does not grow with the number of
+    recipes.
+    """
+    where, params = '', ()
+    if category_no is not None:
+        where, params = ' WHERE r.category_no = ?', (category_no,)
+    recipes = db.con.cursor()
+    recipes.execute("SELECT r.recipe_no, r.recipe_name, r.no_serv, " +
+        "c.category_desc, p.prep_desc FROM recipe r " +
+        "LEFT JOIN category c ON c.category_no = r.category_no " +
+        "LEFT JOIN preparation p ON p.recipe_no = r.recipe_no" + where +
+        " ORDER BY r.recipe_no", params)
+    ingredients = db.con.cursor()
+    ingredients.execute("SELECT i.recipe_no, i.amount, i.Msre_Desc, " +
+        "i.NDB_No, f.Long_Desc FROM ingredient i JOIN recipe r " +
+        "ON r.recipe_no = i.recipe_no " +
+        "LEFT JOIN food_des f ON f.NDB_No = i.NDB_No" + where +
+        " ORDER BY i.recipe_no, i.rowid", params)
+    ingr = ingredients.fetchone()
+    for recipe_no, name, num_serv, cat_desc, prep_desc in recipes:
+        ingr_list = []
+        while ingr and ingr[0] < recipe_no:
+            ingr = ingredients.fetchone()
+        while ingr and ingr[0] == recipe_no:
+            ingr_list.append(Record(amount=ingr[1], msre_desc=ingr[2],
+                food_num=ingr[3], food_desc=ingr[4] or ingr[3]))
+            ingr = ingredients.fetchone()
+        yield Record(num=recipe_no, desc=name, num_serv=num_serv,
+                     cat_desc=cat_desc, prep_desc=prep_desc,
+                     ingr_list=ingr_list)
+
+def export_recipes(db, f, fmt='html', category_no=None, title='Recipes'):
+    """Write every recipe, or the recipes of category_no, to file object f.
+
+    Nutrient values come from one engine.FoodData shared by all recipes,
+    so each food is read once. A recipe whose totals cannot be computed
+    (an obsolete food or measure) is left out and logged.
+
+    Return a tuple (number exported, number left out).
+    """
+    writer = WRITERS[fmt](f)
+    foods = engine.FoodData(db)
+    nutr_nums = NUTR_NUMS + [n for n in ('203', '204', '205')
+                             if n not in NUTR_NUMS]
+    exported = failed = 0
+    writer.begin(title)
+    for recipe in recipe_records(db, category_no):
+        if not recipe.num_serv:
+            warn("Recipe '{0:s}' not exported: no servings".format(recipe.desc))
+            failed += 1
+            continue
+        ingr_list = [(i.amount, i.msre_desc, i.food_num)
+                     for i in recipe.ingr_list]
+        try:
+            nutr_list = engine.recipe_totals(db, ingr_list, recipe.num_serv,
+                                             nutr_nums, foods)
+        except engine.EngineError, e:
+            warn("Recipe '{0:s}' not exported: {1:s}".format(recipe.desc,
+                                                             ' '.join(e.ebuf)))
+            failed += 1
+            continue
+        writer.recipe(recipe, nutr_list, engine.pcnt_calories(nutr_list))
+        exported += 1
+    writer.end()
+    return (exported, failed)
+
 class SaveAs:
     def __init__(self):
         pass
 
-    def value(self, num):
-        for nutr_num, nutr_val in self.nutr_list:
-            if nutr_num == num:
-                return nutr_val;
-        return 0.0
-
     def html(self, recipe, nutr_list, pcnt_cal, fn):
-        self.nutr_list = nutr_list
         f = file(fn, 'w')
-        f.write(template1 %(recipe.desc, recipe.desc, recipe.num_serv))
-        for ingr in recipe.ingr_list:
-            f.write(template2 %(ingr.amount, ingr.msre_desc, ingr.food_desc))
-        f.write(template3)
-
-        if (recipe.prep_desc):
-            f.write(template4 % (recipe.prep_desc))
-
-        f.write('<p><h2>Nutrient Composition (Per Serving)</h2></p>\n')
-
-        f.write(template5 % ('Macro-Nutrients'))
-        f.write(template6 %('Protein (g)', self.value(203), 
-            'Saturated Fat (g)', self.value(606)))
-        f.write(template6 %('Total Fat (g)', self.value(204), 
-            'Mono-Unsaturated Fat (g)', self.value(645)))
-        f.write(template6 %('Carbohydrates (g)', self.value(205), 
-            'Poly-Unsaturated Fat (g)', self.value(646)))
-        f.write(template6 %('Cholesterol (mg)', self.value(601), 
-            'Fiber (g)', self.value(291)))
-        f.write(template6 %('Calories (kcal)', self.value(208), 
-            'Energy (kJ)', self.value(268)))
-        f.write (template3)
-
-        f.write(template5 %('Micro-Nutrients'))
-        f.write(template6 %('A (mg RE)', self.value(318),
-            'Calcium (mg)', self.value(301)))
-        f.write(template6 %('E (mg ATE)', self.value(394),
-            'Iron (mg)', self.value(303)))
-        f.write(template6 %('C (mg)', self.value(401),
-            'Magnesium (mg)', self.value(304)))
-        f.write(template6 %('Thiamin (mg)', self.value(404),
-            'Phosphorus (mg)', self.value(305)))
-        f.write(template6 %('Riboflavin (mg)', self.value(405),
-            'Potassium (mg)', self.value(306)))
-        f.write(template6 %('Niacin (mg)', self.value(406),
-            'Sodium (mg)', self.value(307)))
-        f.write(template6 %('Panto. Acid (mg)', self.value(410),
-            'Zinc (mg)', self.value(309)))
-        f.write(template6 %('B6 (mg)', self.value(415),
-            'Copper (mg)', self.value(312)))
-        f.write(template6 %('Folate (cmg)', self.value(417),
-            'Manganese (mg)', self.value(315)))
-        f.write(template6 %('B12 (cmg)', self.value(418),
-            'Selenium (mcg)', self.value(317)))
-        f.write (template3)
-
-        f.write(template5 % ('Percentage of Calories'))
-        f.write(template6 %('Protein', pcnt_cal[0],
-            'Fat', pcnt_cal[1]))
-        f.write(template7 %('Carbohydrates', pcnt_cal[2]))
-        f.write (template3)
-        f.write('</html>\n')
-        f.close()
+        try:
+            self.write(f, 'html', recipe, nutr_list, pcnt_cal)
+        finally:
+            f.close()
+
+    def write(self, f, fmt, recipe, nutr_list, pcnt_cal):
+        """Write one recipe to file object f in format fmt."""
+        writer = WRITERS[fmt](f)
+        writer.begin(recipe.desc)
+        writer.recipe(recipe, nutr_list, pcnt_cal)
+        writer.end()
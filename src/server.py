@@ -0,0 +1,233 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""gnutrition-server: the GNUtrition data over HTTP/JSON.
+
+Serves on localhost only, one thread per request. Each request borrows a
+read-only connection from a pool; food, nutrient and food group names come
+from the Store dictionaries built once at startup.
+
+  GET /nutrients
+      Nutr_No -> nutrient description.
+  GET /foods?q=TEXT[&group=FdGrp_Cd][&limit=N]
+      Foods whose description contains TEXT.
+  GET /foods/NDB_No[?amount=N&measure=Msre_Desc]
+      Measures and nutrient composition of a food, per 100 gm or for the
+      amount of measure given.
+  GET /recipes/RECIPE_NO
+      Nutrient totals per serving and percent of calories.
+  GET /plans/PERSON_NO?start=YYYY-MM-DD&end=YYYY-MM-DD[&avg=1]
+      Plan nutrient totals and percent of the person's nutrient goals.
+"""
+import sys
+import json
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import database
+import engine
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+DEFAULT_PORT = 8078
+
+class NotFound(Exception): pass
+class BadRequest(Exception): pass
+
+def _param(params, name, default=None):
+    values = params.get(name)
+    if not values:
+        if default is None:
+            raise BadRequest("Parameter '{0:s}' is required.".format(name))
+        return default
+    return values[0]
+
+def _number(text, convert=int):
+    try:
+        return convert(text)
+    except ValueError:
+        raise BadRequest("'{0:s}' is not a number.".format(text))
+
+def _date(text):
+    """Return date text as YYYY-MM-DD, as dates are stored in the plans."""
+    import datetime
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise BadRequest("'{0:s}' is not a date (YYYY-MM-DD).".format(text))
+
+class NutritionService:
+    """The queries behind each URL, independent of HTTP."""
+    def __init__(self, pool, store):
+        self.pool = pool
+        self.store = store
+
+    def nutrients(self, con, params):
+        return self.store.nutr_num2desc
+
+    def food_search(self, con, params):
+        txt = _param(params, 'q')
+        limit = _number(_param(params, 'limit', '50'))
+        sql = "SELECT NDB_No, Long_Desc FROM food_des WHERE Long_Desc LIKE ?"
+        sql_params = ['%' + txt + '%']
+        group = _param(params, 'group', '')
+        if group:
+            sql += " AND FdGrp_Cd = ?"
+            sql_params.append(group)
+        con.query(sql + " ORDER BY Long_Desc LIMIT ?",
+                  sql_params=sql_params + [limit])
+        return [{'NDB_No': num, 'desc': desc}
+                for num, desc in con.get_result() or ()]
+
+    def food(self, con, NDB_No, params):
+        if NDB_No not in self.store.fd_num2desc:
+            raise NotFound("No food {0:s}".format(NDB_No))
+        con.query("SELECT Msre_Desc, Amount, Gm_wgt FROM weight " +
+                  "WHERE NDB_No = ? ORDER BY Seq", sql_params=(NDB_No,))
+        measures = [{'desc': d, 'amount': a, 'grams': g}
+                    for d, a, g in con.get_result() or ()]
+        if 'measure' in params:
+            amount = _number(_param(params, 'amount', '1'), float)
+            try:
+                totals = engine.food_totals(con, amount,
+                    _param(params, 'measure'), NDB_No,
+                    self.store.nutr_num_list)
+            except engine.EngineError, e:
+                raise BadRequest(' '.join(e.ebuf))
+        else:
+            totals = engine.food_nutrients(con, NDB_No)
+        return {'NDB_No': NDB_No, 'desc': self.store.fd_num2desc[NDB_No],
+                'measures': measures, 'nutrients': dict(totals)}
+
+    def recipe(self, con, recipe_no, params):
+        try:
+            totals = engine.stored_recipe_totals(con, _number(recipe_no),
+                self.store.nutr_num_list)
+        except engine.EngineError, e:
+            raise NotFound(' '.join(e.ebuf))
+        return {'recipe_no': int(recipe_no), 'nutrients': dict(totals),
+                'pcnt_calories': engine.pcnt_calories(totals)}
+
+    def plan(self, con, person_no, params):
+        person_no = _number(person_no)
+        start = _date(_param(params, 'start'))
+        end = _date(_param(params, 'end'))
+        if end < start:
+            raise BadRequest("End date {0:s} is before start date {1:s}."
+                             .format(end, start))
+        avg = _param(params, 'avg', '0') not in ('0', 'no', 'false')
+        try:
+            totals = engine.plan_totals(con, start, end, avg,
+                person_no=person_no, nutr_nums=self.store.nutr_num_list)
+        except engine.EngineError, e:
+            raise BadRequest(' '.join(e.ebuf))
+        goals = engine.nutr_goal(con, person_no)
+        return {'person_no': person_no, 'start': start, 'end': end,
+                'nutrients': dict(totals),
+                'pcnt_goal': dict(engine.pcnt_nutr_goal(totals, goals))}
+
+    def dispatch(self, path, params):
+        """Return the result for URL path as a JSON-serializable object."""
+        parts = [p for p in path.split('/') if p]
+        if parts == ['nutrients']:
+            method, args = self.nutrients, ()
+        elif parts == ['foods']:
+            method, args = self.food_search, ()
+        elif len(parts) == 2 and parts[0] == 'foods':
+            method, args = self.food, (parts[1],)
+        elif len(parts) == 2 and parts[0] == 'recipes':
+            method, args = self.recipe, (parts[1],)
+        elif len(parts) == 2 and parts[0] == 'plans':
+            method, args = self.plan, (parts[1],)
+        else:
+            raise NotFound("No such resource {0:s}".format(path))
+        con = self.pool.get()
+        try:
+            return method(con, *(args + (params,)))
+        finally:
+            self.pool.put(con)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Set by make_server()
+    service = None
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        try:
+            result = self.service.dispatch(url.path, params)
+            self.send_json(200, result)
+        except NotFound, e:
+            self.send_json(404, {'error': str(e)})
+        except BadRequest, e:
+            self.send_json(400, {'error': str(e)})
+        except Exception, e:
+            error('{0:s}: {1!r}'.format(self.path, e))
+            self.send_json(500, {'error': 'Internal error'})
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj, sort_keys=True)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        debug(fmt % args)
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def make_server(port=DEFAULT_PORT, dbfile=None, pool_size=4):
+    """Return an HTTP server bound to localhost, ready to serve_forever()."""
+    import store
+    database.Database(dbfile)   # Store uses the shared connection
+    service = NutritionService(database.ConnectionPool(pool_size, dbfile),
+                               store.Store())
+    class Handler(RequestHandler):
+        pass
+    Handler.service = service
+    return ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage=__doc__.split('\n\n', 1)[1].rstrip())
+    parser.add_option('--db', dest='dbfile', default=None,
+        help='SQLite database file (default ~/.gnutrition/gnutr_db.lt3)')
+    parser.add_option('-p', '--port', dest='port', type='int',
+        default=DEFAULT_PORT, help='port to listen on (default %default)')
+    parser.add_option('--connections', dest='pool_size', type='int',
+        default=4, help='number of database connections (default %default)')
+    (opts, args) = parser.parse_args(argv)
+
+    from util.log import initLogger
+    initLogger(logLevel='warn', logDisk=False, logConsole=True)
+    server = make_server(opts.port, opts.dbfile, opts.pool_size)
+    sys.stderr.write('Serving on http://127.0.0.1:{0:d}/\n'.format(opts.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
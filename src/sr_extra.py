@@ -0,0 +1,281 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""SR tables not needed to start GNUtrition.
+
+The footnotes, LanguaL food descriptions and nutrient data sources of the
+USDA SR release are not loaded by init_USDA_data(). Each is loaded when
+first asked for with ensure_loaded(), or in the background after startup
+by load_in_background(). A table is marked in sr_extra_loaded once it
+and its indexes are complete.
+
+Only the table being loaded is locked. A call from the GUI thread for a
+table the background thread is loading waits until that table is done,
+unless it passes wait=False: it then gets no rows and can ask again
+later.
+
+The LanguaL factors of foods are kept by FacetIndex, an inverted index
+from factor code to the set of foods described by it, for food searches
+limited to foods with given facets.
+"""
+import threading
+import database
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+# Tables in the order they are loaded in the background, smallest first:
+# (table, CREATE TABLE statement, number of columns, CREATE INDEX statements)
+EXTRA_TABLES = (
+    ('src_cd', "CREATE TABLE src_cd " +
+        "(Src_Cd TEXT PRIMARY KEY NOT NULL, " +
+        "SrcCd_Desc TEXT NOT NULL)", 2, ()),
+    ('deriv_cd', "CREATE TABLE deriv_cd " +
+        "(Deriv_Cd TEXT PRIMARY KEY NOT NULL, " +
+        "Deriv_Desc TEXT NOT NULL)", 2, ()),
+    ('footnote', "CREATE TABLE footnote " +
+        "(NDB_No TEXT NOT NULL, " +
+        "Footnt_No TEXT NOT NULL, " +
+        # 'D' food description, 'M' measure, 'N' nutrient value
+        "Footnt_Typ TEXT NOT NULL, " +
+        "Nutr_No TEXT, " +
+        "Footnt_Txt TEXT NOT NULL)", 5,
+        ("CREATE INDEX footnote_NDB_No ON footnote (NDB_No)",)),
+    ('data_src', "CREATE TABLE data_src " +
+        "(DataSrc_ID TEXT PRIMARY KEY NOT NULL, " +
+        "Authors TEXT, " +
+        "Title TEXT NOT NULL, " +
+        "Year TEXT, " +
+        "Journal TEXT, " +
+        "Vol_City TEXT, " +
+        "Issue_State TEXT, " +
+        "Start_Page TEXT, " +
+        "End_Page TEXT)", 9, ()),
+    ('langdesc', "CREATE TABLE langdesc " +
+        "(Factor_Code TEXT PRIMARY KEY NOT NULL, " +
+        "Description TEXT NOT NULL)", 2, ()),
+    ('langual', "CREATE TABLE langual " +
+        "(NDB_No TEXT NOT NULL, " +
+        "Factor_Code TEXT NOT NULL, " +
+        "PRIMARY KEY(NDB_No, Factor_Code))", 2,
+        ("CREATE INDEX langual_Factor_Code ON langual (Factor_Code)",)),
+    ('datsrcln', "CREATE TABLE datsrcln " +
+        "(NDB_No TEXT NOT NULL, " +
+        "Nutr_No TEXT NOT NULL, " +
+        "DataSrc_ID TEXT NOT NULL, " +
+        "PRIMARY KEY(NDB_No, Nutr_No, DataSrc_ID))", 3,
+        ("CREATE INDEX datsrcln_DataSrc_ID ON datsrcln (DataSrc_ID)",)))
+
+TABLE_NAMES = [t[0] for t in EXTRA_TABLES]
+
+# Rows inserted per transaction, so the database is never locked for long
+CHUNK = 10000
+
+# table -> lock held while the table is loaded, so a table asked for by
+# the GUI is not loaded a second time by the background thread
+_table_locks = {}
+_table_locks_lock = threading.Lock()
+
+def _table_lock(table):
+    _table_locks_lock.acquire()
+    try:
+        return _table_locks.setdefault(table, threading.Lock())
+    finally:
+        _table_locks_lock.release()
+
+def loaded_tables(db):
+    """Return the set of extra tables already loaded into db."""
+    db.query("CREATE TABLE IF NOT EXISTS sr_extra_loaded " +
+             "(table_name TEXT PRIMARY KEY NOT NULL)")
+    db.query("SELECT table_name FROM sr_extra_loaded")
+    return set([row[0] for row in db.get_result() or ()])
+
+def load_table(db, table):
+    """Load one extra table with its indexes from the installed data.
+
+    Rows are committed CHUNK at a time, letting other connections write
+    in between. Use ensure_loaded() unless the table is to be reloaded.
+    """
+    import csv
+    import time
+    import install
+    from os import path
+    from transfer import chunks
+    from util.exception import AppFileReadError
+    global _facet_index
+    (name, create_sql, width, indexes) = [t for t in EXTRA_TABLES
+                                          if t[0] == table][0]
+    if table in ('langual', 'langdesc'):
+        _facet_index = None
+    db.query("DROP TABLE IF EXISTS {0:s}".format(table))
+    db.create_table(create_sql, table)
+    data_file = path.join(install.idir, 'data', table.upper() + '.txt')
+    sql = "INSERT INTO {0:s} VALUES ({1:s})".format(table,
+                                                    ', '.join(['?'] * width))
+    try:
+        f = open(data_file, 'r')
+    except IOError, e:
+        e = AppFileReadError(e)
+        e = e + "Failed to read data file '{0:s}'".format(data_file)
+        raise e
+    try:
+        for rows in chunks(csv.reader(f, delimiter='^', quotechar="'"),
+                           CHUNK):
+            db.query(sql, many=True, sql_params=rows)
+            time.sleep(0)   # let the GUI thread run
+    finally:
+        f.close()
+    for sql in indexes:
+        db.query(sql)
+    db.query("INSERT OR REPLACE INTO sr_extra_loaded VALUES (?)",
+             sql_params=(table,))
+    info("loaded table '{0:s}'".format(table))
+
+def ensure_loaded(db, table, wait=True):
+    """Load table into db now unless it is loaded already.
+
+    Return True once the table is loaded. If another thread is loading
+    it, wait for that unless wait is False, and then return False.
+    """
+    if table in loaded_tables(db):
+        return True
+    lock = _table_lock(table)
+    if not lock.acquire(wait):
+        return False
+    try:
+        if table not in loaded_tables(db):
+            load_table(db, table)
+    finally:
+        lock.release()
+    return True
+
+def load_in_background(dbfile=None):
+    """Load every extra table not yet loaded in a daemon thread.
+
+    The thread has its own connection to the database. Return the thread,
+    or None if there is nothing to load.
+    """
+    missing = [t for t in TABLE_NAMES
+               if t not in loaded_tables(database.Database())]
+    if not missing:
+        return None
+
+    def run():
+        db = database.Connection(dbfile)
+        try:
+            for table in missing:
+                ensure_loaded(db, table)
+        except Exception, e:
+            error('Loading SR tables failed: {0!s}'.format(e))
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, name='SR tables')
+    thread.setDaemon(True)
+    thread.start()
+    return thread
+
+def food_footnotes(db, NDB_No, wait=True):
+    """Return list of (Footnt_Typ, Nutr_No, Footnt_Txt) for food NDB_No.
+
+    With wait False, return no footnotes while the table is being loaded.
+    """
+    if not ensure_loaded(db, 'footnote', wait):
+        return ()
+    db.query("SELECT Footnt_Typ, Nutr_No, Footnt_Txt FROM footnote " +
+             "WHERE NDB_No = ? ORDER BY Footnt_No", sql_params=(NDB_No,))
+    return db.get_result() or ()
+
+def nutrient_sources(db, NDB_No, Nutr_No, wait=True):
+    """Return list of (Authors, Title, Year, Journal) of the references
+    for the value of nutrient Nutr_No of food NDB_No.
+
+    With wait False, return no references while the tables are being
+    loaded.
+    """
+    if not (ensure_loaded(db, 'data_src', wait) and
+            ensure_loaded(db, 'datsrcln', wait)):
+        return ()
+    db.query("SELECT Authors, Title, Year, Journal FROM datsrcln " +
+             "JOIN data_src ON data_src.DataSrc_ID = datsrcln.DataSrc_ID " +
+             "WHERE NDB_No = ? AND Nutr_No = ?",
+             sql_params=(NDB_No, Nutr_No))
+    return db.get_result() or ()
+
+class FacetIndex:
+    """LanguaL factors of every food, indexed both ways.
+
+    'foods' maps a factor code to the set of NDB_No it describes (the
+    inverted index searched), 'facets' maps NDB_No to its factor codes
+    and 'desc' maps a factor code to its description.
+    """
+    def __init__(self, db):
+        ensure_loaded(db, 'langual')
+        ensure_loaded(db, 'langdesc')
+        self.foods = {}
+        self.facets = {}
+        db.query("SELECT NDB_No, Factor_Code FROM langual")
+        for NDB_No, code in db.get_result() or ():
+            self.foods.setdefault(code, set()).add(NDB_No)
+            self.facets.setdefault(NDB_No, []).append(code)
+        db.query("SELECT Factor_Code, Description FROM langdesc")
+        self.desc = dict(db.get_result() or ())
+
+    def search(self, codes, NDB_Nos=None):
+        """Return the set of foods described by every code in codes.
+
+        With NDB_Nos, a sequence of food numbers such as the result of a
+        text search, only those foods are returned.
+        """
+        sets = [self.foods.get(code, set()) for code in codes]
+        if NDB_Nos is not None:
+            sets.append(set(NDB_Nos))
+        if not sets:
+            return set()
+        # Intersect from the smallest set
+        sets.sort(key=len)
+        found = set(sets[0])
+        for s in sets[1:]:
+            found &= s
+            if not found:
+                break
+        return found
+
+    def food_facets(self, NDB_No):
+        """Return list of (code, description) of the factors of a food."""
+        return [(code, self.desc.get(code, ''))
+                for code in self.facets.get(NDB_No, ())]
+
+_facet_index = None
+
+def facet_index(db):
+    """Return the FacetIndex, built when first asked for.
+
+    It is built again after load_table() reloads langual or langdesc.
+    """
+    global _facet_index
+    if _facet_index is None:
+        _facet_index = FacetIndex(db)
+    return _facet_index
+
+def filter_by_facets(db, NDB_Nos, codes):
+    """Return the foods of NDB_Nos described by every LanguaL code in codes,
+    in the order of NDB_Nos."""
+    found = facet_index(db).search(codes, NDB_Nos)
+    return [num for num in NDB_Nos if num in found]
@@ -0,0 +1,233 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Upgrade of the USDA Standard Reference data to a new release.
+
+Instead of dropping and reloading the SR tables as init_USDA_data() does,
+the new release is compared with the loaded one and only the rows that
+were added, changed or removed are written:
+
+  1. each data file of the release is loaded into a TEMP table shaped
+     like the SR table;
+  2. rows of the new release not in the loaded one (SQL EXCEPT) are the
+     added or changed rows, keys of loaded rows not in the new release
+     are the changed or removed rows;
+  3. the changes of every table are applied in one transaction.
+
+The release is read from a local SR archive (zip file) or a directory of
+its data files, so no network access is needed; get_database_archive()
+in version.py only downloads the archive.
+
+Afterwards recipe ingredients and food plan entries whose food or measure
+is no longer in the SR data are listed in table obsolete_ref.
+"""
+import csv
+import zipfile
+from os import path, listdir
+import database
+from util.exception import AppException, AppFileReadError
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+class UpgradeError(AppException): pass
+
+# SR tables in the order they are compared, with the key of their rows
+SR_TABLES = (
+    ('fd_group', ('FdGrp_Cd',)),
+    ('food_des', ('NDB_No',)),
+    ('nutr_def', ('Nutr_No',)),
+    ('nut_data', ('NDB_No', 'Nutr_No')),
+    ('weight', ('NDB_No', 'Seq')))
+
+def clean_lines(lines):
+    """Yield lines of an SR data file prepared as by prep_data_files.sh:
+    DOS line ends and end of file marks dropped, '~' text quotes removed."""
+    for line in lines:
+        line = line.rstrip('\r\n\x1a').replace('~', '')
+        if line:
+            yield line
+
+class Release:
+    """The data files of an SR release in a zip archive or a directory."""
+    def __init__(self, source):
+        self.source = source
+        self.zip = None
+        try:
+            if path.isdir(source):
+                names = [path.join(source, n) for n in listdir(source)]
+            elif zipfile.is_zipfile(source):
+                self.zip = zipfile.ZipFile(source)
+                names = self.zip.namelist()
+            else:
+                raise UpgradeError("'{0:s}' is not an SR archive or " \
+                    "directory".format(source))
+        except (IOError, OSError, zipfile.BadZipfile), e:
+            e = AppFileReadError(e)
+            e = e + "Failed to read SR release '{0:s}'".format(source)
+            raise e
+        # data file name (FOOD_DES.txt) -> name in archive or path
+        self.files = dict([(path.basename(n).upper(), n) for n in names])
+
+    def has_table(self, table):
+        return table.upper() + '.TXT' in self.files
+
+    def rows(self, table):
+        """Return a reader of the rows of the data file of table."""
+        name = self.files.get(table.upper() + '.TXT')
+        if name is None:
+            raise UpgradeError("No data file for table '{0:s}' in {1:s}"
+                .format(table, self.source))
+        if self.zip:
+            f = self.zip.open(name)
+        else:
+            f = open(name, 'rb')
+        return csv.reader(clean_lines(f), delimiter='^', quotechar="'")
+
+    def close(self):
+        if self.zip:
+            self.zip.close()
+
+def _columns(db, table):
+    db.query("PRAGMA table_info({0:s})".format(table))
+    return [row[1] for row in db.get_result()]
+
+def _key_match(key, a, b):
+    return ' AND '.join(['{0:s}.{2:s} = {1:s}.{2:s}'.format(a, b, k)
+                         for k in key])
+
+def stage(db, release, table, key):
+    """Load the release's data of table and find the rows that differ.
+
+    Leaves TEMP tables new_TABLE (the release's data), add_TABLE (rows to
+    insert) and del_TABLE (keys of rows to delete). Return the counts
+    (added, changed, removed).
+    """
+    columns = _columns(db, table)
+    if not columns:
+        raise UpgradeError("Table '{0:s}' is not loaded".format(table))
+    new, add, rm = 'new_' + table, 'add_' + table, 'del_' + table
+    for t in (new, add, rm):
+        db.query("DROP TABLE IF EXISTS temp.{0:s}".format(t))
+    # Same column names and types, so values convert as in the SR table
+    db.query("CREATE TEMP TABLE {0:s} AS SELECT * FROM main.{1:s} WHERE 0"
+             .format(new, table))
+    rows = release.rows(table)
+    width = len(columns)
+    def checked(rows):
+        for row in rows:
+            if len(row) != width:
+                raise UpgradeError("{0:s} has {1:d} fields, table '{2:s}' " \
+                    "{3:d}: the release needs a new database".format(
+                        table.upper() + '.txt', len(row), table, width))
+            yield row
+    db.query("INSERT INTO temp.{0:s} VALUES ({1:s})".format(new,
+             ', '.join(['?'] * width)), many=True, sql_params=checked(rows))
+    db.query("CREATE TEMP TABLE {0:s} AS SELECT * FROM temp.{1:s} " \
+             "EXCEPT SELECT * FROM main.{2:s}".format(add, new, table))
+    db.query("CREATE TEMP TABLE {0:s} AS SELECT {1:s} FROM " \
+             "(SELECT * FROM main.{2:s} EXCEPT SELECT * FROM temp.{3:s})"
+             .format(rm, ', '.join(key), table, new))
+    db.query("CREATE INDEX temp.{0:s}_key ON {0:s} ({1:s})".format(rm,
+             ', '.join(key)))
+    db.query("SELECT COUNT(*) FROM temp.{0:s}".format(add))
+    n_add = db.get_single_result()
+    db.query("SELECT COUNT(*) FROM temp.{0:s}".format(rm))
+    n_rm = db.get_single_result()
+    db.query("SELECT COUNT(*) FROM temp.{0:s} a WHERE EXISTS (SELECT 1 " \
+             "FROM temp.{1:s} d WHERE {2:s})".format(add, rm,
+             _key_match(key, 'd', 'a')))
+    changed = db.get_single_result()
+    db.query("DROP TABLE temp.{0:s}".format(new))
+    return (n_add - changed, changed, n_rm - changed)
+
+def apply_changes(db, table, key):
+    """Delete the staged keys of table and insert the staged rows.
+
+    Run with commit=False; the caller commits.
+    """
+    db.query("DELETE FROM main.{0:s} WHERE EXISTS (SELECT 1 FROM " \
+             "temp.del_{0:s} d WHERE {1:s})".format(table,
+             _key_match(key, 'd', 'main.' + table)), commit=False)
+    db.query("INSERT INTO main.{0:s} SELECT * FROM temp.add_{0:s}"
+             .format(table), commit=False)
+
+def create_obsolete_ref(db):
+    db.create_table("CREATE TABLE IF NOT EXISTS obsolete_ref " +
+        "(table_name TEXT NOT NULL, " +
+        # recipe_no for 'ingredient', rowid for 'food_plan'
+        "ref_no INTEGER NOT NULL, " +
+        "NDB_No TEXT NOT NULL, " +
+        "Msre_Desc TEXT NOT NULL, " +
+        # 'food' or 'measure'
+        "reason TEXT NOT NULL)", 'obsolete_ref')
+
+def flag_obsolete(db):
+    """Fill obsolete_ref with user rows referring to removed SR data.
+
+    Run with commit=False; the caller commits. Return the number of rows
+    flagged for 'ingredient' and 'food_plan'.
+    """
+    db.query("DELETE FROM obsolete_ref", commit=False)
+    counts = {}
+    for table, ref_no in (('ingredient', 'recipe_no'),
+                          ('food_plan', 'rowid')):
+        db.query("INSERT INTO obsolete_ref SELECT '{0:s}', u.{1:s}, " \
+            "u.NDB_No, u.Msre_Desc, " \
+            "CASE WHEN f.NDB_No IS NULL THEN 'food' ELSE 'measure' END " \
+            "FROM {0:s} u LEFT JOIN food_des f ON f.NDB_No = u.NDB_No " \
+            "WHERE f.NDB_No IS NULL OR NOT EXISTS (SELECT 1 FROM weight w " \
+            "WHERE w.NDB_No = u.NDB_No AND w.Msre_Desc = u.Msre_Desc)"
+            .format(table, ref_no), commit=False)
+        db.query("SELECT COUNT(*) FROM obsolete_ref WHERE table_name = ?",
+                 sql_params=(table,), commit=False)
+        counts[table] = db.get_single_result()
+    return counts
+
+def upgrade(db, source):
+    """Upgrade the SR tables of db to the release in source.
+
+    Parameter source is an SR zip archive or a directory of data files.
+    Every table of SR_TABLES must be in the release. Return a dictionary
+    table -> (added, changed, removed) row counts, and under 'obsolete'
+    the rows flagged by flag_obsolete().
+    """
+    release = Release(source)
+    try:
+        for table, key in SR_TABLES:
+            if not release.has_table(table):
+                raise UpgradeError("No data file for table '{0:s}' in {1:s}"
+                    .format(table, source))
+        stats = {}
+        for table, key in SR_TABLES:
+            stats[table] = stage(db, release, table, key)
+            info("SR table '{0:s}': {1:d} added, {2:d} changed, " \
+                 "{3:d} removed".format(table, *stats[table]))
+    finally:
+        release.close()
+    create_obsolete_ref(db)
+    # A failed query rolls back the whole transaction
+    for table, key in SR_TABLES:
+        apply_changes(db, table, key)
+    stats['obsolete'] = flag_obsolete(db)
+    db.commit()
+    for table, key in SR_TABLES:
+        db.query("DROP TABLE temp.add_{0:s}".format(table))
+        db.query("DROP TABLE temp.del_{0:s}".format(table))
+    return stats
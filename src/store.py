@@ -16,7 +16,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from collections import OrderedDict
 import database
+import engine
+
+# Number of foods whose measures are kept by Store.get_measures()
+MSRE_CACHE_SIZE = 1000
 
 class Store:
     _shared_state = {}
@@ -35,6 +40,9 @@ class Store:
         self.fg_desc2num = {} 
         self.fd_desc2num = {} 
         self.fd_num2desc = {} 
+        # NDB_No -> ((Msre_Desc, Amount, Gm_wgt), ...), least recently
+        # used first
+        self.measures = OrderedDict()
         self.db = database.Database()
         self.create_nutr_num_list()
         self.create_nutr_desc_list()
@@ -105,8 +113,48 @@ class Store:
             self.fd_desc2num[desc] = num
             self.fd_num2desc[num] = desc
 
+    def get_measures(self, fd_num):
+        """Return ((Msre_Desc, Amount, Gm_wgt), ...) of food fd_num.
+
+        Measures are in Seq order. The measures of the last MSRE_CACHE_SIZE
+        foods used are kept.
+        """
+        try:
+            measures = self.measures.pop(fd_num)
+        except KeyError:
+            self.db.query("SELECT Msre_Desc, Amount, Gm_wgt FROM weight " +
+                "WHERE NDB_No = ? ORDER BY Seq", sql_params=(fd_num,))
+            measures = self.db.get_result() or ()
+            if len(self.measures) >= MSRE_CACHE_SIZE:
+                self.measures.popitem(last=False)
+        self.measures[fd_num] = measures
+        return measures
+
+    def load_measures(self, fd_nums):
+        """Read the measures of every food of fd_nums not already kept."""
+        fd_nums = [n for n in set(fd_nums) if n not in self.measures]
+        fd_nums = fd_nums[:MSRE_CACHE_SIZE]
+        for i in range(0, len(fd_nums), 500):
+            chunk = fd_nums[i:i+500]
+            measures = dict([(n, []) for n in chunk])
+            self.db.query("SELECT NDB_No, Msre_Desc, Amount, Gm_wgt " +
+                "FROM weight WHERE NDB_No IN ({0:s}) ".format(
+                    ', '.join(['?'] * len(chunk))) +
+                "ORDER BY NDB_No, Seq", sql_params=chunk)
+            for num, desc, amount, gm_wgt in self.db.get_result() or ():
+                measures[num].append((desc, amount, gm_wgt))
+            for num in chunk:
+                if len(self.measures) >= MSRE_CACHE_SIZE:
+                    self.measures.popitem(last=False)
+                self.measures[num] = tuple(measures[num])
+
+    def gm_per_measure(self, fd_num, msre_desc):
+        """Return the gram weight of one msre_desc of food fd_num."""
+        for desc, amount, gm_wgt in self.get_measures(fd_num):
+            if desc == msre_desc:
+                return float(gm_wgt)
+        raise engine.EngineError("No measure '{0:s}' for NDB_No {1:s}".format(
+                msre_desc, fd_num))
+
     def get_msre_desc_tuples(self, fd_num):
-        self.db.query("SELECT Msre_Desc FROM weight WHERE " +
-            "NDB_No = '{0:s}'".format(fd_num))
-        result = self.db.get_result()
-        return result
+        return tuple([(m[0],) for m in self.get_measures(fd_num)])
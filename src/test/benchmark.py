@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the database and computation paths of GNUtrition.
+
+A fresh database is built in a temporary directory (or at --db), the USDA
+data loaded and filled with synthetic users by gen_user_data.py. Each
+benchmark is run --repeat times and the results written as JSON, so the
+files of two releases can be compared. Benchmarks of GUI classes are
+reported as skipped when gtk cannot be imported.
+
+    benchmark.py [--persons N] [--recipes N] [--years N] [--repeat N]
+                 [--db FILE] [-o FILE]
+"""
+import sys
+import json
+import time
+import platform
+import sqlite3
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+class Skip(Exception): pass
+
+def timed(func, repeat, setup=None):
+    """Run func repeat times, return dictionary of timings in seconds.
+
+    setup, if given, is called before each run and not timed.
+    """
+    times = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    times.sort()
+    stats = {'runs': repeat, 'min': times[0], 'max': times[-1],
+             'median': times[len(times) / 2],
+             'mean': sum(times) / len(times)}
+    if isinstance(result, (list, tuple)):
+        stats['rows'] = len(result)
+    return stats
+
+def bare(cls, **attrs):
+    """Return an instance of GUI class cls without creating its widgets."""
+    import new
+    return new.instance(cls, attrs)
+
+def gui_module(name):
+    try:
+        import gtk
+    except ImportError:
+        raise Skip('gtk is not available')
+    return __import__(name)
+
+class Benchmarks:
+    def __init__(self, db, counts, repeat):
+        import person
+        self.db = db
+        self.repeat = repeat
+        self.counts = counts
+        self.person_no = counts['first_person']
+        # Act as the first synthetic person without touching the config
+        self.person = person.Person()
+        self.person.person_num = self.person_no
+
+    def store(self):
+        import store
+        def setup():
+            store.Store._shared_state.clear()
+        return timed(store.Store, self.repeat, setup)
+
+    def person_setup(self):
+        return timed(self.person.setup, self.repeat)
+
+    def plan_compute(self):
+        import store
+        plan_compute_dlg = gui_module('plan_compute_dlg')
+        dlg = bare(plan_compute_dlg.PlanComputeDlg, db=self.db)
+        self.person.setup()
+        start, end = self.counts['first_date'], self.db.curdate()
+        return timed(lambda: dlg.compute(start, end, True), self.repeat)
+
+    def search_by_nutr_constr(self):
+        import engine
+        # Protein, calcium and iron up, fat down
+        constr_list = [('203', 1.0), ('301', 0.5), ('303', 0.5), ('204', -1.0)]
+        return timed(lambda: engine.search_by_nutr_constr(self.db,
+            constr_list, None, 0, 100), self.repeat)
+
+    def food_srch_res_create_tree(self):
+        import store
+        food_srch_res_dlg = gui_module('food_srch_res_dlg')
+        import gtk
+        dlg = bare(food_srch_res_dlg.FoodSrchResDlg, store=store.Store())
+        self.db.query("SELECT NDB_No FROM food_des ORDER BY Long_Desc")
+        fd_num_list = [row[0] for row in self.db.get_result()][:2000]
+        def create_tree():
+            dlg.create_tree(gtk.TreeStore(str, str), fd_num_list)
+            return fd_num_list
+        return timed(create_tree, self.repeat)
+
+    def plan_win_save_plan(self):
+        plan_win = gui_module('plan_win')
+        win = bare(plan_win.PlanWin, db=self.db, person=self.person)
+        self.person.setup()
+        return timed(win.save_plan, self.repeat)
+
+    def startup_app(self):
+        """Return a RunApp and a function resetting what startup builds."""
+        run_app = gui_module('run_app')
+        import store
+        import help
+        app = bare(run_app.RunApp, first_run=False)
+        def reset():
+            if hasattr(app, 'base_win'):
+                app.base_win.ui.win.destroy()
+            store.Store._shared_state.clear()
+            help.selected_browser = None
+            self.person.plan_copied = False
+        return app, reset
+
+    def startup(self):
+        """RunApp.startup() up to showing the last used view."""
+        app, reset = self.startup_app()
+        return timed(app.startup, self.repeat, reset)
+
+    def startup_deferred(self):
+        """The idle tasks after startup, except the network version check."""
+        app, reset = self.startup_app()
+        def setup():
+            reset()
+            app.startup()
+        def run():
+            for name, task in app.deferred:
+                if task != app.check_version:
+                    task()
+        return timed(run, self.repeat, setup)
+
+    def run(self, names):
+        results = {}
+        for name in names:
+            try:
+                results[name] = getattr(self, name)()
+            except Skip, e:
+                results[name] = {'skipped': str(e)}
+            sys.stderr.write('{0:s}: {1!r}\n'.format(name, results[name]))
+        return results
+
+BENCHMARKS = ['store', 'person_setup', 'plan_compute', 'search_by_nutr_constr',
+              'food_srch_res_create_tree', 'plan_win_save_plan', 'startup',
+              'startup_deferred']
+
+def main(argv=None):
+    from optparse import OptionParser
+    import tempfile
+    import shutil
+    parser = OptionParser(usage=__doc__.split('\n\n')[-1].strip())
+    parser.add_option('--persons', type='int', default=20)
+    parser.add_option('--recipes', type='int', default=2000)
+    parser.add_option('--years', type='int', default=3)
+    parser.add_option('--seed', type='int', default=1)
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--db', dest='dbfile', default=None,
+        help='build the database in this file instead of a temporary one')
+    parser.add_option('-o', '--output', dest='output', default='-',
+        help='write the JSON results to this file')
+    parser.add_option('-b', '--benchmark', dest='names', action='append',
+        help='run only this benchmark (may be repeated): ' +
+             ', '.join(BENCHMARKS))
+    (opts, args) = parser.parse_args(argv)
+
+    from util.log import initLogger
+    initLogger(logLevel='warn', logDisk=False, logConsole=True)
+    import install
+    import database
+    import gen_user_data
+
+    tmpdir = None
+    dbfile = opts.dbfile
+    if not dbfile:
+        tmpdir = tempfile.mkdtemp(prefix='gnutrition-bench')
+        dbfile = path.join(tmpdir, 'gnutr_db.lt3')
+    try:
+        db = database.Database(dbfile)
+        results = {}
+        results['init_USDA_data'] = timed(db.init_USDA_data, 1)
+        db.init_user()
+        start = time.time()
+        counts = gen_user_data.generate(db, opts.persons, opts.recipes,
+                                        opts.years, opts.seed)
+        results['generate_user_data'] = {'runs': 1,
+                                         'min': time.time() - start}
+        counts['first_person'] = gen_user_data.FIRST_PERSON
+        bench = Benchmarks(db, counts, opts.repeat)
+        results.update(bench.run(opts.names or BENCHMARKS))
+        db.close()
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+    report = {'gnutrition': install.gnutr_version(),
+              'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version,
+              'platform': platform.platform(),
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'params': {'persons': opts.persons, 'recipes': opts.recipes,
+                         'years': opts.years, 'seed': opts.seed,
+                         'repeat': opts.repeat},
+              'data': counts,
+              'results': results}
+    out = sys.stdout if opts.output == '-' else open(opts.output, 'w')
+    json.dump(report, out, indent=1, sort_keys=True)
+    out.write('\n')
+    if out is not sys.stdout:
+        out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check the computations of engine.py and calc_rdi.py on the test
+database, and the day counts and measure matching of database.py.
+
+The RDIs are compared with values of the tables compiled into calc_rdi.py
+before they were moved to the database (GNUtrition 0.32), less the last
+thiamin (404) entry that made every thiamin RDI 0. Those tables had no
+cholesterol value below age 18, so only adults are compared.
+"""
+import sys
+import shutil
+import tempfile
+from os import path
+from testdb import make, check
+
+# (age, weight, female, pregnant, lactating) -> {Nutr_No: RDI}
+RDI = {
+    (18, 55, 1, 0, 0): {
+        '203': 41.25, '204': 62.054, '205': 231.068, '208': 1861.62,
+        '268': 7756.75, '269': 43.5977, '291': 30, '301': 1200, '303': 15,
+        '304': 300, '305': 1200, '306': 2000, '307': 500, '309': 12,
+        '312': 1.5, '315': 1.5, '317': 50, '392': 800, '394': 8, '401': 60,
+        '404': 1.1, '405': 1.3, '406': 15, '410': 4, '415': 1.5, '417': 180,
+        '418': 2, '501': 0.1925, '502': 0.385, '503': 0.55, '504': 0.77,
+        '505': 0.66, '506': 0.3575, '507': 0.3575, '508': 0.385, '509': 0.385,
+        '510': 0.55, '512': 0.44, '601': 300, '606': 20.6847, '618': 2.06847,
+        '619': 0.413693, '645': 20.6847, '646': 20.6847},
+    (25, 60, 1, 1, 0): {
+        '203': 51, '204': 65.5472, '205': 244.075, '208': 1966.42,
+        '268': 8193.4, '269': 46.0519, '291': 30, '301': 1200, '303': 30,
+        '304': 320, '305': 1200, '306': 2000, '307': 500, '309': 15,
+        '312': 1.5, '315': 1.5, '317': 65, '392': 800, '394': 10, '401': 70,
+        '404': 1.5, '405': 1.6, '406': 17, '410': 4, '415': 2.2, '417': 400,
+        '418': 2.2, '501': 0.21, '502': 0.42, '503': 0.6, '504': 0.84,
+        '505': 0.72, '506': 0.39, '507': 0.39, '508': 0.42, '509': 0.42,
+        '510': 0.6, '512': 0.48, '601': 300, '606': 21.8491, '618': 2.18491,
+        '619': 0.436981, '645': 21.8491, '646': 21.8491},
+    (45, 80, 0, 0, 0): {
+        '203': 60, '204': 85.164, '205': 317.121, '208': 2554.92,
+        '268': 10645.5, '269': 59.8342, '291': 30, '301': 800, '303': 10,
+        '304': 350, '305': 800, '306': 2000, '307': 500, '309': 15,
+        '312': 1.5, '315': 1.5, '317': 70, '392': 1000, '394': 10, '401': 60,
+        '404': 1.5, '405': 1.7, '406': 19, '410': 4, '415': 2, '417': 200,
+        '418': 2, '501': 0.28, '502': 0.56, '503': 0.8, '504': 1.12,
+        '505': 0.96, '506': 0.52, '507': 0.52, '508': 0.56, '509': 0.56,
+        '510': 0.8, '512': 0.64, '601': 300, '606': 28.388, '618': 2.8388,
+        '619': 0.56776, '645': 28.388, '646': 28.388},
+    (51.5, 62, 1, 0, 1): {
+        '203': 64, '204': 65.0564, '205': 242.248, '208': 1951.69,
+        '268': 8132.06, '269': 45.7071, '291': 30, '301': 1200, '303': 10,
+        '304': 355, '305': 1200, '306': 2000, '307': 500, '309': 19,
+        '312': 1.8, '315': 1.5, '317': 75, '392': 1300, '394': 10, '401': 95,
+        '404': 1.6, '405': 1.8, '406': 18, '410': 4, '415': 2.1, '417': 280,
+        '418': 2.6, '501': 0.217, '502': 0.434, '503': 0.62, '504': 0.868,
+        '505': 0.744, '506': 0.403, '507': 0.403, '508': 0.434, '509': 0.434,
+        '510': 0.62, '512': 0.496, '601': 300, '606': 21.6855, '618': 2.16855,
+        '619': 0.43371, '645': 21.6855, '646': 21.6855},
+    (75, 68, 0, 0, 0): {
+        '203': 51, '204': 65.8784, '205': 245.308, '208': 1976.35,
+        '268': 8234.8, '269': 46.2846, '291': 30, '301': 800, '303': 10,
+        '304': 350, '305': 800, '306': 2000, '307': 500, '309': 15,
+        '312': 1.5, '315': 1.5, '317': 70, '392': 1000, '394': 10, '401': 60,
+        '404': 1.2, '405': 1.4, '406': 15, '410': 4, '415': 2, '417': 200,
+        '418': 2, '501': 0.238, '502': 0.476, '503': 0.68, '504': 0.952,
+        '505': 0.816, '506': 0.442, '507': 0.442, '508': 0.476, '509': 0.476,
+        '510': 0.68, '512': 0.544, '601': 300, '606': 21.9595, '618': 2.19595,
+        '619': 0.439189, '645': 21.9595, '646': 21.9595},
+}
+
+def close(a, b):
+    return abs(a - b) <= 1e-5 * max(abs(a), abs(b), 1.0)
+
+def close_totals(tot_list, expected):
+    tot = dict(tot_list)
+    return not [num for num in expected if not close(tot[num], expected[num])]
+
+def fill(db):
+    """Add a recipe of rice and apple in 2 servings and food plans."""
+    db.query("INSERT INTO recipe VALUES (1, 'Apple rice', 2, 2, 101)")
+    db.query("INSERT INTO ingredient VALUES (?, ?, ?, ?)", many=True,
+             sql_params=[(1, 1.0, 'cup', '20044'),
+                         (1, 1.0, 'medium (3" dia)', '09003')])
+    db.query("INSERT INTO recipe_plan VALUES " +
+             "(1, '2012-01-01', '12:00:00', 1.0, 1)")
+    # Person 3 plans a recipe since deleted
+    db.query("INSERT INTO recipe_plan VALUES " +
+             "(3, '2012-01-01', '12:00:00', 1.0, 99)")
+    db.query("INSERT INTO food_plan VALUES (?, ?, ?, ?, ?, ?)", many=True,
+             sql_params=[(1, '2012-01-01', '08:00:00', 1.0, 'cup', '01077'),
+                         (1, '2012-01-02', '08:00:00', 2.0, 'tbsp', '01001'),
+                         (1, '2012-01-03', '08:00:00', 1.0, 'cup', '01077'),
+                         (2, '2012-01-01', '08:00:00', 1.0, 'cup', '01077')])
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import engine
+    import calc_rdi
+    import database
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ok = True
+        db = make(tmpdir)
+        fill(db)
+
+        # Reading the sets neither writes nor needs the data files
+        import install
+        idir, install.idir = install.idir, path.join(tmpdir, 'none')
+        readonly = database.Connection(db.dbfile, readonly=True)
+        ok &= check('RDIs read only', calc_rdi.ReferenceSet(readonly).
+            nutr_nos == calc_rdi.ReferenceSet(db).nutr_nos)
+        readonly.close()
+        install.idir = idir
+        ref = calc_rdi.ReferenceSet(db)
+        failed = []
+        for person, expected in sorted(RDI.items()):
+            rdi = dict([(num, float(value)) for num, value in
+                        calc_rdi.compute(*(person + (ref,)))])
+            if sorted(rdi) != sorted(expected) or \
+                    [num for num in expected
+                     if not close(rdi[num], expected[num])]:
+                failed.append(person)
+        ok &= check('RDIs as from the compiled tables', not failed)
+        rows = calc_rdi.compute_many(*(zip(*sorted(RDI)) + [ref]))
+        ok &= check('RDIs of many persons at once',
+            not [person for person, row in zip(sorted(RDI), rows)
+                 if not close_totals(zip(ref.nutr_nos, row),
+                                     RDI[person])])
+
+        empty = database.Connection(path.join(tmpdir, 'empty.lt3'))
+        try:
+            calc_rdi.active_set(empty)
+            ok &= check('RDI tables missing', False)
+        except calc_rdi.RDIError:
+            ok &= check('RDI tables missing', True)
+        empty.close()
+
+        nutr_nums = engine.nutr_num_list(db)
+        milk = {'203': 7.686, '204': 7.93, '208': 148.84}
+        ok &= check('food totals',
+            close_totals(engine.food_totals(db, 1, 'cup', '01077'), milk))
+        foods = engine.FoodData(db)
+        foods.load(['01077', '01001'])
+        ok &= check('food totals from FoodData',
+            close_totals(engine.food_totals(db, 1, 'cup', '01077',
+                                            nutr_nums, foods), milk))
+        # Half of 158 g rice and 182 g apple
+        serving = {'203': 2.3617, '205': 34.8214, '208': 150.02}
+        ok &= check('recipe totals per serving',
+            close_totals(engine.stored_recipe_totals(db, 1), serving))
+        # Milk and serving on Jan 1, 28.4 g butter on Jan 2
+        plan = {'203': 10.2891, '204': 31.34114, '208': 502.488}
+        ok &= check('plan totals', close_totals(engine.plan_totals(db,
+            '2012-01-01', '2012-01-02', person_no=1), plan))
+        ok &= check('plan totals from FoodData', close_totals(
+            engine.plan_totals(db, '2012-01-01', '2012-01-02', person_no=1,
+                               nutr_nums=nutr_nums, foods=foods), plan))
+        ok &= check('plan averaged by day', close_totals(
+            engine.plan_totals(db, '2012-01-01', '2012-01-02', avg=True,
+                               person_no=1),
+            dict([(n, v / 2) for n, v in plan.items()])))
+        try:
+            engine.plan_totals(db, '2012-01-01', '2012-01-02', person_no=3)
+            ok &= check('plan of missing recipe refused', False)
+        except engine.EngineError:
+            ok &= check('plan of missing recipe refused', True)
+        try:
+            engine.food_totals(db, 1, 'bowl', '20044')
+            ok &= check('unknown measure refused', False)
+        except engine.EngineError:
+            ok &= check('unknown measure refused', True)
+
+        ok &= check('days between', database.days_between([
+            ('2012-01-01', '2012-01-01'), ('2012-02-01', '2012-03-01'),
+            ('2011-12-31', '2012-01-01'), ('2011-01-01', '2011-12-31')]) ==
+            [1, 30, 2, 365])
+
+        index = database.MeasureIndex(db)
+        ok &= check('measure matched exactly',
+            index.match('01001', 'tbsp') == 'tbsp' and
+            index.is_valid('01001', 'tbsp') and
+            not index.is_valid('01001', 'Tbsp'))
+        ok &= check('measure matched on text',
+            index.match('09003', 'Medium  (3" DIA)') == 'medium (3" dia)')
+        ok &= check('measure matched on gram weight',
+            index.match('01077', 'glass', 244.04) == 'cup' and
+            index.match('01077', 'Fl Oz', 244) == 'cup')
+        ok &= check('measure not matched',
+            index.match('20044', 'bowl') is None and
+            index.match('20044', 'bowl', 100) is None and
+            index.match('99999', 'cup') is None)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check sr_extra.py: tables loaded when asked for, a table being loaded
+by another thread, and food searches limited by LanguaL facets.
+"""
+import sys
+import shutil
+import tempfile
+from os import path
+from testdb import make, write_data, check, count
+
+LANGDESC = [
+    ['A0001', 'Dairy product'],
+    ['A0002', 'Fruit'],
+    ['F0001', 'Raw'],
+    ['F0002', 'Cooked'],
+    ['H0001', 'Salt added']]
+
+LANGUAL = [
+    ['01001', 'A0001'], ['01001', 'F0001'], ['01001', 'H0001'],
+    ['01077', 'A0001'], ['01077', 'F0001'],
+    ['09003', 'A0002'], ['09003', 'F0001'],
+    ['20044', 'F0002'], ['20044', 'H0001']]
+
+FOOTNOTE = [
+    ['01001', '01', 'D', '', 'Salted butter'],
+    ['09003', '01', 'N', '203', 'Analytical']]
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import sr_extra
+    sr_extra.CHUNK = 4
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ok = True
+        db = make(tmpdir)
+        data_dir = path.join(tmpdir, 'data')
+        write_data(data_dir, {'langdesc': LANGDESC, 'langual': LANGUAL,
+                              'footnote': FOOTNOTE})
+        ok &= check('nothing loaded at start', not sr_extra.loaded_tables(db))
+
+        # Another thread holds the lock of the table it is loading
+        lock = sr_extra._table_lock('footnote')
+        lock.acquire()
+        try:
+            ok &= check('table being loaded not waited for',
+                sr_extra.food_footnotes(db, '01001', wait=False) == () and
+                'footnote' not in sr_extra.loaded_tables(db))
+            ok &= check('other tables loaded meanwhile',
+                sr_extra.ensure_loaded(db, 'langdesc', wait=False))
+        finally:
+            lock.release()
+        ok &= check('loaded when asked for',
+            [tuple(r) for r in sr_extra.food_footnotes(db, '01001')] ==
+                [('D', '', 'Salted butter')] and
+            'footnote' in sr_extra.loaded_tables(db))
+
+        index = sr_extra.facet_index(db)
+        ok &= check('index of every food', len(index.facets) == 4 and
+            count(db, "SELECT COUNT(*) FROM langual") == len(LANGUAL))
+        ok &= check('one facet', index.search(['F0001']) ==
+            set(['01001', '01077', '09003']))
+        ok &= check('facets intersected',
+            index.search(['A0001', 'F0001', 'H0001']) == set(['01001']) and
+            index.search(['F0001', 'H0001']) == set(['01001']) and
+            index.search(['A0002', 'F0002']) == set())
+        ok &= check('unknown facet', index.search(['Z9999']) == set() and
+            index.search([]) == set())
+        ok &= check('limited to foods found',
+            index.search(['H0001'], ['20044', '09003']) == set(['20044']) and
+            index.search([], ['09003']) == set(['09003']))
+        ok &= check('filtered in given order',
+            sr_extra.filter_by_facets(db, ['09003', '01077', '01001'],
+                                      ['F0001']) ==
+                ['09003', '01077', '01001'])
+        ok &= check('facet descriptions', index.food_facets('20044') ==
+            [('F0002', 'Cooked'), ('H0001', 'Salt added')])
+
+        # Reloading langual builds the index again
+        write_data(data_dir, {'langual': LANGUAL + [['09003', 'H0001']]})
+        sr_extra.load_table(db, 'langual')
+        ok &= check('index rebuilt after reload',
+            sr_extra.facet_index(db) is not index and
+            sr_extra.facet_index(db).search(['H0001']) ==
+                set(['01001', '09003', '20044']))
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
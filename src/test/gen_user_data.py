@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fill a GNUtrition database with synthetic user data for benchmarks.
+
+Persons, recipes with ingredients and preparation, food and recipe plans
+covering several years, RDI inputs and nutrient goals are added to a
+database that already has the USDA data loaded. Foods and measures are
+picked from the USDA tables, so every row is valid. The same seed gives
+the same data.
+
+    gen_user_data.py [--persons N] [--recipes N] [--years N] [--seed N] DBFILE
+"""
+import sys
+import random
+import datetime
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+FIRST_PERSON = 20001
+MEAL_TIMES = ('8:00', '12:00', '15:00', '19:00')
+
+def food_measures(db):
+    """Return list of (NDB_No, (Msre_Desc, ...)) of foods with measures."""
+    db.query("SELECT NDB_No, Msre_Desc FROM weight ORDER BY NDB_No, Seq")
+    measures = {}
+    for num, desc in db.get_result() or ():
+        measures.setdefault(num, []).append(desc)
+    return sorted(measures.items())
+
+def add_recipes(db, rnd, foods, count):
+    """Add count recipes, return their recipe_no."""
+    db.query("SELECT category_no FROM category")
+    categories = [row[0] for row in db.get_result()]
+    first = db.next_row('recipe_no', 'recipe')
+    recipes, ingredients, preparations = [], [], []
+    for recipe_no in range(first, first + count):
+        ingr = rnd.sample(foods, rnd.randint(3, 12))
+        recipes.append((recipe_no, 'Benchmark recipe {0:d}'.format(recipe_no),
+                        rnd.randint(1, 8), len(ingr), rnd.choice(categories)))
+        for num, descs in ingr:
+            ingredients.append((recipe_no, rnd.choice((0.25, 0.5, 1, 2, 3)),
+                                rnd.choice(descs), num))
+        preparations.append((recipe_no, '0:{0:02d}'.format(rnd.randint(5, 59)),
+                             'Mix and cook. ' * rnd.randint(1, 20)))
+    db.query("INSERT INTO recipe VALUES (?, ?, ?, ?, ?)", many=True,
+             sql_params=recipes, commit=False)
+    db.query("INSERT INTO ingredient VALUES (?, ?, ?, ?)", many=True,
+             sql_params=ingredients, commit=False)
+    db.query("INSERT INTO preparation VALUES (?, ?, ?)", many=True,
+             sql_params=preparations, commit=False)
+    return range(first, first + count)
+
+def add_person_plans(db, rnd, person_no, foods, recipe_nos, start, days):
+    food_plan, recipe_plan = [], []
+    for day in range(days):
+        date = (start + datetime.timedelta(day)).isoformat()
+        for time in MEAL_TIMES:
+            for num, descs in rnd.sample(foods, rnd.randint(1, 4)):
+                food_plan.append((person_no, date, time,
+                    rnd.choice((0.5, 1, 1.5, 2)), rnd.choice(descs), num))
+        if rnd.random() < 0.6:
+            recipe_plan.append((person_no, date, rnd.choice(MEAL_TIMES[1:]),
+                                rnd.choice((0.5, 1, 2)), rnd.choice(recipe_nos)))
+    db.query("INSERT INTO food_plan VALUES (?, ?, ?, ?, ?, ?)", many=True,
+             sql_params=food_plan, commit=False)
+    if recipe_plan:
+        db.query("INSERT INTO recipe_plan VALUES (?, ?, ?, ?, ?)", many=True,
+                 sql_params=recipe_plan, commit=False)
+    return len(food_plan) + len(recipe_plan)
+
+def generate(db, persons=20, recipes=2000, years=3, seed=1):
+    """Add the synthetic data to db and return a dictionary of row counts.
+
+    Person numbers start at FIRST_PERSON; plans end today.
+    """
+    import calc_rdi
+    import engine
+    rnd = random.Random(seed)
+    db.init_rdi()
+    foods = food_measures(db)
+    recipe_nos = add_recipes(db, rnd, foods, recipes)
+    days = years * 365
+    start = datetime.date.today() - datetime.timedelta(days - 1)
+    person_nos = range(FIRST_PERSON, FIRST_PERSON + persons)
+    plan_rows = 0
+    rdi = []
+    for person_no in person_nos:
+        db.query("INSERT INTO person VALUES (?, ?, ?)", sql_params=(person_no,
+            'Benchmark person {0:d}'.format(person_no),
+            'bench{0:d}'.format(person_no)), commit=False)
+        plan_rows += add_person_plans(db, rnd, person_no, foods, recipe_nos,
+                                      start, days)
+        female = rnd.randint(0, 1)
+        rdi.append((person_no, rnd.randint(18, 80), rnd.randint(45, 110),
+                    female, 0, female and int(rnd.random() < 0.05)))
+    db.query("INSERT OR REPLACE INTO person_rdi VALUES (?, ?, ?, ?, ?, ?)",
+             many=True, sql_params=rdi, commit=False)
+    ref = calc_rdi.ReferenceSet(db)
+    columns = zip(*rdi)
+    rows = calc_rdi.compute_many(*(columns[1:] + [ref]))
+    # Commits everything added above
+    engine.save_goals(db, dict([(p, zip(ref.nutr_nos, row))
+                                for p, row in zip(columns[0], rows)]))
+    return {'persons': persons, 'recipes': recipes, 'plan_rows': plan_rows,
+            'days': days, 'first_date': start.isoformat()}
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage=__doc__.split('\n\n')[-1].strip())
+    parser.add_option('--persons', type='int', default=20)
+    parser.add_option('--recipes', type='int', default=2000)
+    parser.add_option('--years', type='int', default=3)
+    parser.add_option('--seed', type='int', default=1)
+    (opts, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('a database file is required')
+    import database
+    db = database.Database(args[0])
+    counts = generate(db, opts.persons, opts.recipes, opts.years, opts.seed)
+    db.close()
+    print counts
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
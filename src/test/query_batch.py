@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check that statements run with commit=False stay in one transaction
+when they are logged as slow queries.
+
+Every statement is made 'slow' so its plan is asked for. The plan of a
+statement inside the transaction must only be read after it ends: the
+sqlite3 module commits before running EXPLAIN.
+"""
+import sys
+import shutil
+import tempfile
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+def check(what, ok):
+    sys.stdout.write('{0:s}: {1:s}\n'.format(what, 'ok' if ok else 'FAILED'))
+    return ok
+
+def count(db):
+    db.query("SELECT COUNT(*) FROM t")
+    return db.get_single_result()
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import database
+    database.query_stats.configure()
+    database.query_stats.slow_ms = 0
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = database.Connection(path.join(tmpdir, 'batch.lt3'))
+        db.query("CREATE TABLE t (n INTEGER NOT NULL)")
+        db.query("INSERT INTO t VALUES (?)", many=True,
+                 sql_params=[(i,) for i in range(10)])
+        ok = True
+
+        db.query("DELETE FROM t WHERE n < ?", sql_params=(5,), commit=False)
+        try:
+            db.query("INSERT INTO t VALUES (NULL)", commit=False)
+        except database.SQLiteQueryError:
+            pass
+        ok &= check('failed batch rolled back', count(db) == 10)
+
+        db.query("DELETE FROM t WHERE n < ?", sql_params=(5,), commit=False)
+        db.rollback()
+        ok &= check('rollback() after slow statement', count(db) == 10)
+        ok &= check('plans read after the transaction',
+                    not db.pending_explain)
+
+        db.query("DELETE FROM t WHERE n < ?", sql_params=(5,), commit=False)
+        db.query("UPDATE t SET n = n + 1", commit=False)
+        db.commit()
+        ok &= check('batch committed', count(db) == 5)
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check sr_upgrade.py against a small synthetic release.
+
+The new release drops the apple, adds broccoli in a new food group,
+changes the protein of milk and renames the tablespoon of butter. It is
+read from a zip archive with '~' quotes and DOS line ends, as the USDA
+ships it, and from a directory of prepared data files.
+"""
+import sys
+import copy
+import shutil
+import zipfile
+import tempfile
+from os import path
+from testdb import SR_DATA, make, write_data, check, count
+
+# Expected (added, changed, removed) rows of each table
+EXPECTED = {
+    'fd_group': (1, 0, 0),
+    'food_des': (1, 0, 1),
+    'nutr_def': (0, 0, 0),
+    'nut_data': (1, 1, 5),
+    'weight': (1, 1, 2)}
+
+def new_release():
+    data = copy.deepcopy(SR_DATA)
+    for table in ('food_des', 'nut_data', 'weight'):
+        data[table] = [row for row in data[table] if row[0] != '09003']
+    data['fd_group'].append(['1100', 'Vegetables and Vegetable Products'])
+    data['food_des'].append(['11090', '1100', 'Broccoli, raw', 'BROCCOLI,RAW',
+        '', '', 'Y', '', '39', '', '6.25', '2.44', '8.37', '3.57'])
+    for row in data['nut_data']:
+        if row[:2] == ['01077', '203']:
+            row[2] = '3.27'
+    data['nut_data'].append(['11090', '203', '2.82', '1', '', '1'] +
+                            [''] * 12)
+    for row in data['weight']:
+        if row[:2] == ['01001', '2']:
+            row[3] = 'tbsp, pat'
+    data['weight'].append(['11090', '1', '1', 'cup, chopped', '91', '', ''])
+    return data
+
+def write_zip(filename, data):
+    """Write data as the USDA does: text quoted with '~', DOS line ends."""
+    z = zipfile.ZipFile(filename, 'w')
+    for table, rows in data.items():
+        lines = ['^'.join(['~{0:s}~'.format(v) if not v.replace('.', '')
+                           .isdigit() else v for v in row]) for row in rows]
+        z.writestr(table.upper() + '.txt', '\r\n'.join(lines) + '\r\n\x1a')
+    z.close()
+
+def fill(db):
+    """Add a recipe with the apple and a food plan with the butter."""
+    db.query("INSERT INTO recipe VALUES (1, 'Apple rice', 2, 2, 101)")
+    db.query("INSERT INTO ingredient VALUES (?, ?, ?, ?)", many=True,
+             sql_params=[(1, 1.0, 'cup, sliced', '09003'),
+                         (1, 1.0, 'cup', '20044')])
+    db.query("INSERT INTO food_plan VALUES (?, ?, ?, ?, ?, ?)", many=True,
+             sql_params=[(1, '2012-01-01', '08:00:00', 1.0, 'tbsp', '01001'),
+                         (1, '2012-01-01', '08:00:00', 1.0, 'cup', '01077')])
+
+def table_rows(db, table):
+    db.query("SELECT * FROM {0:s} ORDER BY 1, 2".format(table))
+    return [tuple(row) for row in db.get_result()]
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import sr_upgrade
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ok = True
+        data = new_release()
+        archive = path.join(tmpdir, 'sr_new.zip')
+        write_zip(archive, data)
+        release_dir = path.join(tmpdir, 'sr_new')
+        write_data(release_dir, data)
+
+        # The same database loaded with the new release from the start
+        fresh = make(tmpdir, 'fresh.lt3')
+        write_data(path.join(tmpdir, 'data'), data)
+        fresh.init_USDA_data()
+
+        for name, source in (('zip', archive), ('directory', release_dir)):
+            db = make(tmpdir, name + '.lt3')
+            fill(db)
+            stats = sr_upgrade.upgrade(db, source)
+            ok &= check(name + ': rows added, changed, removed',
+                dict([(t, stats[t]) for t in EXPECTED]) == EXPECTED)
+            ok &= check(name + ': tables as in the new release',
+                not [t for t, key in sr_upgrade.SR_TABLES
+                     if table_rows(db, t) != table_rows(fresh, t)])
+            db.query("SELECT table_name, NDB_No, Msre_Desc, reason " +
+                     "FROM obsolete_ref ORDER BY table_name")
+            ok &= check(name + ': obsolete references',
+                stats['obsolete'] == {'ingredient': 1, 'food_plan': 1} and
+                [tuple(r) for r in db.get_result()] ==
+                    [('food_plan', '01001', 'tbsp', 'measure'),
+                     ('ingredient', '09003', 'cup, sliced', 'food')])
+            stats = sr_upgrade.upgrade(db, source)
+            ok &= check(name + ': second upgrade changes nothing',
+                not [t for t in EXPECTED if stats[t] != (0, 0, 0)])
+            db.close()
+
+        # A release of another layout changes nothing
+        db = make(tmpdir, 'layout.lt3')
+        bad = new_release()
+        bad['weight'][0].append('')
+        write_data(release_dir, bad)
+        try:
+            sr_upgrade.upgrade(db, release_dir)
+            ok &= check('other layout refused', False)
+        except sr_upgrade.UpgradeError:
+            ok &= check('other layout refused',
+                count(db, "SELECT COUNT(*) FROM food_des") ==
+                    len(SR_DATA['food_des']) and
+                count(db, "SELECT COUNT(*) FROM food_des " +
+                      "WHERE NDB_No = '11090'") == 0)
+        db.close()
+        fresh.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A small database for the test scripts.
+
+The SR tables are loaded from the few foods of SR_DATA, written as data
+files to a temporary directory that install.idir is pointed at. The
+category and RDI files are copied from the source tree's data directory.
+"""
+import sys
+import shutil
+from os import path, mkdir
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+DATA_DIR = path.join(path.dirname(path.dirname(path.dirname(
+    path.abspath(__file__)))), 'data')
+
+def _nut(NDB_No, Nutr_No, value):
+    return [NDB_No, Nutr_No, value, '1', '', '1'] + [''] * 12
+
+def _food(NDB_No, group, desc):
+    return [NDB_No, group, desc, desc.upper(), '', '', 'Y', '', '0', '',
+            '6.25', '4', '9', '4']
+
+# Rows of each SR data file, as strings
+SR_DATA = {
+    'fd_group': [
+        ['0100', 'Dairy and Egg Products'],
+        ['0900', 'Fruits and Fruit Juices'],
+        ['2000', 'Cereal Grains and Pasta']],
+    'food_des': [
+        _food('01001', '0100', 'Butter, salted'),
+        _food('01077', '0100', 'Milk, whole'),
+        _food('09003', '0900', 'Apples, raw, with skin'),
+        _food('20044', '2000', 'Rice, white, cooked')],
+    'nutr_def': [
+        ['203', 'g', 'PROCNT', 'Protein', '2', '600'],
+        ['204', 'g', 'FAT', 'Total lipid (fat)', '2', '800'],
+        ['205', 'g', 'CHOCDF', 'Carbohydrate, by difference', '2', '1100'],
+        ['208', 'kcal', 'ENERC_KCAL', 'Energy', '0', '300'],
+        ['268', 'kJ', 'ENERC_KJ', 'Energy', '0', '400']],
+    'nut_data': [
+        _nut('01001', '203', '0.85'), _nut('01001', '204', '81.11'),
+        _nut('01001', '205', '0.06'), _nut('01001', '208', '717'),
+        _nut('01001', '268', '2999'),
+        _nut('01077', '203', '3.15'), _nut('01077', '204', '3.25'),
+        _nut('01077', '205', '4.8'), _nut('01077', '208', '61'),
+        _nut('01077', '268', '255'),
+        _nut('09003', '203', '0.26'), _nut('09003', '204', '0.17'),
+        _nut('09003', '205', '13.81'), _nut('09003', '208', '52'),
+        _nut('09003', '268', '218'),
+        _nut('20044', '203', '2.69'), _nut('20044', '204', '0.28'),
+        _nut('20044', '205', '28.17'), _nut('20044', '208', '130'),
+        _nut('20044', '268', '544')],
+    'weight': [
+        ['01001', '1', '1', 'cup', '227', '', ''],
+        ['01001', '2', '1', 'tbsp', '14.2', '', ''],
+        ['01077', '1', '1', 'cup', '244', '', ''],
+        ['01077', '2', '1', 'fl oz', '30.5', '', ''],
+        ['09003', '1', '1', 'medium (3" dia)', '182', '', ''],
+        ['09003', '2', '1', 'cup, sliced', '109', '', ''],
+        ['20044', '1', '1', 'cup', '158', '', '']]}
+
+def write_data(dirname, data):
+    """Write data, a dictionary table -> rows, as SR data files."""
+    if not path.isdir(dirname):
+        mkdir(dirname)
+    for table, rows in data.items():
+        f = open(path.join(dirname, table.upper() + '.txt'), 'w')
+        for row in rows:
+            f.write('^'.join(row) + '\n')
+        f.close()
+
+def make(tmpdir, name='gnutr_db.lt3'):
+    """Return a database.Connection to a new database in tmpdir.
+
+    The data files are written to tmpdir/data and install.idir is set to
+    tmpdir.
+    """
+    import install
+    import database
+    data_dir = path.join(tmpdir, 'data')
+    write_data(data_dir, SR_DATA)
+    for fn in ('CATEGORY.txt', 'RDI_SET.txt', 'RDI_NUTR.txt', 'RDI.txt'):
+        shutil.copy(path.join(DATA_DIR, fn), data_dir)
+    install.idir = tmpdir
+    db = database.Connection(path.join(tmpdir, name))
+    db.init_USDA_data()
+    db.init_user()
+    db.init_rdi()
+    return db
+
+def check(what, ok):
+    sys.stdout.write('{0:s}: {1:s}\n'.format(what, 'ok' if ok else 'FAILED'))
+    return ok
+
+def count(db, sql, params=None):
+    db.query(sql, sql_params=params)
+    return db.get_single_result()
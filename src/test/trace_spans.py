@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check util/trace.py: span totals, their report file and one profile
+per outermost span, however close together.
+"""
+import sys
+import shutil
+import tempfile
+from os import path, listdir
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+def check(what, ok):
+    sys.stdout.write('{0:s}: {1:s}\n'.format(what, 'ok' if ok else 'FAILED'))
+    return ok
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    from util import trace
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ok = True
+        profile_dir = path.join(tmpdir, 'profile')
+        report_fn = path.join(tmpdir, 'span_totals')
+        trace.configure(0, profile_dir, report_fn)
+        for i in range(3):
+            with trace.span('action'):
+                with trace.span('step'):
+                    pass
+        ok &= check('totals kept', trace.totals['action'][0] == 3 and
+                    trace.totals['step'][0] == 3)
+        ok &= check('one profile per span',
+                    len([fn for fn in listdir(profile_dir)
+                         if fn.startswith('action-')]) == 3)
+        trace.dump()
+        f = open(report_fn)
+        lines = f.read().splitlines()
+        f.close()
+        ok &= check('totals reported', len(lines) == 3 and
+                    lines[1].split()[0] == '3' and
+                    set([l.split()[-1] for l in lines[1:]]) ==
+                        set(['action', 'step']))
+        trace.configure(0, None, None)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
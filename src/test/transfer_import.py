@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check transfer.py: export in both formats, an import interrupted and
+run again, and giving the plans and goals of an export to another person.
+"""
+import sys
+import json
+import shutil
+import tempfile
+from os import path
+from testdb import make, check, count
+
+RECIPES = 30
+# Recipe with an ingredient no longer in the SR data, left out on import
+OBSOLETE_RECIPE = 7
+
+class Interrupted(Exception): pass
+
+def fill(db):
+    """Add recipes, and plans and goals of persons 1 and 2."""
+    recipes, ingredients, preparations = [], [], []
+    for n in range(1, RECIPES + 1):
+        recipes.append((n, 'Recipe {0:d}'.format(n), 2, 2, 101))
+        ingredients.append((n, 1.0, 'cup', '20044'))
+        if n == OBSOLETE_RECIPE:
+            ingredients.append((n, 1.0, 'cup', '99999'))
+        else:
+            ingredients.append((n, 2.0, 'tbsp', '01001'))
+        preparations.append((n, '10 min', 'Mix.'))
+    db.query("INSERT INTO recipe VALUES (?, ?, ?, ?, ?)", many=True,
+             sql_params=recipes)
+    db.query("INSERT INTO ingredient VALUES (?, ?, ?, ?)", many=True,
+             sql_params=ingredients)
+    db.query("INSERT INTO preparation VALUES (?, ?, ?)", many=True,
+             sql_params=preparations)
+    for person_no in (1, 2):
+        db.query("INSERT INTO food_plan VALUES (?, ?, ?, ?, ?, ?)", many=True,
+                 sql_params=[(person_no, '2012-01-{0:02d}'.format(d),
+                              '08:00:00', 1.0, 'cup', '01077')
+                             for d in range(1, 21)])
+        db.query("INSERT INTO recipe_plan VALUES (?, ?, ?, ?, ?)", many=True,
+                 sql_params=[(person_no, '2012-01-01', '12:00:00', 1.0, n)
+                             for n in range(1, 6)])
+        db.query("INSERT INTO nutr_goal VALUES (?, ?, ?)", many=True,
+                 sql_params=[(person_no, num, 100.0 * person_no)
+                             for num in ('203', '204', '205', '208')])
+
+def consistent(db):
+    """True if every ingredient, preparation and plan has its recipe."""
+    return not count(db, "SELECT COUNT(*) FROM ingredient WHERE recipe_no " +
+        "NOT IN (SELECT recipe_no FROM recipe)") and \
+        not count(db, "SELECT COUNT(*) FROM preparation WHERE recipe_no " +
+        "NOT IN (SELECT recipe_no FROM recipe)") and \
+        not count(db, "SELECT COUNT(*) FROM recipe_plan WHERE recipe_no " +
+        "NOT IN (SELECT recipe_no FROM recipe)")
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import transfer
+    transfer.CHUNK = 7
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ok = True
+        src = make(tmpdir, 'source.lt3')
+        fill(src)
+        exp = path.join(tmpdir, 'export')
+        counts = transfer.export_data(src, exp)
+        ok &= check('export', counts['recipe'] == RECIPES and
+                    counts['food_plan'] == 40 and counts['nutr_goal'] == 8)
+
+        # Interrupted after a few chunks, then run again
+        dst = make(tmpdir, 'target.lt3')
+        commit = dst.commit
+        commits = [0]
+        def interrupting_commit():
+            commits[0] += 1
+            if commits[0] == 6:
+                raise Interrupted()
+            commit()
+        dst.commit = interrupting_commit
+        try:
+            transfer.import_data(dst, exp)
+            ok &= check('import interrupted', False)
+        except Interrupted:
+            dst.rollback()
+        dst.commit = commit
+        done = count(dst, "SELECT COUNT(*) FROM recipe")
+        ok &= check('partly imported', 0 < done < RECIPES)
+        stats = transfer.import_data(dst, exp)
+        ok &= check('import resumed',
+            count(dst, "SELECT COUNT(*) FROM recipe") == RECIPES - 1 and
+            count(dst, "SELECT COUNT(*) FROM ingredient") ==
+                2 * (RECIPES - 1) and
+            count(dst, "SELECT COUNT(*) FROM food_plan") == 40 and
+            count(dst, "SELECT COUNT(*) FROM nutr_goal") == 8)
+        ok &= check('obsolete food counted', stats['obsolete'] == 1)
+        ok &= check('recipes and their rows consistent', consistent(dst))
+        transfer.import_data(dst, exp)
+        ok &= check('finished import not repeated',
+            count(dst, "SELECT COUNT(*) FROM recipe") == RECIPES - 1)
+
+        # The same export as JSON Lines
+        jexp = path.join(tmpdir, 'export.json')
+        transfer.export_data(src, jexp, fmt='json')
+        f = open(path.join(jexp, 'RECIPE.jsonl'))
+        first = json.loads(f.readline())
+        f.close()
+        ok &= check('export as JSON Lines', first[:2] == [1, 'Recipe 1'])
+        jdst = make(tmpdir, 'json.lt3')
+        transfer.import_data(jdst, jexp)
+        ok &= check('import of JSON Lines', [count(jdst,
+            "SELECT COUNT(*) FROM {0:s}".format(t)) for t, c in
+            transfer.TABLES] == [count(dst, "SELECT COUNT(*) FROM " +
+            t) for t, c in transfer.TABLES] and consistent(jdst))
+        jdst.close()
+
+        # A database of an older version, with duplicate goals, must be
+        # upgraded first
+        old = make(tmpdir, 'old.lt3')
+        old.query("DROP INDEX nutr_goal_person_nutr")
+        old.query("INSERT INTO nutr_goal VALUES (?, ?, ?)", many=True,
+                  sql_params=[(1, '203', 1.0), (1, '203', 2.0),
+                              (1, '204', 3.0)])
+        try:
+            transfer.import_data(old, exp)
+            ok &= check('old database refused', False)
+        except transfer.TransferError:
+            ok &= check('old database refused',
+                not count(old, "SELECT COUNT(*) FROM recipe") and
+                count(old, "SELECT COUNT(*) FROM nutr_goal") == 3)
+        ok &= check('duplicate goals deleted', old.index_nutr_goal() == 1 and
+            count(old, "SELECT goal_val FROM nutr_goal " +
+                  "WHERE Nutr_No = '203'") == 2.0 and
+            old.index_nutr_goal() == 0)
+        transfer.import_data(old, exp)
+        ok &= check('upgraded database imported',
+            count(old, "SELECT COUNT(*) FROM recipe") == RECIPES - 1)
+
+        # Plans of several persons can't go to one person
+        other = make(tmpdir, 'other.lt3')
+        try:
+            transfer.import_data(other, exp, person_no=5)
+            ok &= check('several persons refused', False)
+        except transfer.TransferError:
+            ok &= check('several persons refused',
+                not count(other, "SELECT COUNT(*) FROM recipe"))
+
+        # The export of one person can, and its goals replace person 5's.
+        # Imported twice the plans are added twice, the goals kept once.
+        other.query("INSERT INTO nutr_goal VALUES (5, '203', 1.0)")
+        for name in ('export1', 'export2'):
+            transfer.export_data(src, path.join(tmpdir, name), person_no=2)
+            transfer.import_data(other, path.join(tmpdir, name), person_no=5)
+        ok &= check('one person given to another',
+            count(other, "SELECT COUNT(*) FROM food_plan WHERE person_no = 5")
+                == 40 and
+            count(other, "SELECT COUNT(*) FROM food_plan") == 40)
+        ok &= check('goals replaced, one per nutrient',
+            count(other, "SELECT COUNT(*) FROM nutr_goal") == 4 and
+            count(other, "SELECT COUNT(DISTINCT Nutr_No) FROM nutr_goal " +
+                  "WHERE person_no = 5 AND goal_val = 200.0") == 4)
+        for db in (src, dst, old, other):
+            db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
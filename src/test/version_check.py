@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check version.py against a stub version server on localhost.
+
+The server answers /version with a version file, /slow after a delay
+longer than the timeout used, and anything else with 404. Changes made to
+the config are discarded.
+"""
+import sys
+import time
+import threading
+from os import path
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+VERSION_FILE = """{
+"version": "99.0",
+"sr": "25",
+"date": "September 2012",
+"sr_url": "http://www.ars.usda.gov/SP2UserFiles/Place/12354500/Data/SR25/dnload/sr25.zip",
+"message": "A test release."
+}
+"""
+SLOW = 2.0
+TIMEOUT = 0.5
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(SLOW)
+        if self.path in ('/version', '/slow'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(VERSION_FILE)
+        else:
+            self.send_error(404)
+
+    def log_message(self, fmt, *args):
+        pass
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass    # The client gave up on /slow
+
+def check(what, ok):
+    sys.stdout.write('{0:s}: {1:s}\n'.format(what, 'ok' if ok else 'FAILED'))
+    return ok
+
+def main():
+    from util.log import initLogger
+    initLogger(logLevel='critical', logDisk=False, logConsole=True)
+    import config
+    import version
+
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    base = 'http://127.0.0.1:{0:d}'.format(server.server_address[1])
+    expected = ('99.0', '25', 'September 2012',
+                'http://www.ars.usda.gov/SP2UserFiles/Place/12354500/Data/' +
+                'SR25/dnload/sr25.zip', 'A test release.')
+    ok = True
+    ok &= check('version file read',
+        version.get_latest_version(base + '/version', TIMEOUT) == expected)
+    ok &= check('missing file',
+        version.get_latest_version(base + '/missing', TIMEOUT) ==
+        version.NO_VERSION)
+    start = time.time()
+    result = version.get_latest_version(base + '/slow', TIMEOUT)
+    ok &= check('timeout', result == version.NO_VERSION and
+                           time.time() - start < SLOW)
+
+    # Without a main loop the result is handled in the checking thread
+    version.idle_add = lambda func, *args: func(*args)
+    notified = []
+    config.set_key_value('check_disabled', False)
+    config.set_key_value('check_version', True)
+    config.set_key_value('check_interval', 3600)
+    config.set_key_value('last_check', 0)
+    start = time.time()
+    checker = version.check_version(base + '/slow', TIMEOUT,
+        lambda ver, mesg: notified.append(ver))
+    ok &= check('check does not block', time.time() - start < TIMEOUT)
+    checker.join()
+    ok &= check('no notice after timeout', not notified)
+
+    config.set_key_value('last_check', 0)
+    version.check_version(base + '/version', TIMEOUT,
+        lambda ver, mesg: notified.append(ver)).join()
+    ok &= check('newer version noticed', notified == ['99.0'])
+    ok &= check('result cached',
+                config.get_value('latest_version') == expected)
+    server.shutdown()
+    ok &= check('no check within interval',
+        version.check_version(base + '/version', TIMEOUT,
+            lambda ver, mesg: notified.append(ver)) is None)
+    ok &= check('notice from cached result', notified == ['99.0', '99.0'])
+
+    config.discard()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,367 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk export and import of user data.
+
+An export is a directory with one file per table and a MANIFEST naming
+the export, its format and the row count of each file. The format is
+one of FORMATS:
+  csv   TABLE.txt, '^' separated as the SR data files, read by the same
+        csv dialect (the default);
+  json  TABLE.jsonl, JSON Lines: one JSON array of the column values per
+        row, for other programs to read.
+Rows are streamed both ways so memory use does not depend on the size of
+the data.
+
+On import:
+  - recipes get new recipe numbers following those already in the
+    database; ingredients, preparations and recipe plans follow them.
+  - NDB_No must be in the current SR data and Msre_Desc is matched to a
+    current measure with database.MeasureIndex, as in migrate(). A recipe
+    with an ingredient that cannot be matched is left out, with its
+    preparation and plan entries.
+  - the plans and goals of an export of one person may be given to
+    another person with person_no.
+  - the goals of a person in the export replace that person's goals; a
+    goal is kept once per (person_no, Nutr_No). A database made before
+    that was enforced must first be upgraded, see
+    Database.index_nutr_goal().
+  - rows are inserted in chunks of CHUNK rows, each committed together
+    with the import's progress in the import_progress table. An import
+    that was interrupted continues where it stopped when run again.
+"""
+import csv
+import json
+from os import path
+import database
+from util.exception import AppException, AppFileReadError
+from util.log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+class TransferError(AppException): pass
+
+CHUNK = 5000
+
+# Tables in the order they are imported, with their columns
+TABLES = (
+    ('recipe', ('recipe_no', 'recipe_name', 'no_serv', 'no_ingr',
+                'category_no')),
+    ('ingredient', ('recipe_no', 'amount', 'Msre_Desc', 'NDB_No')),
+    ('preparation', ('recipe_no', 'prep_time', 'prep_desc')),
+    ('food_plan', ('person_no', 'date', 'time', 'amount', 'Msre_Desc',
+                   'NDB_No')),
+    ('recipe_plan', ('person_no', 'date', 'time', 'no_portions',
+                     'recipe_no')),
+    ('nutr_goal', ('person_no', 'Nutr_No', 'goal_val')))
+
+# Tables with a person_no column
+PERSON_TABLES = ('food_plan', 'recipe_plan', 'nutr_goal')
+
+# Export formats and the extension of their data files
+FORMATS = {'csv': '.txt', 'json': '.jsonl'}
+
+class JSONLinesWriter:
+    """Write rows as JSON Lines, with the writerows() of a csv writer."""
+    def __init__(self, f):
+        self.f = f
+
+    def writerows(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(list(row)) + '\n')
+
+def _reader(f, fmt='csv'):
+    if fmt == 'json':
+        return (json.loads(line) for line in f if line.strip())
+    return csv.reader(f, delimiter='^', quotechar="'")
+
+def _writer(f, fmt='csv'):
+    if fmt == 'json':
+        return JSONLinesWriter(f)
+    return csv.writer(f, delimiter='^', quotechar="'", lineterminator='\n')
+
+def _data_file(dirname, table, fmt='csv'):
+    return path.join(dirname, table.upper() + FORMATS[fmt])
+
+def chunks(iterable, size=CHUNK):
+    """Yield lists of up to size items of iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def export_data(db, dirname, person_no=None, fmt='csv'):
+    """Write the user tables to directory dirname in format fmt.
+
+    With person_no only that person's plans and goals are written (every
+    recipe is). Return a dictionary of rows written per table.
+    """
+    import time
+    import install
+    from os import makedirs
+    if fmt not in FORMATS:
+        raise TransferError("Unknown export format '{0:s}'".format(fmt))
+    if not path.isdir(dirname):
+        makedirs(dirname)
+    counts = {}
+    for table, columns in TABLES:
+        sql = "SELECT {0:s} FROM {1:s}".format(', '.join(columns), table)
+        params = ()
+        if person_no is not None and table in PERSON_TABLES:
+            sql += " WHERE person_no = ?"
+            params = (person_no,)
+        cur = db.con.cursor()
+        cur.execute(sql + " ORDER BY rowid", params)
+        f = open(_data_file(dirname, table, fmt), 'w')
+        writer = _writer(f, fmt)
+        count = 0
+        try:
+            while True:
+                rows = cur.fetchmany(CHUNK)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                count += len(rows)
+        finally:
+            f.close()
+        counts[table] = count
+        info("exported {0:d} rows of '{1:s}'".format(count, table))
+    manifest = {'export_id': '{0:s}-{1:.6f}'.format(path.basename(
+                    path.abspath(dirname)), time.time()),
+                'gnutrition': install.gnutr_version(),
+                'format': fmt,
+                'columns': dict(TABLES),
+                'rows': counts}
+    f = open(path.join(dirname, 'MANIFEST'), 'w')
+    json.dump(manifest, f, indent=1, sort_keys=True)
+    f.close()
+    return counts
+
+def read_manifest(dirname):
+    fn = path.join(dirname, 'MANIFEST')
+    try:
+        f = open(fn, 'r')
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError), e:
+        e = AppFileReadError(e)
+        e = e + "Failed to read export manifest '{0:s}'".format(fn)
+        raise e
+
+class Importer:
+    """Import of one export directory into db. See the module docstring."""
+    def __init__(self, db, dirname, person_no=None):
+        self.db = db
+        self.dirname = dirname
+        self.person_no = person_no
+        self.manifest = read_manifest(dirname)
+        self.source = self.manifest['export_id']
+        # Exports made before the format was recorded are csv
+        self.format = self.manifest.get('format', 'csv')
+        if self.format not in FORMATS:
+            raise TransferError("Export in {0:s} has unknown format " \
+                "'{1:s}'".format(dirname, self.format))
+        for table, columns in TABLES:
+            if list(self.manifest['columns'].get(table, ())) != list(columns):
+                raise TransferError("Export in {0:s} has different columns "
+                    "for table '{1:s}'".format(dirname, table))
+        self.stats = {'imported': 0, 'skipped': 0, 'obsolete': 0}
+
+    def create_tables(self):
+        self.db.query("CREATE TABLE IF NOT EXISTS import_progress " +
+            "(source TEXT NOT NULL, table_name TEXT NOT NULL, " +
+            "rows_done INTEGER NOT NULL, PRIMARY KEY (source, table_name))")
+        self.db.query("CREATE TABLE IF NOT EXISTS import_recipe_map " +
+            "(source TEXT NOT NULL, old_no INTEGER NOT NULL, " +
+            "new_no INTEGER NOT NULL, PRIMARY KEY (source, old_no))")
+        # Goals are inserted with INSERT OR REPLACE, which needs the unique
+        # index of Database.index_nutr_goal()
+        self.db.query("SELECT COUNT(*) FROM sqlite_master " +
+            "WHERE type = 'index' AND name = 'nutr_goal_person_nutr'")
+        if not self.db.get_single_result():
+            raise TransferError("The database was made by an older " \
+                "version; run 'gnutrition-batch upgrade-db' before importing")
+
+    def export_persons(self):
+        """Return the set of person_no in the plans and goals of the export."""
+        persons = set()
+        for table in PERSON_TABLES:
+            f = open(_data_file(self.dirname, table, self.format), 'r')
+            try:
+                for row in _reader(f, self.format):
+                    persons.add(int(row[0]))
+            finally:
+                f.close()
+        return persons
+
+    def rows_done(self, table):
+        self.db.query("SELECT rows_done FROM import_progress " +
+            "WHERE source = ? AND table_name = ?",
+            sql_params=(self.source, table))
+        result = self.db.get_result()
+        return result[0][0] if result else 0
+
+    def load_references(self):
+        """Read what rows are checked against: foods, measures, nutrients,
+        and recipe numbers already given by an earlier run."""
+        self.NDB_Nos = database.valid_NDB_No_set(self.db)
+        self.measures = database.MeasureIndex(self.db)
+        self.db.query("SELECT Nutr_No FROM nutr_def")
+        self.nutr_nos = set([row[0] for row in self.db.get_result()])
+        self.db.query("SELECT old_no, new_no FROM import_recipe_map " +
+            "WHERE source = ?", sql_params=(self.source,))
+        self.recipe_map = dict(self.db.get_result() or ())
+        self.db.query("SELECT MAX(recipe_no) FROM recipe")
+        self.next_recipe_no = (self.db.get_single_result() or 0) + 1
+
+    def measure(self, NDB_No, Msre_Desc):
+        """Return the current Msre_Desc for an imported one, or None."""
+        if NDB_No not in self.NDB_Nos:
+            self.obsolete.add(NDB_No)
+            return None
+        return self.measures.match(NDB_No, Msre_Desc)
+
+    def failed_recipes(self):
+        """Return the recipe numbers with an ingredient that won't import.
+
+        Read in a first pass over the ingredients so recipes can be left
+        out before any of their rows are written.
+        """
+        failed = set()
+        f = open(_data_file(self.dirname, 'ingredient', self.format), 'r')
+        try:
+            for recipe_no, amount, desc, NDB_No in _reader(f, self.format):
+                if int(recipe_no) not in failed and \
+                        not self.measure(NDB_No, desc):
+                    failed.add(int(recipe_no))
+        finally:
+            f.close()
+        return failed
+
+    def convert(self, table, row):
+        """Return the row to insert, or None to skip it."""
+        if self.person_no is not None and table in PERSON_TABLES:
+            row[0] = self.person_no
+        if table == 'recipe':
+            old_no = int(row[0])
+            if old_no in self.failed:
+                return None
+            new_no = self.next_recipe_no
+            self.next_recipe_no += 1
+            self.recipe_map[old_no] = new_no
+            self.new_map.append((self.source, old_no, new_no))
+            row[0] = new_no
+        elif table in ('ingredient', 'preparation', 'recipe_plan'):
+            col = -1 if table == 'recipe_plan' else 0
+            row[col] = self.recipe_map.get(int(row[col]))
+            if row[col] is None:
+                return None
+            if table == 'ingredient':
+                row[2] = self.measure(row[3], row[2])
+        elif table == 'food_plan':
+            row[4] = self.measure(row[5], row[4])
+            if not row[4]:
+                return None
+        elif table == 'nutr_goal':
+            if row[1] not in self.nutr_nos:
+                return None
+            person_no = int(row[0])
+            if person_no not in self.goal_persons:
+                self.goal_persons.add(person_no)
+                self.new_goal_persons.append(person_no)
+        return row
+
+    def import_table(self, table, columns):
+        done = self.rows_done(table)
+        sql = "INSERT {0:s}INTO {1:s} ({2:s}) VALUES ({3:s})".format(
+            'OR REPLACE ' if table == 'nutr_goal' else '', table,
+            ', '.join(columns), ', '.join(['?'] * len(columns)))
+        f = open(_data_file(self.dirname, table, self.format), 'r')
+        try:
+            reader = _reader(f, self.format)
+            for i in xrange(done):      # rows of an earlier run
+                row = reader.next()
+                if table == 'nutr_goal':
+                    self.goal_persons.add(int(row[0]) if self.person_no is None
+                                          else self.person_no)
+            for chunk in chunks(reader, CHUNK):
+                self.new_map = []
+                self.new_goal_persons = []
+                rows = [r for r in [self.convert(table, row) for row in chunk]
+                        if r is not None]
+                for person_no in self.new_goal_persons:
+                    self.db.query("DELETE FROM nutr_goal WHERE person_no = ?",
+                        sql_params=(person_no,), commit=False)
+                if rows:
+                    self.db.query(sql, many=True, sql_params=rows,
+                                  commit=False)
+                if self.new_map:
+                    self.db.query("INSERT INTO import_recipe_map " +
+                        "VALUES (?, ?, ?)", many=True,
+                        sql_params=self.new_map, commit=False)
+                done += len(chunk)
+                self.db.query("INSERT OR REPLACE INTO import_progress " +
+                    "VALUES (?, ?, ?)", sql_params=(self.source, table, done),
+                    commit=False)
+                self.db.commit()
+                self.stats['imported'] += len(rows)
+                self.stats['skipped'] += len(chunk) - len(rows)
+        except database.SQLiteQueryError:
+            self.db.rollback()
+            raise
+        finally:
+            f.close()
+        info("imported '{0:s}' from {1:s}: {2:d} rows done".format(table,
+            self.dirname, done))
+
+    def run(self):
+        """Import every table.
+
+        Return a dictionary with the number of rows 'imported' and
+        'skipped', and the number of 'obsolete' foods (NDB_No not in the
+        current SR data) met.
+        """
+        if self.person_no is not None:
+            persons = self.export_persons()
+            if len(persons) > 1:
+                raise TransferError("Export in {0:s} holds the plans or " \
+                    "goals of {1:d} persons; only the data of one person " \
+                    "can be given to person {2:d}".format(self.dirname,
+                    len(persons), self.person_no))
+        self.create_tables()
+        self.load_references()
+        self.obsolete = set()
+        self.goal_persons = set()
+        self.failed = self.failed_recipes()
+        for table, columns in TABLES:
+            self.import_table(table, columns)
+        self.stats['obsolete'] = len(self.obsolete)
+        import engine
+        engine.forget_goals(self.goal_persons)
+        return self.stats
+
+def import_data(db, dirname, person_no=None):
+    """Import an export_data() directory into db, see Importer."""
+    return Importer(db, dirname, person_no).run()
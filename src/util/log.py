@@ -24,9 +24,19 @@ Then, for example, log.info('whatever').
 
 This also will log Python exceptions.
 
+With logQueue (init_logging keyword 'queue') records are only put on a
+queue by the calling thread. A listener thread writes them to the log file
+and console in batches, so logging never waits for disk I/O. Messages that
+are costly to build should still be guarded:
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(...)
 """
+import atexit
 import logging, logging.handlers as handlers
-from os import path
+import threading
+import Queue
+from os import path, makedirs
 from exception import AppException
 
 class LogLevelError(AppException): pass
@@ -112,8 +122,122 @@ def log_error_message(caller, levelspec):
     e = "Invalid logging level specification \"{0!r}\"".format(levelspec)
     raise LogLevelError(e)
 
+class QueueHandler(logging.Handler):
+    """Handler putting records on a queue for a QueueListener."""
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        """Make record safe to hand to another thread.
+
+        The message is merged with its arguments here since they may change
+        before the listener formats the record, and a traceback is
+        formatted while its frames still exist.
+        """
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+_exc_formatter = logging.Formatter()
+
+class QueueListener:
+    """Thread writing records from a queue to handlers.
+
+    All records waiting on the queue, up to BATCH of them, are written to a
+    handler together: one write, one flush and, for a RotatingFileHandler,
+    one rollover check per batch.
+    """
+    BATCH = 200
+
+    def __init__(self, queue, *handler_list):
+        self.queue = queue
+        self.handlers = handler_list
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='log listener')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        """Write the records still queued and end the thread."""
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            for handler in self.handlers:
+                self.write(handler, batch)
+            if done:
+                return
+
+    def write(self, handler, batch):
+        records = [r for r in batch
+                   if r.levelno >= handler.level and handler.filter(r)]
+        if not records:
+            return
+        if not isinstance(handler, logging.StreamHandler):
+            for record in records:
+                handler.handle(record)
+            return
+        handler.acquire()
+        try:
+            try:
+                lines = [handler.format(r) for r in records]
+                text = '\n'.join(lines) + '\n'
+                if isinstance(text, unicode):
+                    text = text.encode('utf-8')
+                if isinstance(handler, handlers.RotatingFileHandler):
+                    if handler.stream is None:
+                        handler.stream = handler._open()
+                    if handler.maxBytes > 0:
+                        handler.stream.seek(0, 2)
+                        if handler.stream.tell() + len(text) >= handler.maxBytes:
+                            handler.doRollover()
+                handler.stream.write(text)
+                handler.flush()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                handler.handleError(records[0])
+        finally:
+            handler.release()
+
+_listener = None
+
+def _stop_listener():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
 def initLogger(logFile='my.log', logLevel='warn', logMaxSize=50000,
-                             logRotate=5, logDisk=True, logConsole=False):
+                             logRotate=5, logDisk=True, logConsole=False,
+                             logQueue=False):
     """Initialize and return a logger object at given log level or warn by
     default.
 
@@ -126,8 +250,11 @@ def initLogger(logFile='my.log', logLevel='warn', logMaxSize=50000,
 
     Default behavior will be to log any message sent with a log level of equal to or
     greater that logging.WARNING.
+
+    If logQueue is True the disk and console handlers are run by a
+    QueueListener thread, stopped at exit after writing what is queued.
     """
-    global _LOG_MODULE
+    global _LOG_MODULE, _listener
     # Figure out what format was used to specify log level; convert to integer log level
     level = toLogLevel(logLevel)
     if level == -1:
@@ -141,6 +268,7 @@ def initLogger(logFile='my.log', logLevel='warn', logMaxSize=50000,
     if dname and not path.isdir(dname): makedirs(dname)
     logger = logging.getLogger(_LOG_MODULE)
     logger.setLevel(level)
+    handler_list = []
     if disk:
         # disk file log handler
         dfh = handlers.RotatingFileHandler(logFile,
@@ -150,14 +278,23 @@ def initLogger(logFile='my.log', logLevel='warn', logMaxSize=50000,
         fmt = "%(asctime)s:%(funcName)s():%(levelname)s: %(message)s"
         datefmt='%Y-%m-%d %H:%M:%S'
         dfh.setFormatter(logging.Formatter(fmt,datefmt))
-        logger.addHandler(dfh)
+        handler_list.append(dfh)
     if logConsole:
         # console logging handler
         clh = logging.StreamHandler()
         clh.setLevel(level)
         fmt = "%(funcName)s(): %(levelname)s: %(message)s"
         clh.setFormatter(logging.Formatter(fmt))
-        logger.addHandler(clh)
+        handler_list.append(clh)
+    if logQueue and handler_list:
+        _stop_listener()
+        queue = Queue.Queue()
+        _listener = QueueListener(queue, *handler_list)
+        _listener.start()
+        logger.addHandler(QueueHandler(queue))
+    else:
+        for h in handler_list:
+            logger.addHandler(h)
 
 def init_logging(logfile, **kwargs):
     """Initialize application logging facility.
@@ -171,10 +308,11 @@ def init_logging(logfile, **kwargs):
       'level'
       'maxsize'
       'rotate'
+      'queue'
     """
     from os.path import dirname, isdir
     from utility import fopen_mode_ok, limit_intrange
-    ld, ll, lr, lms, lc = True, 'warn', 3, 50000, False
+    ld, ll, lr, lms, lc, lq = True, 'warn', 3, 50000, False, False
     lf = logfile
     if not isdir(dirname(lf)):
         from os import mkdir
@@ -198,10 +336,13 @@ def init_logging(logfile, **kwargs):
             lms = limit_intrange(value, 0)
         elif keyword == 'rotate':
             lr = limit_intrange(value, 1, 10)
+        elif keyword == 'queue':
+            lq = bool(value)
     lf = logfile
 
     initLogger(logFile=lf, logLevel=ll, logMaxSize=lms,
-                                   logRotate=lr, logDisk=ld, logConsole=lc)
+                                   logRotate=lr, logDisk=ld, logConsole=lc,
+                                   logQueue=lq)
 
 def setLogLevel(loglevel):
     level = toLogLevel(loglevel)
@@ -211,3 +352,4 @@ def setLogLevel(loglevel):
     LOG.setLevel(level)
 
 LOG = logging.getLogger(_LOG_MODULE)
+atexit.register(_stop_listener)
@@ -0,0 +1,191 @@
+#  GNUtrition - a nutrition and diet analysis program.
+#  Copyright (C) 2012 Free Software Foundation, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of user actions.
+
+A span times a block of code and may contain other spans:
+
+    from util.trace import span, traced
+
+    with span('compute'):
+        ...
+
+    @traced('PlanComputeDlg.on_response')
+    def on_response(self, w, r, d=None):
+        ...
+
+When the outermost span of a thread ends its tree of timings is logged,
+at info level if it took at least slow_ms milliseconds and at debug level
+otherwise. The count, total and maximum time of every span name are kept
+in 'totals' and, with a report file set by configure(), written there by
+report() at exit.
+
+With a profile directory set by configure() each outermost span of the
+main thread also runs under cProfile, and the profile is written to that
+directory as NAME-YYYYmmdd-HHMMSS-PID-N.prof, N counting the profiles of
+the process (see the pstats module).
+"""
+import itertools
+import logging
+import threading
+import time
+from log import LOG as log
+debug = log.debug
+info = log.info
+warn = log.warn
+error = log.error
+critical = log.critical
+
+slow_ms = 200
+profile_dir = None
+report_fn = None
+
+# Numbers the profiles written, so two in the same second get their own file
+_profile_count = itertools.count(1)
+
+# span name -> [count, total ms, maximum ms]
+totals = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+def configure(slow=None, profile=None, report_file=None):
+    """Set the slow span limit in milliseconds, the profile directory and
+    the file the span totals are written to at exit.
+
+    A profile of None turns profiling off.
+    """
+    global slow_ms, profile_dir, report_fn
+    if slow is not None:
+        slow_ms = slow
+    profile_dir = profile
+    if report_file and not report_fn:
+        import atexit
+        atexit.register(dump)
+    report_fn = report_file
+
+class Span:
+    """A timed block of code. See span()."""
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+        self.start = self.ms = None
+        self.profiler = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            stack[-1].children.append(self)
+        elif profile_dir and threading.current_thread().name == 'MainThread':
+            import cProfile
+            self.profiler = cProfile.Profile()
+        stack.append(self)
+        if self.profiler:
+            self.profiler.enable()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.ms = (time.time() - self.start) * 1000.0
+        if self.profiler:
+            self.profiler.disable()
+        _local.stack.pop()
+        _lock.acquire()
+        try:
+            entry = totals.get(self.name)
+            if entry is None:
+                entry = totals[self.name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += self.ms
+            if self.ms > entry[2]:
+                entry[2] = self.ms
+        finally:
+            _lock.release()
+        if not _local.stack:
+            self.finish()
+        return False
+
+    def lines(self, depth=0):
+        """Return the timings of this span and its children as text lines."""
+        lines = ['{0:s}{1:s}: {2:.1f} ms'.format('  ' * depth, self.name,
+                                                 self.ms)]
+        for child in self.children:
+            lines.extend(child.lines(depth + 1))
+        return lines
+
+    def finish(self):
+        if self.ms >= slow_ms:
+            info('\n'.join(self.lines()))
+        elif log.isEnabledFor(logging.DEBUG):
+            debug('\n'.join(self.lines()))
+        if self.profiler:
+            self.save_profile()
+
+    def save_profile(self):
+        from os import path, makedirs
+        from os import getpid
+        fn = path.join(profile_dir, '{0:s}-{1:s}-{2:d}-{3:d}.prof'.format(
+            self.name, time.strftime('%Y%m%d-%H%M%S'), getpid(),
+            _profile_count.next()))
+        try:
+            if not path.isdir(profile_dir):
+                makedirs(profile_dir)
+            self.profiler.dump_stats(fn)
+        except (IOError, OSError), e:
+            error('Could not write profile {0:s}: {1!s}'.format(fn, e))
+        self.profiler = None
+
+def span(name):
+    """Return a context manager timing the enclosed block as 'name'."""
+    return Span(name)
+
+def traced(name):
+    """Decorator timing each call of a function as span 'name'."""
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            with Span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorate
+
+def report():
+    """Return the totals of every span name as text, most total time first."""
+    _lock.acquire()
+    try:
+        entries = sorted(totals.items(), key=lambda i: -i[1][1])
+    finally:
+        _lock.release()
+    lines = ['{0:>8s} {1:>10s} {2:>10s}  {3:s}'.format('count', 'total ms',
+                                                      'max ms', 'span')]
+    for name, (count, total, high) in entries:
+        lines.append('{0:8d} {1:10.1f} {2:10.1f}  {3:s}'.format(count, total,
+                                                              high, name))
+    return '\n'.join(lines)
+
+def dump(fn=None):
+    """Write report() to fn, by default the report file of configure()."""
+    fn = fn or report_fn
+    if not fn or not totals:
+        return
+    try:
+        f = open(fn, 'w')
+        f.write(report() + '\n')
+        f.close()
+    except IOError, e:
+        error('Could not write span totals: {0!s}'.format(e))
@@ -22,15 +22,35 @@ warn = log.warn
 error = log.error
 critical = log.critical
 
-def get_latest_version(url):
-    """Fetch latest version information posted at URL provided."""
-    import urllib
-    import re
+NO_VERSION = ('0.0', None, None, None, None)
+
+def get_latest_version(url, timeout=None):
+    """Fetch latest version information posted at URL provided.
+
+    Return a tuple (version, SR release, SR date, SR URL, message), or
+    NO_VERSION if the information could not be read within timeout
+    seconds (default gnutr_consts.CHECK_TIMEOUT).
+    """
+    import urllib2
+    import socket
+    import gnutr_consts
+    if timeout is None:
+        timeout = gnutr_consts.CHECK_TIMEOUT
     try:
-        obj = urllib.urlopen(url)
-    except IOError, e:
+        obj = urllib2.urlopen(url, timeout=timeout)
+        try:
+            text = obj.read()
+        finally:
+            obj.close()
+    except (IOError, socket.error), e:
+        # URLError and HTTPError are IOErrors; a timeout may be either
         error("{0!r}".format(e))
-        return "0.0" # Force update bypass
+        return NO_VERSION # Force update bypass
+    return parse_version_info(text)
+
+def parse_version_info(text):
+    """Return the version tuple of get_latest_version() found in text."""
+    import re
     reex = r"""
             "version"[\s+]?:   #   version":
             [\s+]?"            #  leading junk
@@ -53,11 +73,11 @@ def get_latest_version(url):
             (?P<message>.*\.)["]  # target match
             """
     reobj = re.compile(reex, re.X|re.M|re.S)
-    m = re.search(reobj, obj.read())
+    m = re.search(reobj, text)
     if m:
         return (m.group('VER'), m.group('SR'), m.group('DATE'),
                 m.group('SR_URL'), m.group('message'))
-    return ('0.0', None, None, None, None)
+    return NO_VERSION
 
 def cmp_version_strings(this_ver, curr_ver):
     s1 = this_ver.split('.')
@@ -87,60 +107,135 @@ def update_version(version, message=None):
         msg += '\n{0:s}'.format(message)
     gnutr.Dialog('notify', msg)
 
-def unpack(archive):
-    # HERE: unfinished
+def unpack(archive, dirname):
+    """Extract zip file archive into directory dirname.
+
+    Return the names extracted, or None if archive is not a zip file.
+    """
     from zipfile import is_zipfile, ZipFile
     if not is_zipfile(archive):
-        return False
-    ZipFile.extractall(archive)
+        error("{0:s} is not a zip archive".format(archive))
+        return None
+    zf = ZipFile(archive)
+    try:
+        zf.extractall(dirname)
+        return zf.namelist()
+    finally:
+        zf.close()
+
+def get_database_archive(url, dirname=None, timeout=None):
+    """Download the SR archive at url into directory dirname.
 
-def get_database_archive(url):
-    # HERE: Unfinished. Dropped working on automatic database update since it is
-    #       updated once per year and updating would present permission errors.
+    The archive is saved as the basename of url in dirname (default the
+    user's ~/.gnutrition), ready for sr_upgrade.upgrade(). Return the
+    file name, or None if the download failed. Only the download needs
+    the network; the upgrade works from the saved file.
+    """
+    import urllib2
+    import socket
     import gnutr_consts
-    from urllib2 import Request, urlopen, URLError, HTTPError
-    from os.path import basename, join
-    success = 0
-    tmp_file = join('/tmp/',basename(url))
-    req = Request(url)
+    from os import path, rename, remove
+    if dirname is None:
+        dirname = config.udir
+    if timeout is None:
+        timeout = gnutr_consts.CHECK_TIMEOUT
+    fn = path.join(dirname, path.basename(url))
+    part = fn + '.part'
     try:
-        f = urlopen(req)
-        # HERE: put the file in tmp?
-        local_file = open(tmp_file, "wb")
-        local_file.write(f.read())
-        local_file.close()
-    except HTTPError, e:
-        error("HTTP Error: {0!r} {1:s}".format(e.code, url))
-        success = 1
-    except URLError, e:
-        error("URL Error: {0!r} {1:s}".format(e.reason, url))
-        success = 1
-    return success
-
-def check_version():
-    import gnutr_consts
+        f = urllib2.urlopen(url, timeout=timeout)
+        try:
+            local_file = open(part, 'wb')
+            try:
+                while True:
+                    block = f.read(64 * 1024)
+                    if not block:
+                        break
+                    local_file.write(block)
+            finally:
+                local_file.close()
+        finally:
+            f.close()
+        rename(part, fn)
+    except (IOError, OSError, socket.error), e:
+        # URLError and HTTPError are IOErrors; a timeout may be either
+        error("Download of {0:s} failed: {1!r}".format(url, e))
+        if path.exists(part):
+            remove(part)
+        return None
+    return fn
+
+def idle_add(func, *args):
+    """Call func from the GLib main loop, or now if there is none."""
+    try:
+        from gobject import idle_add
+    except ImportError:
+        func(*args)
+        return
+    idle_add(func, *args)
+
+def notify_newer(result, notify=update_version):
+    """Call notify(version, message) if result, a tuple returned by
+    get_latest_version(), names a version newer than this one."""
     import install
+    (curr_ver, sr, date, sr_url, mesg) = result
     this_ver = install.gnutr_version()
-    if config.get_value('check_disabled') or not config.get_value('check_version'):
-        return 0
+    if this_ver != curr_ver and cmp_version_strings(this_ver, curr_ver):
+        notify(curr_ver, mesg)
+    return False    # Also removes the idle callback
+
+def version_checked(result, notify=update_version):
+    """Store the result of get_latest_version() and notify of a newer version.
+
+    Runs in the main thread, so config is only changed there.
+    """
     import time
+    (curr_ver, sr, date, sr_url, mesg) = result
+    config.set_key_value('last_check', time.time())
+    if curr_ver == NO_VERSION[0]:
+        return False
+    config.set_key_value('latest_version', result)
+    config.set_key_value('sr', sr)
+    config.set_key_value('sr_date', date)
+    config.set_key_value('sr_url', sr_url)
+    return notify_newer(result, notify)
+
+def check_version(url=None, timeout=None, notify=update_version):
+    """Check for a newer version in a background thread.
+
+    Nothing is done if checking is disabled. If the last check is more
+    recent than config 'check_interval' seconds, its result kept in config
+    'latest_version' is used without reading the network: notify(version,
+    message) is called through gobject.idle_add() if that version is newer
+    than this one. Otherwise the version file at url (default
+    gnutr_consts.LATEST_VERSION) is read by a daemon thread, which gives
+    up after timeout seconds. Its result is passed to version_checked()
+    the same way, which notifies as above.
+
+    Return the thread started, or None.
+    """
+    import gnutr_consts
+    import threading
+    import time
+    if config.get_value('check_disabled') or not config.get_value('check_version'):
+        return None
     interval = config.get_value('check_interval')
-    last_check = config.get_value('last_check')
-    time_now = time.time()
-    if (time_now - last_check > interval):
-        (curr_ver, sr, date, sr_url, mesg) = get_latest_version(gnutr_consts.LATEST_VERSION) 
-        config.set_key_value('sr', sr)
-        config.set_key_value('sr_date', date)
-        config.set_key_value('sr_url', sr_url)
-        update = False
-        if this_ver == curr_ver:
-            pass  # Nothing to do
-        else:
-            update = cmp_version_strings(this_ver,curr_ver)
-        if update:
-            update_version(curr_ver, mesg)
-    last_check = config.set_key_value('last_check',time_now)
-    return 1
+    last_check = config.get_value('last_check') or 0
+    if time.time() - last_check <= interval:
+        latest = config.get_value('latest_version')
+        if latest:
+            idle_add(notify_newer, tuple(latest), notify)
+        return None
+    if url is None:
+        url = gnutr_consts.LATEST_VERSION
+
+    def run():
+        result = get_latest_version(url, timeout)
+        idle_add(version_checked, result, notify)
+
+    thread = threading.Thread(target=run, name='version check')
+    thread.setDaemon(True)
+    thread.start()
+    return thread
 
 if __name__ == '__main__':
     def str_cmp_test():